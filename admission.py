@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+QuickUtil memory admission control
+Estimates how much memory an image will take once decoded (from its header
+alone) and reserves that amount against a shared byte budget before any
+pixels are decoded.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Bytes Pillow allocates per pixel for each mode; everything not listed is
+# stored in 32-bit pixels (RGB included)
+MODE_PIXEL_BYTES = {
+    '1': 1, 'L': 1, 'P': 1,
+    'I;16': 2, 'I;16L': 2, 'I;16B': 2, 'I;16N': 2,
+}
+
+
+class AdmissionError(Exception):
+    """Raised when a reservation cannot be granted"""
+
+    def __init__(self, message: str, nbytes: int):
+        super().__init__(message)
+        self.nbytes = nbytes
+
+
+def pixel_buffer_bytes(size: Tuple[int, int], mode: str) -> int:
+    """Bytes Pillow allocates for an image of this size and mode"""
+    width, height = size
+    return width * height * MODE_PIXEL_BYTES.get(mode, 4)
+
+
+def estimate_decoded_bytes(image: Image.Image) -> int:
+    """Decoded size of an opened (not yet loaded) image, from its header"""
+    return pixel_buffer_bytes(image.size, image.mode)
+
+
+class MemoryBudget:
+    """Byte budget that callers reserve against before decoding.
+
+    Reservations block (optionally with a timeout) until enough bytes have
+    been released; a reservation larger than the whole budget is refused
+    immediately since it could never be granted.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.in_use = 0
+        self._condition = threading.Condition()
+        self.counters = {'granted': 0, 'waited': 0, 'rejected': 0}
+
+    def fits(self, nbytes: int) -> bool:
+        """Whether a reservation of this size could ever be granted"""
+        return nbytes <= self.capacity
+
+    def reserve(self, nbytes: int, timeout: Optional[float] = None) -> bool:
+        """Reserve nbytes, waiting up to timeout seconds (None waits forever)"""
+        with self._condition:
+            if not self.fits(nbytes):
+                self.counters['rejected'] += 1
+                return False
+            if self.in_use + nbytes > self.capacity:
+                self.counters['waited'] += 1
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while self.in_use + nbytes > self.capacity:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self.counters['rejected'] += 1
+                        return False
+                    self._condition.wait(remaining)
+            self.in_use += nbytes
+            self.counters['granted'] += 1
+            return True
+
+    def release(self, nbytes: int) -> None:
+        """Return a reservation to the budget"""
+        with self._condition:
+            self.in_use = max(0, self.in_use - nbytes)
+            self._condition.notify_all()
+
+    @contextmanager
+    def reserved(self, nbytes: int, timeout: Optional[float] = None):
+        """Context manager around reserve()/release(); raises AdmissionError on refusal"""
+        if not self.reserve(nbytes, timeout):
+            raise AdmissionError(
+                f'Image needs {nbytes / (1024 * 1024):.0f}MB to decode, '
+                f'memory budget is {self.capacity / (1024 * 1024):.0f}MB', nbytes
+            )
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {**self.counters, 'capacity': self.capacity, 'in_use': self.in_use}
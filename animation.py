@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+QuickUtil animation streaming
+Re-encodes animated GIF, WebP and APNG input as animated GIF or WebP with one
+frame in flight at a time: each frame is composited by Pillow's decoder,
+converted to RGBA, resized and handed to the encoder before the next one is
+decoded, so memory is bounded by a few canvas-sized frames rather than the
+length of the animation.
+- WebP: frames are fed to libwebp's animation encoder as they are decoded; it
+  crops every frame to the rectangle that changed and merges identical
+  consecutive frames itself
+- GIF: written frame by frame with Pillow's GIF helpers. Identical
+  consecutive frames are merged by adding up their durations and every frame
+  after the first is cropped to the box that changed. One frame is held back
+  until the next distinct one arrives, since both the merge and the frame's
+  disposal method depend on its successor.
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+from PIL import GifImagePlugin, Image, ImageChops
+
+from encode_effort import EncodePolicy
+import resample
+
+logger = logging.getLogger(__name__)
+
+# Formats whose animations are decoded frame by frame
+ANIMATED_INPUTS = {'GIF', 'WEBP', 'PNG'}
+# Formats written as animations
+ANIMATED_FORMATS = {'GIF', 'WEBP'}
+# Canvas-sized RGBA frames alive at once (decoder canvas, held-back frame,
+# current frame and its resized copy), for memory admission
+FRAMES_IN_FLIGHT = 4
+# GIF has 1-bit transparency: alpha below this is transparent
+GIF_ALPHA_THRESHOLD = 128
+GIF_TRANSPARENT_LUT = [255] * GIF_ALPHA_THRESHOLD + [0] * (256 - GIF_ALPHA_THRESHOLD)
+# GIF disposal methods
+DO_NOT_DISPOSE = 1
+RESTORE_BACKGROUND = 2
+
+Frame = Tuple[Image.Image, int]
+Box = Tuple[int, int, int, int]
+
+
+@dataclass
+class AnimationStats:
+    """What encode_animation() did (frames_written is None when the encoder merges frames itself)"""
+    frames: int
+    frames_written: Optional[int]
+    size: Tuple[int, int]
+
+    def describe(self) -> str:
+        if self.frames_written is None or self.frames_written == self.frames:
+            return str(self.frames)
+        return f"{self.frames}->{self.frames_written}"
+
+
+def is_animated(image: Image.Image) -> bool:
+    return image.format in ANIMATED_INPUTS and getattr(image, 'is_animated', False)
+
+
+def frames(image: Image.Image, size: Optional[Tuple[int, int]] = None,
+           resize_quality: str = resample.DEFAULT_TIER) -> Iterator[Frame]:
+    """(RGBA frame, duration in ms) for each frame, decoded when it is asked for"""
+    for index in range(image.n_frames):
+        image.seek(index)
+        image.load()
+        # WebP sets the duration when the frame is loaded, GIF when it is seeked
+        duration = int(image.info.get('duration') or 0)
+        frame = image.convert('RGBA')
+        if size:
+            resized = resample.fit(frame, size, resize_quality)
+            if resized is not frame:
+                frame.close()
+                frame = resized
+        yield frame, duration
+
+
+def changed_box(previous: Image.Image, current: Image.Image) -> Optional[Box]:
+    """Bounding box of the pixels that differ in any band, None when identical"""
+    with ImageChops.difference(previous, current) as diff:
+        boxes = []
+        for band in diff.split():
+            with band:
+                box = band.getbbox()
+            if box:
+                boxes.append(box)
+    if not boxes:
+        return None
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+def transparent_mask(image: Image.Image) -> Image.Image:
+    """'L' mask, 255 where the frame is transparent once written as GIF"""
+    with image.getchannel('A') as alpha:
+        return alpha.point(GIF_TRANSPARENT_LUT)
+
+
+@dataclass
+class _Pending:
+    image: Image.Image
+    duration: int
+    box: Box
+    mask: Image.Image
+
+    def close(self) -> None:
+        self.image.close()
+        self.mask.close()
+
+
+class GifStreamWriter:
+    """Writes an animated GIF one frame at a time (see module docstring).
+
+    A frame is drawn over the previous one (disposal 'do not dispose') unless
+    it turns opaque pixels transparent; then the previous frame is written
+    whole with disposal 'restore to background' and the new frame is drawn on
+    a cleared canvas.
+    """
+
+    def __init__(self, output, loop: Optional[int] = None, dither: bool = True):
+        self.output = output
+        self.loop = loop
+        self.dither = Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE
+        self.frames = 0
+        self.frames_written = 0
+        self._pending: Optional[_Pending] = None
+        self._first_transparent = False
+
+    def add(self, image: Image.Image, duration: int) -> None:
+        """Take ownership of an RGBA frame"""
+        self.frames += 1
+        mask = transparent_mask(image)
+        pending = self._pending
+        if pending is None:
+            self._first_transparent = mask.getbbox() is not None
+            self._pending = _Pending(image, duration, (0, 0) + image.size, mask)
+            return
+        box = changed_box(pending.image, image)
+        if box is None:
+            pending.duration += duration
+            image.close()
+            mask.close()
+            return
+        with ImageChops.subtract(mask, pending.mask) as revealed:
+            clear = revealed.getbbox() is not None
+        self._flush(clear)
+        if clear:
+            with ImageChops.invert(mask) as opaque:
+                box = opaque.getbbox() or (0, 0, 1, 1)
+        self._pending = _Pending(image, duration, box, mask)
+
+    def close(self) -> None:
+        """Write the held-back frame and the trailer"""
+        if self._pending:
+            # Looping restarts on the last frame's canvas: clear it if the first frame has holes
+            self._flush(self._first_transparent)
+        self.output.write(b';')
+
+    def _flush(self, clear: bool) -> None:
+        pending, self._pending = self._pending, None
+        try:
+            box = (0, 0) + pending.image.size if clear else pending.box
+            self._write(pending.image, box, pending.duration, RESTORE_BACKGROUND if clear else DO_NOT_DISPOSE)
+        finally:
+            pending.close()
+
+    def _write(self, image: Image.Image, box: Box, duration: int, disposal: int) -> None:
+        with image.crop(box) as region, region.getchannel('A') as alpha:
+            holes = alpha.point(GIF_TRANSPARENT_LUT)
+            has_holes = holes.getbbox() is not None
+            with region.convert('RGB') as rgb:
+                frame = rgb.quantize(255 if has_holes else 256, dither=self.dither)
+        with frame, holes:
+            params = {'duration': duration, 'disposal': disposal, 'include_color_table': True}
+            if has_holes:
+                # Reserve the last palette entry for transparency
+                palette = frame.getpalette()
+                frame.putpalette(palette + [0] * (768 - len(palette)))
+                frame.paste(255, mask=holes)
+                params['transparency'] = 255
+            if self.frames_written == 0:
+                info = {'duration': duration}
+                if self.loop is not None:
+                    info['loop'] = self.loop
+                header, _ = GifImagePlugin.getheader(frame, info=info)
+                self.output.write(b''.join(header))
+            for chunk in GifImagePlugin.getdata(frame, offset=box[:2], **params):
+                self.output.write(chunk)
+        self.frames_written += 1
+
+
+class _FrameSource:
+    """Stands in for a multi-frame image in append_images: Pillow's WebP
+    writer seeks it frame by frame and each seek pulls the next frame from
+    the stream. The duration of each pulled frame is appended to the list
+    passed as `duration`, which the writer reads after adding the frame."""
+    mode = 'RGBA'
+
+    def __init__(self, stream: Iterator[Frame], n_frames: int, durations: List[int]):
+        self.n_frames = n_frames
+        self._stream = stream
+        self._durations = durations
+        self._frame: Optional[Image.Image] = None
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self._frame.size
+
+    def seek(self, index: int) -> None:
+        self.close()
+        self._frame, duration = next(self._stream)
+        self._durations.append(duration)
+
+    def load(self) -> None:
+        pass
+
+    def tobytes(self, *args) -> bytes:
+        return self._frame.tobytes(*args)
+
+    def close(self) -> None:
+        if self._frame:
+            self._frame.close()
+            self._frame = None
+
+
+def encode_animation(image: Image.Image, format: str, output, quality: int = 85,
+                     policy: Optional[EncodePolicy] = None, size: Optional[Tuple[int, int]] = None,
+                     resize_quality: str = resample.DEFAULT_TIER) -> AnimationStats:
+    """Write every frame of an animated image to `output` as an animated
+    `format` ('GIF' or 'WEBP'), resized to `size` when given"""
+    format = format.upper()
+    if format not in ANIMATED_FORMATS:
+        raise ValueError(f"Cannot write animated {format}")
+    policy = policy or EncodePolicy()
+    size = tuple(size or image.size)
+    total = image.n_frames
+    loop = image.info.get('loop')
+    _, settings = policy.settings(format, size)
+    stream = frames(image, size, resize_quality)
+
+    if format == 'GIF':
+        writer = GifStreamWriter(output, loop, policy.dither)
+        for frame, duration in stream:
+            writer.add(frame, duration)
+        writer.close()
+        stats = AnimationStats(writer.frames, writer.frames_written, size)
+    else:
+        first, duration = next(stream)
+        durations = [duration]
+        rest = _FrameSource(stream, total - 1, durations)
+        try:
+            first.save(
+                output, format='WEBP', save_all=True, append_images=[rest], duration=durations,
+                # No loop extension means play once
+                loop=1 if loop is None else loop, background=(0, 0, 0, 0), quality=quality, **settings
+            )
+        finally:
+            rest.close()
+            first.close()
+        stats = AnimationStats(total, None, size)
+    logger.info(f"🎞️ Animated {format}: {stats.describe()} frames at {size[0]}x{size[1]}")
+    return stats
@@ -6,40 +6,111 @@ Supports: Compression, Format Conversion, HEIC, Resize, Crop, Rotate, Filters, B
 """
 
 import os
-import uuid
 import tempfile
 import logging
-import gc
 from datetime import datetime
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Request, Response, after_this_request, g, request, jsonify, send_file, stream_with_context
+from werkzeug.datastructures import FileStorage
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image
 import io
-import threading
-import time
+import json
+import math
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
 
-# HEIC support
-try:
-    from PIL import Image
-    import pillow_heif
-    pillow_heif.register_heif_opener()
-    HEIC_SUPPORT = True
-    print("✅ HEIC support enabled (pillow-heif)")
-except ImportError:
-    HEIC_SUPPORT = False
-    print("❌ HEIC support disabled (pillow-heif not available)")
+from admission import AdmissionError, MemoryBudget, pixel_buffer_bytes
+from artifact_store import Sweeper
+from encode_effort import OFFLINE_EFFORT, cost_model, policy_from_form, timed_save
+from format_select import (DEFAULT_CANDIDATES, DEFAULT_MIN_PSNR, LOSSLESS_FORMATS, classify,
+                           encoded_psnr, quality_proxy, shortlist)
+from image_decode import decode_for_bounds, fit_within, plan_decode
+from image_probe import ProbeError, ProbingFile, check_accepted, probe_stream
+import animation
+import jpeg_lossless
+import metrics
+from pipeline import Pipeline, PipelineError, parse_operations
+import resample
+from jobs import DONE, FINISHED_STATES, JobQueue, JobWorkerPool
+from originals import OriginalStore, parse_digest, parse_file_size
+from result_cache import ResultCache, hash_stream
+from png_engine import encode_png
+from size_search import fit_to_size, parse_size
+from variants import MAX_FORMATS, build_pyramid, parse_widths, pyramid_pixels, srcset, variant_sizes
+from zip_stream import ZipStreamWriter
 
-# Flask app configuration
-app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB limit
-CORS(app)
+import warmup
+
+# HEIC support
+HEIC_SUPPORT = warmup.register_heif()
 
 # Constants
 MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB
 UPLOAD_FOLDER = os.path.join(tempfile.gettempdir(), 'quickutil_uploads')
 PROCESSED_FOLDER = os.path.join(tempfile.gettempdir(), 'quickutil_processed')
 SUPPORTED_FORMATS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'tiff', 'heic', 'heif'}
+# Pillow format names accepted by the header probe
+INPUT_FORMATS = {'JPEG', 'MPO', 'PNG', 'GIF', 'BMP', 'WEBP', 'TIFF', 'HEIF'}
+LOSSY_FORMATS = {'JPEG', 'WEBP', 'HEIF'}
+OUTPUT_FORMATS = ['png', 'jpeg', 'jpg', 'webp', 'gif', 'bmp', 'tiff', 'heic', 'heif']
+# CRITICAL: Format mapping for processing
+FORMAT_MAPPING = {
+    'jpeg': 'JPEG',
+    'jpg': 'JPEG',
+    'png': 'PNG',
+    'webp': 'WEBP',
+    'gif': 'GIF',
+    'bmp': 'BMP',
+    'tiff': 'TIFF',
+    'heic': 'HEIF',  # HEIC maps to HEIF for pillow-heif
+    'heif': 'HEIF'
+}
+# format=auto picks among these (override per request with auto_formats)
+AUTO_FORMAT = 'auto'
+AUTO_CANDIDATES = [f.strip().lower() for f in os.environ.get('AUTO_FORMATS', ','.join(DEFAULT_CANDIDATES)).split(',') if f.strip()]
+# format=auto on animated input keeps the animation in the first of these that is a candidate
+AUTO_ANIMATED_FORMATS = ['webp', 'gif']
+# Threads encoding responsive variants (Pillow encoders release the GIL)
+ENCODE_WORKERS = int(os.environ.get('ENCODE_WORKERS', min(4, os.cpu_count() or 1)))
+# Threads filtering bands of large images (see tile_filters)
+FILTER_WORKERS = int(os.environ.get('FILTER_WORKERS', os.cpu_count() or 1))
+# Background jobs: local worker threads per process
+JOB_OPERATIONS = {'compress', 'convert', 'heic-convert'}
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 1))
+# Uploads stay in memory up to this size and only spill to UPLOAD_FOLDER above it
+SPOOL_MAX_MEMORY = int(os.environ.get('SPOOL_MAX_MEMORY_MB', 16)) * 1024 * 1024
+# Decoded-pixel memory this worker may hold at once; requests reserve their
+# share from the image header before decoding and wait when it is used up.
+# The default fits one full 64 MP decode, so phone photos (48 MP) only ever
+# queue; only images larger than the whole budget are turned away.
+DECODE_MEMORY_BUDGET = int(os.environ.get('DECODE_MEMORY_MB', 512)) * 1024 * 1024
+ADMISSION_TIMEOUT = float(os.environ.get('ADMISSION_TIMEOUT', 10))  # seconds
+# Decoded image plus one full-size copy (mode conversion, resize) at a time
+DECODE_WORKING_SET_FACTOR = 2
+# Decompression bomb limit, independent of the budget (which only limits how
+# much decodes at once): Pillow's default unless MAX_IMAGE_MP is set. Pillow
+# warns above it and refuses at twice it.
+if os.environ.get('MAX_IMAGE_MP'):
+    Image.MAX_IMAGE_PIXELS = int(float(os.environ['MAX_IMAGE_MP']) * 1_000_000)
+
+class SpoolingRequest(Request):
+    """Request that keeps uploaded files in memory until SPOOL_MAX_MEMORY.
+
+    Each file's header is probed as it arrives (see check_probe); a rejected
+    upload stops being stored, and /inspect never stores anything.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY, dir=UPLOAD_FOLDER)
+        if self.endpoint == 'inspect':
+            return ProbingFile(spool, keep=False)
+        return ProbingFile(spool, check=check_probe)
+
+# Flask app configuration
+app = Flask(__name__)
+app.request_class = SpoolingRequest
+app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB limit
+CORS(app)
 
 # Create directories
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -51,39 +122,100 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+if HEIC_SUPPORT:
+    logger.info("✅ HEIC support enabled (pillow-heif)")
+else:
+    logger.warning("❌ HEIC support disabled (pillow-heif not available)")
 
-# Background cleanup thread
-def cleanup_files():
-    """Clean up old files every 10 minutes"""
-    while True:
-        try:
-            now = time.time()
-            for folder in [UPLOAD_FOLDER, PROCESSED_FOLDER]:
-                for filename in os.listdir(folder):
-                    file_path = os.path.join(folder, filename)
-                    if os.path.isfile(file_path):
-                        file_age = now - os.path.getmtime(file_path)
-                        if file_age > 600:  # 10 minutes
-                            os.remove(file_path)
-                            logger.info(f"Cleaned up: {filename}")
-        except Exception as e:
-            logger.error(f"Cleanup error: {e}")
-        
-        time.sleep(600)  # Run every 10 minutes
+# Processed results live in a content-addressed cache instead of one-off files
+result_cache = ResultCache(PROCESSED_FOLDER)
+
+# Memory admission for decodes in this worker
+decode_budget = MemoryBudget(DECODE_MEMORY_BUDGET)
+
+# Per-stage latency and memory histograms, served on /metrics
+request_metrics = metrics.install(app, gauges={
+    'quickutil_decode_budget_bytes': lambda: decode_budget.capacity,
+    'quickutil_decode_budget_in_use_bytes': lambda: decode_budget.in_use
+})
+
+# Queue for slow conversions, shared by all workers
+job_queue = JobQueue()
 
-# Start cleanup thread
-cleanup_thread = threading.Thread(target=cleanup_files, daemon=True)
-cleanup_thread.start()
+# Originals kept for /uploads/preflight, so repeat requests need no upload
+originals = OriginalStore()
+
+# Expires cached results, kept originals and finished jobs; one process sweeps
+# at a time (the originals and job tasks under their own lease, since
+# image_compression_api shares the result cache and its sweeper lease).
+# Spilled uploads need no sweep: they are unlinked temporary files.
+sweeper = Sweeper(
+    result_cache.store, result_cache.sweep_disk,
+    tasks=[originals.sweep, job_queue.purge_expired], stores=[originals.store]
+)
+
+encode_executor = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix='encode')
+filter_executor = ThreadPoolExecutor(max_workers=FILTER_WORKERS, thread_name_prefix='filter')
 
 # Helper functions
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in SUPPORTED_FORMATS
 
+def check_probe(probe):
+    """Reject inputs that could never be processed, from their header alone"""
+    check_accepted(probe, INPUT_FORMATS if HEIC_SUPPORT else INPUT_FORMATS - {'HEIF'})
+
+def upload_probe(file, check=True):
+    """Header probe of an uploaded file; raises ProbeError when rejected"""
+    if isinstance(file.stream, ProbingFile):
+        probe = file.stream.result()
+    else:
+        probe = probe_stream(file.stream)
+        file.stream.seek(0)
+    if check:
+        check_probe(probe)
+    return probe
+
+def output_pixels(probe, max_width=None, max_height=None):
+    """Pixels of the encoded output, from an upload's header probe (0 when unknown)"""
+    if not probe.size:
+        return 0
+    width, height = fit_within(probe.size, max_width, max_height)
+    return width * height
+
+def probe_error_response(error):
+    return jsonify({'error': str(error)}), error.status
+
 def get_file_format(filename):
     return filename.rsplit('.', 1)[1].lower() if '.' in filename else None
 
-def process_image_with_quality(image, format='JPEG', quality=85):
-    """Process image with specified quality and format - MEMORY OPTIMIZED"""
+def admit_decode(image, decoded_size=None, timeout=ADMISSION_TIMEOUT, peak_pixels=0):
+    """Reserve the memory an opened (not yet loaded) image needs to decode.
+
+    `peak_pixels` covers later stages that grow the image (upscale, rotate).
+    Raises AdmissionError when the budget cannot be granted in time.
+    """
+    decoded = pixel_buffer_bytes(decoded_size or image.size, image.mode)
+    nbytes = max(decoded, peak_pixels * 4) * DECODE_WORKING_SET_FACTOR
+    return decode_budget.reserved(nbytes, timeout=timeout)
+
+def admission_error_response(error):
+    """413 for images that can never fit the decode budget, 503 while it is just busy"""
+    if isinstance(error, AdmissionError) and decode_budget.fits(error.nbytes):
+        logger.warning(f"⏳ Decode budget busy, rejecting after {ADMISSION_TIMEOUT:g}s: {error}")
+        response = jsonify({'error': 'Server is busy processing other images, please retry shortly'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(max(1, int(ADMISSION_TIMEOUT)))
+        return response
+    logger.warning(f"🚫 Image rejected by admission control: {error}")
+    return jsonify({'error': f'Image too large for processing: {error}'}), 413
+
+def process_image_with_quality(image, format='JPEG', quality=85, effort=None):
+    """Process image with specified quality and format - MEMORY OPTIMIZED
+
+    `effort` is an EncodePolicy choosing the encoder settings (default tier
+    when omitted).
+    """
     output = io.BytesIO()
     original_image = image
     background = None
@@ -91,33 +223,44 @@ def process_image_with_quality(image, format='JPEG', quality=85):
     try:
         if format.upper() == 'JPEG':
             # Convert RGBA to RGB for JPEG
-            if image.mode in ('RGBA', 'LA', 'P'):
-                background = Image.new('RGB', image.size, (255, 255, 255))
-                background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-                image = background
-            image.save(output, format='JPEG', quality=quality, optimize=True)
+            with metrics.stage('convert'):
+                if image.mode in ('RGBA', 'LA', 'P'):
+                    background = Image.new('RGB', image.size, (255, 255, 255))
+                    background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
+                    image = background
+            with metrics.stage('encode'):
+                timed_save(image, output, 'JPEG', effort, quality=quality)
             
         elif format.upper() == 'WEBP':
-            image.save(output, format='WEBP', quality=quality, optimize=True)
+            with metrics.stage('encode'):
+                timed_save(image, output, 'WEBP', effort, quality=quality)
             
         elif format.upper() in ['HEIC', 'HEIF']:
             # HEIC/HEIF output support with pillow-heif - MEMORY OPTIMIZED
             if HEIC_SUPPORT:
                 # Convert RGBA to RGB for HEIC if necessary
-                if image.mode in ('RGBA', 'LA', 'P'):
-                    background = Image.new('RGB', image.size, (255, 255, 255))
-                    background.paste(image, mask=image.split()[-1] if image.mode in ('RGBA', 'LA') else None)
-                    image = background
-                image.save(output, format='HEIF', quality=quality, optimize=True)
+                with metrics.stage('convert'):
+                    if image.mode in ('RGBA', 'LA', 'P'):
+                        background = Image.new('RGB', image.size, (255, 255, 255))
+                        background.paste(image, mask=image.split()[-1] if image.mode in ('RGBA', 'LA') else None)
+                        image = background
+                with metrics.stage('encode'):
+                    timed_save(image, output, 'HEIF', effort, quality=quality)
             else:
                 # Fallback to JPEG if HEIC not supported
-                if image.mode in ('RGBA', 'LA', 'P'):
-                    background = Image.new('RGB', image.size, (255, 255, 255))
-                    background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-                    image = background
-                image.save(output, format='JPEG', quality=quality, optimize=True)
+                with metrics.stage('convert'):
+                    if image.mode in ('RGBA', 'LA', 'P'):
+                        background = Image.new('RGB', image.size, (255, 255, 255))
+                        background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
+                        image = background
+                with metrics.stage('encode'):
+                    timed_save(image, output, 'JPEG', effort, quality=quality)
+        elif format.upper() == 'PNG':
+            with metrics.stage('encode'):
+                encode_png(image, output, effort)
         else:
-            image.save(output, format=format.upper(), optimize=True)
+            with metrics.stage('encode'):
+                timed_save(image, output, format.upper(), effort)
         
         output.seek(0)
         return output
@@ -133,26 +276,430 @@ def process_image_with_quality(image, format='JPEG', quality=85):
                 background.close()
                 del background
             # Don't close original_image as it might be used elsewhere
-            # Force garbage collection for HEIC memory cleanup
-            gc.collect()
             logger.info(f"🧹 Memory cleanup completed for format: {format}")
         except Exception as cleanup_error:
             logger.warning(f"⚠️ Memory cleanup warning: {cleanup_error}")
 
-def save_file_temporarily(file):
-    """Save uploaded file to temporary location and return path"""
-    temp_filename = f"{uuid.uuid4()}_{secure_filename(file.filename)}"
-    temp_path = os.path.join(UPLOAD_FOLDER, temp_filename)
-    file.save(temp_path)
-    return temp_path
+def animated_output(image, processing_format):
+    """Whether an opened image is re-encoded frame by frame instead of as its first frame"""
+    return animation.is_animated(image) and processing_format.upper() in animation.ANIMATED_FORMATS
+
+def admit_animation(image, timeout=ADMISSION_TIMEOUT):
+    """admit_decode() for the few canvas-sized frames an animation keeps in flight"""
+    return admit_decode(image, timeout=timeout, peak_pixels=animation.FRAMES_IN_FLIGHT * image.width * image.height)
+
+def process_animation(image, format, quality, effort=None, size=None, resize_quality=resample.DEFAULT_TIER):
+    """Re-encode every frame of an animated image as an animated GIF or WebP.
+
+    Frames are decoded, resized to `size` and encoded one at a time (see
+    animation). Returns the buffer and the AnimationStats.
+    """
+    output = io.BytesIO()
+    with metrics.stage('encode'):
+        stats = animation.encode_animation(image, format, output, quality, effort, size, resize_quality)
+    output.seek(0)
+    return output, stats
+
+def encode_auto(image, quality, effort=None, candidates=None, min_psnr=DEFAULT_MIN_PSNR):
+    """Encode the formats shortlisted for the content concurrently and keep
+    the smallest result whose PSNR against the source meets `min_psnr`.
+
+    Returns the buffer, the chosen output format ('webp', 'png'...) and a
+    short description of the trial for logs and headers.
+    """
+    candidates = candidates or AUTO_CANDIDATES
+    with metrics.stage('classify'):
+        profile = classify(image)
+        reference = quality_proxy(image)
+    formats = shortlist(profile, candidates)
+    
+    def trial(formats):
+        # save() keeps per-call state on the image object (see encode_formats),
+        # so each concurrent encode after the first gets its own copy
+        copies = [image.copy() for _ in formats[1:]]
+        try:
+            futures = [
+                encode_executor.submit(metrics.propagate(process_image_with_quality), view, FORMAT_MAPPING[fmt], quality, effort)
+                for fmt, view in zip(formats, [image] + copies)
+            ]
+            wait(futures)
+        finally:
+            for copy in copies:
+                copy.close()
+        trials = []
+        for fmt, future in zip(formats, futures):
+            buffer = future.result()
+            with metrics.stage('classify'):
+                score = math.inf if fmt in LOSSLESS_FORMATS else encoded_psnr(buffer, reference)
+            trials.append((fmt, buffer, score))
+        return trials
+    
+    trials = trial(formats)
+    passing = [t for t in trials if t[2] >= min_psnr]
+    if not passing:
+        # Nothing lossy looks good enough: lossless if allowed, else the closest match
+        lossless = [fmt for fmt in candidates if fmt in LOSSLESS_FORMATS and fmt not in formats]
+        passing = trial(lossless[:1]) if lossless else [max(trials, key=lambda t: t[2])]
+    fmt, buffer, score = min(passing, key=lambda t: t[1].getbuffer().nbytes)
+    sizes = ','.join(f"{f}={b.getbuffer().nbytes}" for f, b, _ in trials)
+    description = f"{profile.describe()} -> {fmt} [{sizes}]"
+    logger.info(f"🤖 Auto format: {description}")
+    return buffer, fmt, description
+
+def auto_animated_format(image, candidates=None):
+    """format=auto output for an opened image that keeps its animation: the
+    first of AUTO_ANIMATED_FORMATS among the candidates, None for still
+    images or when no candidate can animate (then only the first frame is used)"""
+    if not animation.is_animated(image):
+        return None
+    candidates = candidates or AUTO_CANDIDATES
+    return next((fmt for fmt in AUTO_ANIMATED_FORMATS if fmt in candidates), None)
 
-def cleanup_temp_file(file_path):
-    """Clean up temporary file"""
+def parse_auto_formats(value):
+    """Candidate list for format=auto from a comma-separated field"""
+    if value is None or str(value).strip() == '':
+        return AUTO_CANDIDATES
+    formats = list(dict.fromkeys(f.strip().lower() for f in str(value).split(',') if f.strip()))
+    unsupported = [f for f in formats if f not in OUTPUT_FORMATS]
+    if not formats or unsupported:
+        raise ValueError(f"Invalid auto_formats: {value}")
+    return formats
+
+def compress_stream(stream, processing_format, quality, max_width=None, max_height=None,
+                    target_size=None, progress=None, admission_timeout=ADMISSION_TIMEOUT,
+                    resize_quality=resample.DEFAULT_TIER, effort=None, auto_formats=None):
+    """Decode, optionally downscale and encode an image stream.
+
+    Returns the encoded buffer and a metadata dict (dimensions, decode path,
+    quality used and target-size search stats). `progress(fraction)` is called
+    between stages when given. `resize_quality` is a resample tier and
+    `effort` an EncodePolicy. With processing_format 'auto' the output format
+    is chosen by encode_auto() among `auto_formats` and reported as
+    info['output_format']. Raises AdmissionError if the decode does not fit
+    the worker's memory budget within `admission_timeout` seconds.
+    """
+    image = None
+    info = {
+        'original_dimensions': 'unknown',
+        'final_dimensions': 'unknown',
+        'decode_path': 'full',
+        'quality': quality,
+        'target_iterations': 0,
+        'target_time_ms': 0.0,
+        'output_format': processing_format.lower()
+    }
     try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-    except Exception as e:
-        logger.warning(f"Failed to cleanup temp file {file_path}: {e}")
+        with metrics.stage('probe'):
+            image = Image.open(stream)
+            plan = plan_decode(image, max_width, max_height)
+        metrics.set_labels(input_format=image.format, output_format=processing_format)
+        info['original_dimensions'] = f"{image.width}x{image.height}"
+        
+        # Log image dimensions for memory estimation
+        logger.info(f"🖼️ Image dimensions: {image.width}x{image.height}, Mode: {image.mode}")
+        if progress:
+            progress(0.1)
+        
+        if processing_format == AUTO_FORMAT and not target_size:
+            animated_format = auto_animated_format(image, auto_formats)
+            if animated_format:
+                processing_format = FORMAT_MAPPING[animated_format]
+                info.update(output_format=animated_format, auto_format=f"animated -> {animated_format}")
+                metrics.set_labels(output_format=processing_format)
+        
+        if animated_output(image, processing_format) and not target_size:
+            # Keep every frame; they stream through resize and encode one at a time
+            size = fit_within(image.size, max_width, max_height)
+            with admit_animation(image, timeout=admission_timeout):
+                compressed_data, stats = process_animation(image, processing_format, quality, effort, size, resize_quality)
+            info.update(final_dimensions=f"{size[0]}x{size[1]}", decode_path='frames', frames=stats.describe())
+            if progress:
+                progress(0.9)
+            return compressed_data, info
+        
+        # Reserve memory for the buffer the chosen decode path will allocate
+        with admit_decode(image, plan.decoded_size, timeout=admission_timeout):
+            # Decode at reduced scale when the output is much smaller
+            with metrics.stage('decode'):
+                image, info['decode_path'] = decode_for_bounds(image, max_width, max_height, plan=plan)
+            
+            # Resize if dimensions specified
+            if max_width or max_height:
+                with metrics.stage('resize'):
+                    resized = resample.fit(image, fit_within(image.size, max_width, max_height), resize_quality)
+                if resized is not image:
+                    image.close()
+                    image = resized
+                logger.info(f"🔄 Resized to: {image.width}x{image.height}")
+            if progress:
+                progress(0.5)
+            
+            # Compress image with mapped format
+            info['final_dimensions'] = f"{image.width}x{image.height}"
+            compressed_data = None
+            if processing_format == AUTO_FORMAT:
+                compressed_data, info['output_format'], info['auto_format'] = encode_auto(
+                    image, quality, effort, auto_formats
+                )
+                processing_format = FORMAT_MAPPING[info['output_format']]
+                metrics.set_labels(output_format=processing_format)
+            if target_size:
+                # Highest quality (up to the requested one) that fits the target size
+                search = fit_to_size(
+                    image,
+                    lambda img, q: process_image_with_quality(img, processing_format, q, effort),
+                    target_size,
+                    max_quality=quality,
+                    lossy=processing_format in LOSSY_FORMATS
+                )
+                compressed_data = search.data
+                info['quality'] = search.quality
+                info['final_dimensions'] = f"{search.size[0]}x{search.size[1]}"
+                info['target_iterations'] = search.full_encodes
+                info['target_time_ms'] = search.elapsed_ms
+            elif compressed_data is None:
+                compressed_data = process_image_with_quality(image, processing_format, quality, effort)
+            # Drop the pixels before the reservation is handed back
+            image.close()
+        if progress:
+            progress(0.9)
+        
+        return compressed_data, info
+    
+    finally:
+        # 🧹 MEMORY CLEANUP: closing frees the pixel buffer right away
+        if image:
+            try:
+                image.close()
+                logger.info("🧹 Image memory cleaned up")
+            except Exception as cleanup_err:
+                logger.warning(f"⚠️ Image cleanup warning: {cleanup_err}")
+
+def process_stream(stream, operations, processing_format, quality, resize_quality=resample.DEFAULT_TIER,
+                   effort=None):
+    """Decode once, run an operation pipeline and encode once.
+
+    Returns the encoded buffer and a metadata dict (dimensions, decode path
+    and the fused steps that ran). Raises PipelineError for operations that
+    do not fit the image and AdmissionError like compress_stream().
+    """
+    image = None
+    try:
+        with metrics.stage('probe'):
+            image = Image.open(stream)
+            pipeline = Pipeline(operations, image.size, resize_quality)
+            # Fused geometry may allow a reduced-scale decode
+            max_width, max_height = pipeline.decode_bounds()
+            plan = plan_decode(image, max_width, max_height)
+        metrics.set_labels(input_format=image.format, output_format=processing_format)
+        info = {
+            'original_dimensions': f"{image.width}x{image.height}",
+            'final_dimensions': 'unknown',
+            'decode_path': 'full',
+            'steps': pipeline.describe()
+        }
+        logger.info(f"🛠️ Pipeline for {image.width}x{image.height} {image.format}: {info['steps']}")
+        
+        with admit_decode(image, plan.decoded_size, peak_pixels=pipeline.peak_pixels):
+            with metrics.stage('decode'):
+                image, info['decode_path'] = decode_for_bounds(image, max_width, max_height, plan=plan)
+            image = pipeline.apply(image, stage=metrics.stage, executor=filter_executor)
+            info['final_dimensions'] = f"{image.width}x{image.height}"
+            processed_data = process_image_with_quality(image, processing_format, quality, effort)
+            # Drop the pixels before the reservation is handed back
+            image.close()
+        return processed_data, info
+    
+    finally:
+        if image:
+            image.close()
+
+def encode_formats(image, formats, quality, effort=None):
+    """Encode one image in several formats, one after the other.
+
+    Image.save() stores per-call state on the image object, so the formats of
+    one image are not encoded concurrently.
+    """
+    return [process_image_with_quality(image, FORMAT_MAPPING[fmt], quality, effort) for fmt in formats]
+
+def variants_stream(stream, widths, formats, quality, resize_quality=resample.DEFAULT_TIER, effort=None):
+    """Decode once, build the downscale pyramid and encode every width/format pair.
+
+    A level's encodes run on encode_executor while the next, narrower level
+    is resampled from it. Returns [(size, format, buffer)] widest first and a
+    metadata dict; raises AdmissionError like compress_stream().
+    """
+    image = None
+    levels = []
+    futures = []
+    try:
+        with metrics.stage('probe'):
+            image = Image.open(stream)
+            sizes = variant_sizes(image.size, widths)
+            plan = plan_decode(image, sizes[0][0])
+        metrics.set_labels(input_format=image.format, output_format=FORMAT_MAPPING[formats[0]])
+        info = {
+            'original_dimensions': f"{image.width}x{image.height}",
+            'decode_path': 'full'
+        }
+        logger.info(f"🪜 Variants for {image.width}x{image.height} {image.format}: "
+                    f"{[size[0] for size in sizes]} x {formats}")
+        
+        with admit_decode(image, plan.decoded_size, peak_pixels=pyramid_pixels(sizes)):
+            with metrics.stage('decode'):
+                image, info['decode_path'] = decode_for_bounds(image, sizes[0][0], plan=plan)
+            for size, level in build_pyramid(image, sizes, resize_quality, stage=metrics.stage):
+                levels.append(level)
+                futures.append(encode_executor.submit(
+                    metrics.propagate(encode_formats), level, formats, quality, effort
+                ))
+            wait(futures)
+            results = [
+                (size, fmt, buffer)
+                for size, future in zip(sizes, futures)
+                for fmt, buffer in zip(formats, future.result())
+            ]
+        return results, info
+    
+    finally:
+        # Encodes still running read the levels; let them finish first
+        wait(futures)
+        for level in levels:
+            if level is not image:
+                level.close()
+        if image:
+            image.close()
+
+def run_job(job, source, progress):
+    """Run a queued background job; returns (data, mimetype, download_name)"""
+    params = job['params']
+    base_name = job['filename'].rsplit('.', 1)[0]
+    target_format = params['format']
+    effort = policy_from_form(params, default=OFFLINE_EFFORT, allow_deadline=False)
+    
+    with request_metrics.track(f"job_{job['operation']}"):
+        if job['operation'] in ('compress', 'heic-convert'):
+            compressed_data, info = compress_stream(
+                source, FORMAT_MAPPING.get(target_format, AUTO_FORMAT), params['quality'],
+                params.get('max_width'), params.get('max_height'), params.get('target_size'),
+                progress=progress, admission_timeout=None,
+                resize_quality=params.get('resize_quality', resample.DEFAULT_TIER), effort=effort
+            )
+            if target_format == AUTO_FORMAT:
+                target_format = info['output_format']
+            prefix = 'compressed' if job['operation'] == 'compress' else 'converted'
+            return compressed_data.getvalue(), f'image/{target_format}', f"{prefix}_{base_name}.{target_format}"
+        
+        # convert; background jobs wait for memory instead of failing
+        with metrics.stage('probe'):
+            image = Image.open(source)
+        metrics.set_labels(input_format=image.format, output_format=FORMAT_MAPPING[target_format])
+        if animated_output(image, FORMAT_MAPPING[target_format]):
+            with image, admit_animation(image, timeout=None):
+                progress(0.1)
+                converted_data, _ = process_animation(image, FORMAT_MAPPING[target_format], params['quality'], effort)
+            progress(0.9)
+            return converted_data.getvalue(), f'image/{target_format}', f"converted_{base_name}.{target_format}"
+        with image, admit_decode(image, timeout=None):
+            progress(0.1)
+            with metrics.stage('decode'):
+                image.load()
+            progress(0.5)
+            converted_data = process_image_with_quality(image, FORMAT_MAPPING[target_format], params['quality'], effort)
+        progress(0.9)
+        return converted_data.getvalue(), f'image/{target_format}', f"converted_{base_name}.{target_format}"
+
+def cors_preflight():
+    """Response to a CORS preflight request"""
+    response = jsonify({'status': 'OK'})
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+    response.headers.add('Access-Control-Allow-Methods', 'POST,OPTIONS')
+    return response
+
+def output_format_for(filename):
+    """Requested output format, defaulting to the upload's own format"""
+    target_format = request.form.get('format')
+    if target_format:
+        return target_format.lower()
+    input_format = get_file_format(filename)
+    return input_format if input_format in OUTPUT_FORMATS else 'png'
+
+def get_upload_size(file):
+    """Size of an uploaded file without reading it"""
+    file.stream.seek(0, 2)
+    size = file.stream.tell()
+    file.stream.seek(0)
+    return size
+
+def input_file():
+    """The image a request works on, as (file, None) or (None, error response).
+
+    Either the multipart `file` upload or, with `source_token`, the held
+    original a proven /uploads/preflight granted. An upload sent with an
+    `upload_token` is kept as an original for later requests, and the
+    response carries its source token in `X-Source-Token`.
+    """
+    if request.form.get('source'):
+        return None, (jsonify({'error': 'source is not accepted, use the source_token from /uploads/preflight'}), 400)
+    # The preflight passes the token it has just granted
+    source_token = request.form.get('source_token') or g.get('source_token')
+    if source_token:
+        held = originals.open(source_token)
+        if held is None:
+            # Unknown, expired and gone originals look alike
+            return None, (jsonify({'error': 'Source token not valid (expired or unknown), send the file again'}), 404)
+        stream, filename = held
+        
+        @after_this_request
+        def close_source(response):
+            stream.close()
+            return response
+        return FileStorage(stream, filename), None
+    
+    if 'file' not in request.files:
+        return None, (jsonify({'error': 'No file provided'}), 400)
+    file = request.files['file']
+    if file.filename == '':
+        return None, (jsonify({'error': 'No file selected'}), 400)
+    
+    token = request.form.get('upload_token')
+    if token:
+        try:
+            upload_probe(file)
+        except ProbeError:
+            # Not worth keeping; the endpoint reports the error
+            return file, None
+        try:
+            digest = originals.retain(file.stream, file.filename, token)
+        except OSError as e:
+            logger.warning(f"⚠️ Could not keep original {file.filename}: {e}")
+            digest = None
+        if digest:
+            grant = originals.grant(digest)
+            
+            @after_this_request
+            def send_source_token(response):
+                response.headers['X-Source-Token'] = grant
+                exposed = response.headers.get('Access-Control-Expose-Headers')
+                response.headers['Access-Control-Expose-Headers'] = f"{exposed},X-Source-Token" if exposed else 'X-Source-Token'
+                return response
+    return file, None
+
+def lookup_only():
+    """True while /uploads/preflight runs an endpoint just to find a cached
+    result; the endpoint returns None instead of processing on a miss"""
+    return g.get('lookup_only', False)
+
+def send_image_buffer(buffer, mimetype, download_name):
+    """Send an encoded image straight from its in-memory buffer"""
+    buffer.seek(0)
+    return send_file(
+        buffer,
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=download_name
+    )
 
 # API Routes
 @app.route('/')
@@ -167,14 +714,22 @@ def index():
         'max_file_size': f'{MAX_CONTENT_LENGTH // (1024*1024)}MB',
         'supported_formats': list(SUPPORTED_FORMATS),
         'endpoints': {
+            '/inspect': 'Header-only probe: format, dimensions, mode, frames, orientation, ICC, decode memory',
+            '/uploads/preflight': 'Upload-by-hash: prove you have a held original to get a `source_token`, or get an upload token',
             '/compress': 'Image compression with quality control',
             '/convert': 'Format conversion (PNG, JPEG, WebP, HEIC, etc.)',
             '/heic-convert': 'HEIC/HEIF to JPEG conversion',
+            '/strip': 'Lossless JPEG metadata removal and orientation fix (no re-encode)',
             '/resize': 'Image resizing with aspect ratio',
             '/crop': 'Image cropping',
             '/rotate': 'Image rotation',
             '/filters': 'Image filters (blur, brightness, contrast, etc.)',
-            '/batch-process': 'Multiple image processing'
+            '/batch-process': 'Multiple image processing (operations pipeline, ZIP response)',
+            '/process': 'Operation pipeline: ordered crop/resize/rotate/flip/filters, decoded and encoded once',
+            '/variants': 'Responsive widths x formats from one decode (ZIP or multipart with a srcset manifest)',
+            '/cache/stats': 'Result cache counters',
+            '/metrics': 'Prometheus metrics: per-stage latency, peak RSS growth, request counters',
+            '/jobs': 'Background jobs for slow conversions (submit, status, result, cancel)'
         }
     })
 
@@ -185,9 +740,96 @@ def health():
         'status': 'healthy',
         'heic_support': HEIC_SUPPORT,
         'service': 'QuickUtil Image Processing API',
-        'version': '1.0.8'
+        'version': '1.0.8',
+        'decode_budget': decode_budget.stats(),
+        'encode_costs': cost_model.stats()
     })
 
+@app.route('/cache/stats')
+def cache_stats():
+    """Result cache hit/miss/eviction counters for this worker"""
+    return jsonify({**result_cache.stats(), 'originals': originals.stats()})
+
+@app.route('/inspect', methods=['POST', 'OPTIONS'])
+def inspect_image():
+    """Format, dimensions, mode, frame count, orientation, ICC presence and
+    decode memory of an image, read from its header only.
+
+    Takes a multipart `file` (never spooled) or the raw image as the request
+    body, which is read only as far as the header goes.
+    """
+    if request.method == 'OPTIONS':
+        return cors_preflight()
+    try:
+        with metrics.stage('probe'):
+            if request.mimetype == 'multipart/form-data':
+                if 'file' not in request.files:
+                    return jsonify({'error': 'No file provided'}), 400
+                probe = upload_probe(request.files['file'], check=False)
+            else:
+                probe = probe_stream(request.stream)
+    except ProbeError as pe:
+        return probe_error_response(pe)
+    
+    info = probe.to_dict()
+    if info['decode_bytes'] is not None:
+        # What a full-size decode reserves from the decode budget
+        info['admission_bytes'] = info['decode_bytes'] * DECODE_WORKING_SET_FACTOR
+    try:
+        check_probe(probe)
+        info['accepted'] = True
+    except ProbeError as pe:
+        info.update(accepted=False, reason=str(pe))
+    metrics.set_labels(input_format=info['format'])
+    return jsonify(info)
+
+@app.route('/uploads/preflight', methods=['POST', 'OPTIONS'])
+def upload_preflight():
+    """Announce a file by `sha256` and `size` (form fields) before uploading it.
+    
+    The first call returns a `challenge` and a byte range; call again with
+    `challenge` and `proof` (SHA-256 of the challenge ID followed by those
+    bytes of the file). `held`: the original is on the server; send
+    the returned `source_token` instead of the file to any single-image endpoint.
+    `upload`: send the file once with the returned `upload_token` and it is
+    kept for the requests after it.
+    
+    With `endpoint` (compress, heic-convert, convert, process, resize, crop,
+    rotate, filters) and that endpoint's own form fields, a proven original
+    whose result is cached gets the result itself, exactly as the endpoint
+    would send it; otherwise `cached: false` is added to the `held` answer.
+    """
+    if request.method == 'OPTIONS':
+        return cors_preflight()
+    views = {
+        'compress': compress_image, 'heic-convert': convert_heic, 'convert': convert_format,
+        'process': process_image, 'resize': resize_image, 'crop': crop_image,
+        'rotate': rotate_image, 'filters': apply_filters
+    }
+    fields = request.form
+    try:
+        digest = parse_digest(fields.get('sha256'))
+        size = parse_file_size(fields.get('size'))
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
+    if size > MAX_CONTENT_LENGTH:
+        return jsonify({'error': f'File too large: {size/(1024*1024):.1f}MB. Max: {MAX_CONTENT_LENGTH // (1024*1024)}MB'}), 413
+    endpoint = fields.get('endpoint')
+    if endpoint and endpoint not in views:
+        return jsonify({'error': f'Unknown endpoint: {endpoint}. Use one of: {", ".join(views)}'}), 400
+    
+    result = originals.preflight(digest, size, fields.get('challenge'), fields.get('proof'))
+    logger.info(f"🤝 Upload preflight {digest[:12]} ({size} bytes): {result['status']}")
+    if result['status'] == 'held' and endpoint:
+        g.source_token = result['source_token']
+        g.lookup_only = True
+        response = views[endpoint]()
+        if response is not None:
+            logger.info(f"🤝 Preflight answered /{endpoint} for {digest[:12]} from the result cache")
+            return response
+        result['cached'] = False
+    return jsonify(result)
+
 @app.route('/compress', methods=['POST', 'OPTIONS'])
 def compress_image():
     """Compress image with quality control"""
@@ -198,122 +840,108 @@ def compress_image():
         response.headers.add('Access-Control-Allow-Methods', 'POST,OPTIONS')
         return response
     
-    temp_path = None
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file provided'}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
+        file, error = input_file()
+        if error:
+            return error
         
         if not allowed_file(file.filename):
             return jsonify({'error': 'File type not supported'}), 400
         
+        try:
+            probe = upload_probe(file)
+        except ProbeError as pe:
+            return probe_error_response(pe)
+        
         # Get compression parameters
         quality = int(request.form.get('quality', 85))
         target_format = request.form.get('format', 'jpeg').lower()
         max_width = request.form.get('max_width', type=int)
         max_height = request.form.get('max_height', type=int)
+        try:
+            target_size = parse_size(request.form.get('target_size'))
+            resize_quality = resample.parse_tier(request.form.get('resize_quality'))
+            effort = policy_from_form(request.form)
+            auto_formats = parse_auto_formats(request.form.get('auto_formats'))
+        except ValueError as ve:
+            return jsonify({'error': str(ve)}), 400
         
         # Validate parameters
         quality = max(10, min(100, quality))
         
         # CRITICAL: Validate target format
-        if target_format not in ['png', 'jpeg', 'jpg', 'webp', 'bmp', 'tiff', 'heic', 'heif']:
+        if target_format not in OUTPUT_FORMATS and target_format != AUTO_FORMAT:
             return jsonify({'error': f'Target format not supported: {target_format}'}), 400
         
         # CRITICAL: Format mapping for processing 
-        format_mapping = {
-            'jpeg': 'JPEG',
-            'jpg': 'JPEG', 
-            'png': 'PNG',
-            'webp': 'WEBP',
-            'bmp': 'BMP',
-            'tiff': 'TIFF',
-            'heic': 'HEIF',  # HEIC maps to HEIF for pillow-heif
-            'heif': 'HEIF'
-        }
-        
-        processing_format = format_mapping.get(target_format, 'JPEG')
+        processing_format = FORMAT_MAPPING.get(target_format, AUTO_FORMAT)
         
         # DEBUG: Log format mapping
         logger.info(f"🔧 Format mapping: {target_format} -> {processing_format}")
         
         # 🔧 EARLY FILE SIZE VALIDATION (MEMORY PROTECTION)
-        file.seek(0, 2)  # Seek to end
-        file_size = file.tell()
-        file.seek(0)  # Reset to beginning
+        file_size = get_upload_size(file)
         
         if file_size > 20 * 1024 * 1024:  # 20MB limit for HEIC files
             return jsonify({'error': f'File too large: {file_size/(1024*1024):.1f}MB. Max: 20MB'}), 413
         
         logger.info(f"📊 Processing file: {file.filename}, Size: {file_size/(1024*1024):.1f}MB, Format: {target_format}")
+        metrics.set_labels(input_format=get_file_format(file.filename), output_format=processing_format)
         
-        # Save file temporarily
-        temp_path = save_file_temporarily(file)
+        # ♻️ RESULT CACHE LOOKUP (a hit skips decode and encode entirely)
+        original_size = file_size
+        source_hash = hash_stream(file.stream)
         
-        # 🔧 MEMORY-SAFE IMAGE LOADING
-        image = None
-        compressed_data = None
-        try:
-            image = Image.open(temp_path)
-            original_size = os.path.getsize(temp_path)
-            
-            # Log image dimensions for memory estimation
-            logger.info(f"🖼️ Image dimensions: {image.width}x{image.height}, Mode: {image.mode}")
-            
-            # Resize if dimensions specified
-            if max_width or max_height:
-                image.thumbnail((max_width or image.width, max_height or image.height), Image.Resampling.LANCZOS)
-                logger.info(f"🔄 Resized to: {image.width}x{image.height}")
-            
-            # Compress image with mapped format
-            compressed_data = process_image_with_quality(image, processing_format, quality)
+        def cache_key(policy_params):
+            return result_cache.make_key(
+                source_hash, endpoint='compress', format=processing_format,
+                quality=quality, max_width=max_width, max_height=max_height, target_size=target_size,
+                resize_quality=resize_quality, **policy_params,
+                auto_formats=','.join(auto_formats) if target_format == AUTO_FORMAT else None
+            )
+        cached = result_cache.get_any(
+            cache_key(params) for params in effort.cache_lookups(processing_format, output_pixels(probe, max_width, max_height))
+        )
+        if cached is None and lookup_only():
+            return None
+        if cached:
+            compressed_data = io.BytesIO(cached.data)
+            info = dict(cached.metadata, decode_path='none', target_iterations=0, target_time_ms=0.0)
+        else:
+            # 🔧 MEMORY-SAFE IMAGE LOADING (decoded straight from the spooled upload)
+            try:
+                compressed_data, info = compress_stream(
+                    file.stream, processing_format, quality, max_width, max_height, target_size,
+                    resize_quality=resize_quality, effort=effort, auto_formats=auto_formats
+                )
+            except (AdmissionError, Image.DecompressionBombError) as ae:
+                return admission_error_response(ae)
             
-        except MemoryError as me:
-            logger.error(f"💥 MEMORY ERROR: {me}")
-            return jsonify({'error': 'File too large for processing. Try a smaller image or lower quality.'}), 413
+            except MemoryError as me:
+                logger.error(f"💥 MEMORY ERROR: {me}")
+                return jsonify({'error': 'File too large for processing. Try a smaller image or lower quality.'}), 413
             
-        except Exception as pe:
-            logger.error(f"💥 PROCESSING ERROR: {pe}")
-            return jsonify({'error': f'Image processing failed: {str(pe)}'}), 500
+            except Exception as pe:
+                logger.error(f"💥 PROCESSING ERROR: {pe}")
+                return jsonify({'error': f'Image processing failed: {str(pe)}'}), 500
             
-        finally:
-            # 🧹 CRITICAL MEMORY CLEANUP
-            if image:
-                try:
-                    image.close()
-                    del image
-                    gc.collect()
-                    logger.info("🧹 Image memory cleaned up")
-                except Exception as cleanup_err:
-                    logger.warning(f"⚠️ Image cleanup warning: {cleanup_err}")
-        
-        # Exit early if processing failed
-        if not compressed_data:
-            return jsonify({'error': 'Image processing failed'}), 500
-        
-        # Generate unique filename for output
-        unique_filename = f"{uuid.uuid4()}.{target_format}"
-        output_path = os.path.join(PROCESSED_FOLDER, unique_filename)
+            result_cache.put(cache_key(effort.cache_params()), compressed_data.getbuffer(), info)
         
-        # Save compressed file
-        with open(output_path, 'wb') as f:
-            f.write(compressed_data.getvalue())
+        quality = info['quality']
+        if target_format == AUTO_FORMAT:
+            target_format = info['output_format']
         
         # Calculate compression ratio
-        new_size = len(compressed_data.getvalue())
+        new_size = compressed_data.getbuffer().nbytes
         compression_ratio = (original_size - new_size) / original_size * 100
         
-        logger.info(f"Image compressed: {file.filename} -> {unique_filename}, Quality: {quality}, Ratio: {compression_ratio:.1f}%")
+        logger.info(f"Image compressed: {file.filename}, Quality: {quality}, Ratio: {compression_ratio:.1f}%")
         
-        # Send compressed file
-        response = send_file(
-            output_path,
-            mimetype=f'image/{target_format}',
-            as_attachment=True,
-            download_name=f"compressed_{file.filename.rsplit('.', 1)[0]}.{target_format}"
+        # Send compressed file straight from memory
+        response = send_image_buffer(
+            compressed_data,
+            f'image/{target_format}',
+            f"compressed_{file.filename.rsplit('.', 1)[0]}.{target_format}"
         )
         
         # Add compression metadata to headers
@@ -322,21 +950,25 @@ def compress_image():
         response.headers['X-Compression-Ratio'] = f"{compression_ratio:.1f}"
         response.headers['X-Original-Format'] = get_file_format(file.filename) or 'unknown'
         response.headers['X-Output-Format'] = target_format
-        # Get dimensions safely (image might be closed)
-        dimensions = "unknown"
-        try:
-            with Image.open(temp_path) as img_check:
-                dimensions = f"{img_check.width}x{img_check.height}"
-        except:
-            pass
-            
-        response.headers['X-Original-Dimensions'] = dimensions
-        response.headers['X-Final-Dimensions'] = dimensions
+        response.headers['X-Original-Dimensions'] = info['original_dimensions']
+        response.headers['X-Final-Dimensions'] = info['final_dimensions']
         response.headers['X-Compression-Mode'] = 'standard'
         response.headers['X-Quality'] = str(quality)
+        response.headers['X-Decode-Path'] = info['decode_path']
+        response.headers['X-Encode-Effort'] = effort.summary()
+        if info.get('frames'):
+            response.headers['X-Animation-Frames'] = info['frames']
+        if info.get('auto_format'):
+            response.headers['X-Auto-Format'] = info['auto_format']
+        response.headers['X-Cache'] = 'HIT' if cached else 'MISS'
+        if target_size:
+            response.headers['X-Target-Size'] = str(target_size)
+            response.headers['X-Target-Met'] = str(new_size <= target_size).lower()
+            response.headers['X-Target-Iterations'] = str(info['target_iterations'])
+            response.headers['X-Target-Time-Ms'] = f"{info['target_time_ms']:.1f}"
         
         # CRITICAL: Expose custom headers for CORS
-        response.headers['Access-Control-Expose-Headers'] = 'X-Original-Size,X-Compressed-Size,X-Compression-Ratio,X-Original-Format,X-Output-Format,X-Original-Dimensions,X-Final-Dimensions,X-Compression-Mode,X-Quality'
+        response.headers['Access-Control-Expose-Headers'] = 'X-Original-Size,X-Compressed-Size,X-Compression-Ratio,X-Original-Format,X-Output-Format,X-Original-Dimensions,X-Final-Dimensions,X-Compression-Mode,X-Quality,X-Decode-Path,X-Encode-Effort,X-Animation-Frames,X-Auto-Format,X-Cache,X-Target-Size,X-Target-Met,X-Target-Iterations,X-Target-Time-Ms'
         
         # DEBUG: Log headers being set
         logger.info(f"🔍 Setting response headers: Original={original_size}, Compressed={new_size}, Ratio={compression_ratio:.1f}%")
@@ -346,9 +978,6 @@ def compress_image():
     except Exception as e:
         logger.error(f"Image compression error: {e}")
         return jsonify({'error': str(e)}), 500
-    
-    finally:
-        cleanup_temp_file(temp_path)
 
 @app.route('/heic-convert', methods=['POST', 'OPTIONS'])
 def convert_heic():
@@ -360,55 +989,74 @@ def convert_heic():
         response.headers.add('Access-Control-Allow-Methods', 'POST,OPTIONS')
         return response
     
-    temp_path = None
     try:
         if not HEIC_SUPPORT:
             return jsonify({'error': 'HEIC support not available'}), 501
         
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file provided'}), 400
+        file, error = input_file()
+        if error:
+            return error
         
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
+        try:
+            probe = upload_probe(file)
+        except ProbeError as pe:
+            return probe_error_response(pe)
         
         # Get quality parameter
         quality = int(request.form.get('quality', 85))
         quality = max(10, min(100, quality))
+        # A bounded preview can come from an embedded thumbnail instead of the full image
+        max_width = request.form.get('max_width', type=int)
+        max_height = request.form.get('max_height', type=int)
+        try:
+            resize_quality = resample.parse_tier(request.form.get('resize_quality'))
+            effort = policy_from_form(request.form)
+        except ValueError as ve:
+            return jsonify({'error': str(ve)}), 400
         
-        # Save HEIC file temporarily
-        temp_path = save_file_temporarily(file)
-        
-        # Load HEIC image
-        image = Image.open(temp_path)
-        
-        # Convert to JPEG
-        converted_data = process_image_with_quality(image, 'JPEG', quality)
-        
-        # Generate unique filename for output
-        unique_filename = f"{uuid.uuid4()}.jpg"
-        output_path = os.path.join(PROCESSED_FOLDER, unique_filename)
+        # Load HEIC image straight from the spooled upload and convert to JPEG
+        metrics.set_labels(input_format=get_file_format(file.filename), output_format='JPEG')
+        source_hash = hash_stream(file.stream)
         
-        # Save converted file
-        with open(output_path, 'wb') as f:
-            f.write(converted_data.getvalue())
+        def cache_key(policy_params):
+            return result_cache.make_key(
+                source_hash, endpoint='heic-convert', quality=quality,
+                max_width=max_width, max_height=max_height, resize_quality=resize_quality, **policy_params
+            )
+        cached = result_cache.get_any(
+            cache_key(params) for params in effort.cache_lookups('JPEG', output_pixels(probe, max_width, max_height))
+        )
+        if cached is None and lookup_only():
+            return None
+        if cached:
+            converted_data = io.BytesIO(cached.data)
+            info = dict(cached.metadata, decode_path='none')
+        else:
+            converted_data, info = compress_stream(
+                file.stream, 'JPEG', quality, max_width, max_height,
+                resize_quality=resize_quality, effort=effort
+            )
+            result_cache.put(cache_key(effort.cache_params()), converted_data.getbuffer(), info)
         
-        logger.info(f"HEIC converted: {file.filename} -> JPEG")
+        logger.info(f"HEIC converted: {file.filename} -> JPEG (cache {'hit' if cached else 'miss'})")
         
-        # Send converted file
-        return send_file(
-            output_path,
-            mimetype='image/jpeg',
-            as_attachment=True,
-            download_name=f"converted_{file.filename.rsplit('.', 1)[0]}.jpg"
+        # Send converted file straight from memory
+        response = send_image_buffer(
+            converted_data,
+            'image/jpeg',
+            f"converted_{file.filename.rsplit('.', 1)[0]}.jpg"
         )
+        response.headers['X-Original-Dimensions'] = info['original_dimensions']
+        response.headers['X-Final-Dimensions'] = info['final_dimensions']
+        response.headers['X-Decode-Path'] = info['decode_path']
+        response.headers['Access-Control-Expose-Headers'] = 'X-Original-Dimensions,X-Final-Dimensions,X-Decode-Path'
+        return response
         
+    except (AdmissionError, Image.DecompressionBombError) as ae:
+        return admission_error_response(ae)
     except Exception as e:
         logger.error(f"HEIC conversion error: {e}")
         return jsonify({'error': str(e)}), 500
-    
-    finally:
-        cleanup_temp_file(temp_path)
 
 @app.route('/convert', methods=['POST', 'OPTIONS'])
 def convert_format():
@@ -420,61 +1068,563 @@ def convert_format():
         response.headers.add('Access-Control-Allow-Methods', 'POST,OPTIONS')
         return response
     
-    temp_path = None
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file provided'}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
+        file, error = input_file()
+        if error:
+            return error
         
         if not allowed_file(file.filename):
             return jsonify({'error': 'File type not supported'}), 400
         
+        try:
+            probe = upload_probe(file)
+        except ProbeError as pe:
+            return probe_error_response(pe)
+        
         # Get conversion parameters
         target_format = request.form.get('format', 'jpeg').lower()
         quality = int(request.form.get('quality', 85))
         
         # Validate parameters
-        if target_format not in ['png', 'jpeg', 'jpg', 'webp', 'bmp', 'tiff', 'heic', 'heif']:
+        if target_format not in OUTPUT_FORMATS and target_format != AUTO_FORMAT:
             return jsonify({'error': 'Target format not supported'}), 400
         
         quality = max(10, min(100, quality))
+        try:
+            effort = policy_from_form(request.form)
+            auto_formats = parse_auto_formats(request.form.get('auto_formats'))
+        except ValueError as ve:
+            return jsonify({'error': str(ve)}), 400
         
-        # Save file temporarily
-        temp_path = save_file_temporarily(file)
+        # Load and convert image straight from the spooled upload
+        metrics.set_labels(input_format=get_file_format(file.filename), output_format=target_format)
+        source_hash = hash_stream(file.stream)
+        requested_format = target_format
         
-        # Load and convert image
-        image = Image.open(temp_path)
+        def cache_key(policy_params):
+            return result_cache.make_key(
+                source_hash, endpoint='convert', format=requested_format, quality=quality, **policy_params,
+                auto_formats=','.join(auto_formats) if requested_format == AUTO_FORMAT else None
+            )
+        cached = result_cache.get_any(
+            cache_key(params) for params in effort.cache_lookups(FORMAT_MAPPING.get(target_format, AUTO_FORMAT), output_pixels(probe))
+        )
+        if cached is None and lookup_only():
+            return None
+        if cached:
+            converted_data = io.BytesIO(cached.data)
+            target_format = cached.metadata.get('output_format', target_format)
+        else:
+            with metrics.stage('probe'):
+                image = Image.open(file.stream)
+            metrics.set_labels(input_format=image.format)
+            if target_format == AUTO_FORMAT:
+                target_format = auto_animated_format(image, auto_formats) or AUTO_FORMAT
+            if target_format != AUTO_FORMAT and animated_output(image, FORMAT_MAPPING[target_format]):
+                with image, admit_animation(image):
+                    converted_data, _ = process_animation(image, FORMAT_MAPPING[target_format], quality, effort)
+            else:
+                with image, admit_decode(image):
+                    with metrics.stage('decode'):
+                        image.load()
+                    if target_format == AUTO_FORMAT:
+                        converted_data, target_format, _ = encode_auto(image, quality, effort, auto_formats)
+                    else:
+                        converted_data = process_image_with_quality(image, target_format, quality, effort)
+            result_cache.put(cache_key(effort.cache_params()), converted_data.getbuffer(), {'output_format': target_format})
         
-        # Convert image
-        converted_data = process_image_with_quality(image, target_format, quality)
+        logger.info(f"Image converted: {file.filename} -> {target_format} (cache {'hit' if cached else 'miss'})")
         
-        # Generate unique filename for output
-        unique_filename = f"{uuid.uuid4()}.{target_format}"
-        output_path = os.path.join(PROCESSED_FOLDER, unique_filename)
+        # Send converted file straight from memory
+        return send_image_buffer(
+            converted_data,
+            f'image/{target_format}',
+            f"converted_{file.filename.rsplit('.', 1)[0]}.{target_format}"
+        )
         
-        # Save converted file
-        with open(output_path, 'wb') as f:
-            f.write(converted_data.getvalue())
+    except (AdmissionError, Image.DecompressionBombError) as ae:
+        return admission_error_response(ae)
+    except Exception as e:
+        logger.error(f"Image conversion error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/strip', methods=['POST', 'OPTIONS'])
+def strip_metadata():
+    """Remove EXIF/GPS/XMP/IPTC and comments from a JPEG without re-encoding it.
+    
+    `keep_icc` (default true) keeps the colour profile; `orientation` is
+    keep (minimal EXIF with the tag), apply (lossless jpegtran transform when
+    possible) or drop.
+    """
+    if request.method == 'OPTIONS':
+        return cors_preflight()
+    try:
+        file, error = input_file()
+        if error:
+            return error
         
-        logger.info(f"Image converted: {file.filename} -> {target_format}")
+        try:
+            probe = upload_probe(file)
+        except ProbeError as pe:
+            return probe_error_response(pe)
+        if probe.format not in ('JPEG', 'MPO'):
+            return jsonify({'error': f'Lossless stripping needs a JPEG, got {probe.format.lower()}'}), 415
         
-        # Send converted file
-        return send_file(
-            output_path,
-            mimetype=f'image/{target_format}',
-            as_attachment=True,
-            download_name=f"converted_{file.filename.rsplit('.', 1)[0]}.{target_format}"
+        try:
+            keep_icc, orientation = jpeg_lossless.parse_options(
+                request.form.get('keep_icc'), request.form.get('orientation')
+            )
+        except ValueError as ve:
+            return jsonify({'error': str(ve)}), 400
+        metrics.set_labels(input_format='jpeg', output_format='jpeg')
+        
+        data = file.stream.read()
+        try:
+            with metrics.stage('strip'):
+                result = jpeg_lossless.strip_jpeg(data, keep_icc, orientation)
+        except ValueError as ve:
+            return jsonify({'error': f'Invalid JPEG: {ve}'}), 400
+        
+        logger.info(f"✂️ Stripped {file.filename}: {len(data)} → {len(result.data)} bytes, removed {result.removed}")
+        
+        response = send_image_buffer(
+            io.BytesIO(result.data), 'image/jpeg', f"stripped_{file.filename.rsplit('.', 1)[0]}.jpg"
         )
+        response.headers['X-Original-Size'] = str(len(data))
+        response.headers['X-Processed-Size'] = str(len(result.data))
+        response.headers['X-Final-Dimensions'] = f"{result.size[0]}x{result.size[1]}"
+        response.headers['X-Removed-Segments'] = ','.join(result.removed) or 'none'
+        response.headers['X-Orientation'] = f"{result.orientation}:{result.orientation_action}"
+        response.headers['Access-Control-Expose-Headers'] = 'X-Original-Size,X-Processed-Size,X-Final-Dimensions,X-Removed-Segments,X-Orientation'
+        return response
         
     except Exception as e:
-        logger.error(f"Image conversion error: {e}")
+        logger.error(f"Metadata stripping error: {e}")
+        return jsonify({'error': f'Metadata stripping failed: {str(e)}'}), 500
+
+def pipeline_response(operations):
+    """Run one upload through an operation pipeline and send the result.
+    
+    The /resize, /crop, /rotate, /filters and /process endpoints only differ
+    in how they build the operation list.
+    """
+    try:
+        file, error = input_file()
+        if error:
+            return error
+        
+        if not allowed_file(file.filename):
+            return jsonify({'error': 'File type not supported'}), 400
+        
+        try:
+            probe = upload_probe(file)
+        except ProbeError as pe:
+            return probe_error_response(pe)
+        
+        target_format = output_format_for(file.filename)
+        if target_format not in OUTPUT_FORMATS:
+            return jsonify({'error': f'Target format not supported: {target_format}'}), 400
+        processing_format = FORMAT_MAPPING[target_format]
+        quality = max(10, min(100, int(request.form.get('quality', 90))))
+        try:
+            resize_quality = resample.parse_tier(request.form.get('resize_quality'))
+            effort = policy_from_form(request.form)
+        except ValueError as ve:
+            return jsonify({'error': str(ve)}), 400
+        operations = parse_operations(operations)
+        metrics.set_labels(input_format=get_file_format(file.filename), output_format=processing_format)
+        
+        original_size = get_upload_size(file)
+        source_hash = hash_stream(file.stream)
+        
+        def cache_key(policy_params):
+            return result_cache.make_key(
+                source_hash, endpoint='process', format=processing_format, quality=quality,
+                operations=json.dumps([[op.name, op.params] for op in operations]), resize_quality=resize_quality,
+                **policy_params
+            )
+        # The source size stands in for the output size, which the operations decide
+        cached = result_cache.get_any(
+            cache_key(params) for params in effort.cache_lookups(processing_format, output_pixels(probe))
+        )
+        if cached is None and lookup_only():
+            return None
+        if cached:
+            processed_data = io.BytesIO(cached.data)
+            info = dict(cached.metadata, decode_path='none')
+        else:
+            processed_data, info = process_stream(
+                file.stream, operations, processing_format, quality, resize_quality, effort
+            )
+            result_cache.put(cache_key(effort.cache_params()), processed_data.getbuffer(), info)
+        
+        logger.info(f"Image processed: {file.filename}, Steps: {info['steps']} (cache {'hit' if cached else 'miss'})")
+        
+        response = send_image_buffer(
+            processed_data,
+            f'image/{target_format}',
+            f"processed_{file.filename.rsplit('.', 1)[0]}.{target_format}"
+        )
+        response.headers['X-Original-Size'] = str(original_size)
+        response.headers['X-Processed-Size'] = str(processed_data.getbuffer().nbytes)
+        response.headers['X-Output-Format'] = target_format
+        response.headers['X-Original-Dimensions'] = info['original_dimensions']
+        response.headers['X-Final-Dimensions'] = info['final_dimensions']
+        response.headers['X-Decode-Path'] = info['decode_path']
+        response.headers['X-Pipeline'] = info['steps']
+        response.headers['X-Encode-Effort'] = effort.summary()
+        response.headers['X-Cache'] = 'HIT' if cached else 'MISS'
+        response.headers['Access-Control-Expose-Headers'] = 'X-Original-Size,X-Processed-Size,X-Output-Format,X-Original-Dimensions,X-Final-Dimensions,X-Decode-Path,X-Pipeline,X-Encode-Effort,X-Cache'
+        return response
+        
+    except PipelineError as pe:
+        return jsonify({'error': str(pe)}), 400
+    except (AdmissionError, Image.DecompressionBombError) as ae:
+        return admission_error_response(ae)
+    except Exception as e:
+        logger.error(f"Image processing error: {e}")
+        return jsonify({'error': f'Image processing failed: {str(e)}'}), 500
+
+@app.route('/process', methods=['POST', 'OPTIONS'])
+def process_image():
+    """Apply an ordered list of operations (JSON in the `operations` field)"""
+    if request.method == 'OPTIONS':
+        return cors_preflight()
+    return pipeline_response(request.form.get('operations', ''))
+
+@app.route('/resize', methods=['POST', 'OPTIONS'])
+def resize_image():
+    """Resize, keeping the aspect ratio unless maintain_aspect=false"""
+    if request.method == 'OPTIONS':
+        return cors_preflight()
+    return pipeline_response([{
+        'op': 'resize',
+        'width': request.form.get('width'),
+        'height': request.form.get('height'),
+        'maintain_aspect': request.form.get('maintain_aspect', 'true')
+    }])
+
+@app.route('/crop', methods=['POST', 'OPTIONS'])
+def crop_image():
+    """Crop to the x/y/width/height rectangle"""
+    if request.method == 'OPTIONS':
+        return cors_preflight()
+    return pipeline_response([{
+        'op': 'crop',
+        'x': request.form.get('x', 0),
+        'y': request.form.get('y', 0),
+        'width': request.form.get('width'),
+        'height': request.form.get('height')
+    }])
+
+@app.route('/rotate', methods=['POST', 'OPTIONS'])
+def rotate_image():
+    """Rotate clockwise by `angle` degrees (multiples of 90 are lossless transposes)"""
+    if request.method == 'OPTIONS':
+        return cors_preflight()
+    return pipeline_response([{
+        'op': 'rotate',
+        'angle': request.form.get('angle', 90),
+        'expand': request.form.get('expand', 'true')
+    }])
+
+@app.route('/filters', methods=['POST', 'OPTIONS'])
+def apply_filters():
+    """Brightness, contrast, saturation, sharpness factors (1 = unchanged) and blur radius"""
+    if request.method == 'OPTIONS':
+        return cors_preflight()
+    operations = [
+        {'op': name, 'value': request.form[name]}
+        for name in ('brightness', 'contrast', 'saturation', 'sharpness', 'blur')
+        if request.form.get(name) not in (None, '')
+    ]
+    if not operations:
+        return jsonify({'error': 'No filter values provided'}), 400
+    return pipeline_response(operations)
+
+def stream_batch_process(files, operations, target_format, quality, resize_quality, effort):
+    """Generate a ZIP with each processed file as soon as it is done,
+    followed by a manifest.json entry with the per-file results"""
+    writer = ZipStreamWriter()
+    results = []
+    for file in files:
+        result = {'filename': file.filename}
+        try:
+            if not allowed_file(file.filename):
+                raise PipelineError('File type not supported')
+            upload_probe(file)
+            result['original_size'] = get_upload_size(file)
+            processed_data, info = process_stream(
+                file.stream, operations, FORMAT_MAPPING[target_format], quality, resize_quality, effort
+            )
+            archive_name = writer.unique_name(f"processed_{file.filename.rsplit('.', 1)[0]}.{target_format}")
+            result.update(
+                status='success',
+                archive_name=archive_name,
+                processed_size=processed_data.getbuffer().nbytes,
+                original_dimensions=info['original_dimensions'],
+                final_dimensions=info['final_dimensions'],
+                steps=info['steps']
+            )
+            yield writer.add(archive_name, processed_data.getbuffer())
+        except Exception as e:
+            logger.error(f"Batch item failed: {file.filename}: {e}")
+            result.update(status='error', error=str(e))
+        results.append(result)
+    yield writer.add_json('manifest.json', {
+        'results': results,
+        'total_files': len(files),
+        'successful': len([r for r in results if r['status'] == 'success']),
+        'failed': len([r for r in results if r['status'] == 'error'])
+    })
+    yield writer.close()
+
+@app.route('/batch-process', methods=['POST', 'OPTIONS'])
+def batch_process():
+    """Run the same operation pipeline over several uploads, returned as a ZIP"""
+    if request.method == 'OPTIONS':
+        return cors_preflight()
+    try:
+        files = [f for f in request.files.getlist('files') if f.filename]
+        if not files:
+            return jsonify({'error': 'No files provided'}), 400
+        
+        target_format = request.form.get('format', 'jpeg').lower()
+        if target_format not in OUTPUT_FORMATS:
+            return jsonify({'error': f'Target format not supported: {target_format}'}), 400
+        quality = max(10, min(100, int(request.form.get('quality', 90))))
+        try:
+            resize_quality = resample.parse_tier(request.form.get('resize_quality'))
+            effort = policy_from_form(request.form)
+        except ValueError as ve:
+            return jsonify({'error': str(ve)}), 400
+        operations = parse_operations(request.form.get('operations', ''))
+        metrics.set_labels(output_format=FORMAT_MAPPING[target_format])
+        
+        return Response(
+            stream_with_context(stream_batch_process(files, operations, target_format, quality, resize_quality, effort)),
+            mimetype='application/zip',
+            headers={'Content-Disposition': 'attachment; filename=processed_images.zip'}
+        )
+        
+    except PipelineError as pe:
+        return jsonify({'error': str(pe)}), 400
+    except Exception as e:
+        logger.error(f"Batch processing error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def stream_variants(results, manifest, boundary=None):
+    """Generate the variants response body: a ZIP ending with manifest.json,
+    or multipart/mixed with the manifest as the first part"""
+    if boundary is None:
+        writer = ZipStreamWriter()
+        for entry, (_, _, buffer) in zip(manifest['variants'], results):
+            yield writer.add(entry['name'], buffer.getbuffer())
+        yield writer.add_json('manifest.json', manifest)
+        yield writer.close()
+        return
+    parts = [('manifest.json', 'application/json', json.dumps(manifest, indent=2).encode('utf-8'))]
+    parts += [(entry['name'], f"image/{entry['format']}", buffer.getbuffer())
+              for entry, (_, _, buffer) in zip(manifest['variants'], results)]
+    for name, mimetype, data in parts:
+        yield (f"--{boundary}\r\nContent-Type: {mimetype}\r\n"
+               f"Content-Disposition: attachment; filename=\"{name}\"\r\n"
+               f"Content-Length: {len(data)}\r\n\r\n").encode('utf-8')
+        yield bytes(data)
+        yield b'\r\n'
+    yield f"--{boundary}--\r\n".encode('utf-8')
+
+@app.route('/variants', methods=['POST', 'OPTIONS'])
+def responsive_variants():
+    """Every requested width in every requested format, from a single decode"""
+    if request.method == 'OPTIONS':
+        return cors_preflight()
+    try:
+        file, error = input_file()
+        if error:
+            return error
+        
+        if not allowed_file(file.filename):
+            return jsonify({'error': 'File type not supported'}), 400
+        
+        try:
+            upload_probe(file)
+        except ProbeError as pe:
+            return probe_error_response(pe)
+        
+        formats = list(dict.fromkeys(
+            f.strip().lower() for f in request.form.get('formats', 'webp,jpeg').split(',') if f.strip()
+        ))
+        unsupported = [f for f in formats if f not in OUTPUT_FORMATS]
+        if not formats or unsupported:
+            return jsonify({'error': f"Target format not supported: {','.join(unsupported) or 'none'}"}), 400
+        if len(formats) > MAX_FORMATS:
+            return jsonify({'error': f'At most {MAX_FORMATS} formats are allowed'}), 400
+        output = request.form.get('output', 'zip').lower()
+        if output not in ('zip', 'multipart'):
+            return jsonify({'error': "output must be 'zip' or 'multipart'"}), 400
+        quality = max(10, min(100, int(request.form.get('quality', 85))))
+        try:
+            widths = parse_widths(request.form.get('widths'))
+            resize_quality = resample.parse_tier(request.form.get('resize_quality'))
+            effort = policy_from_form(request.form)
+        except ValueError as ve:
+            return jsonify({'error': str(ve)}), 400
+        metrics.set_labels(input_format=get_file_format(file.filename), output_format=FORMAT_MAPPING[formats[0]])
+        
+        try:
+            results, info = variants_stream(file.stream, widths, formats, quality, resize_quality, effort)
+        except (AdmissionError, Image.DecompressionBombError) as ae:
+            return admission_error_response(ae)
+        
+        base_name = file.filename.rsplit('.', 1)[0]
+        entries = [
+            {'name': f"{base_name}_{size[0]}w.{fmt}", 'width': size[0], 'height': size[1],
+             'format': fmt, 'size': buffer.getbuffer().nbytes}
+            for size, fmt, buffer in results
+        ]
+        manifest = {
+            'original_dimensions': info['original_dimensions'],
+            'decode_path': info['decode_path'],
+            'quality': quality,
+            'variants': entries,
+            'srcset': srcset(entries)
+        }
+        logger.info(f"Variants built: {file.filename}, {len(entries)} files, decode {info['decode_path']}")
+        
+        boundary = None
+        if output == 'zip':
+            mimetype = 'application/zip'
+            headers = {'Content-Disposition': f'attachment; filename={base_name}_variants.zip'}
+        else:
+            boundary = uuid.uuid4().hex
+            mimetype = f"multipart/mixed; boundary={boundary}"
+            headers = {}
+        headers['X-Original-Dimensions'] = info['original_dimensions']
+        headers['X-Decode-Path'] = info['decode_path']
+        headers['X-Variant-Count'] = str(len(entries))
+        headers['X-Encode-Effort'] = effort.summary()
+        headers['Access-Control-Expose-Headers'] = 'X-Original-Dimensions,X-Decode-Path,X-Variant-Count,X-Encode-Effort'
+        return Response(
+            stream_with_context(stream_variants(results, manifest, boundary)),
+            mimetype=mimetype,
+            headers=headers
+        )
+        
+    except Exception as e:
+        logger.error(f"Variant generation error: {e}")
+        return jsonify({'error': f'Variant generation failed: {str(e)}'}), 500
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue a slow compress/convert/heic-convert for background processing"""
+    try:
+        file, error = input_file()
+        if error:
+            return error
+        
+        try:
+            upload_probe(file)
+        except ProbeError as pe:
+            return probe_error_response(pe)
+        
+        operation = request.form.get('operation', 'compress').lower()
+        if operation not in JOB_OPERATIONS:
+            return jsonify({'error': f'Operation not supported: {operation}'}), 400
+        if operation == 'heic-convert' and not HEIC_SUPPORT:
+            return jsonify({'error': 'HEIC support not available'}), 501
+        
+        target_format = 'jpeg' if operation == 'heic-convert' else request.form.get('format', 'jpeg').lower()
+        if target_format not in OUTPUT_FORMATS and not (operation == 'compress' and target_format == AUTO_FORMAT):
+            return jsonify({'error': f'Target format not supported: {target_format}'}), 400
+        
+        try:
+            target_size = parse_size(request.form.get('target_size'))
+            resize_quality = resample.parse_tier(request.form.get('resize_quality'))
+            effort = policy_from_form(request.form, default=OFFLINE_EFFORT, allow_deadline=False)
+        except ValueError as ve:
+            return jsonify({'error': str(ve)}), 400
+        
+        params = {
+            'format': target_format,
+            'quality': max(10, min(100, int(request.form.get('quality', 85)))),
+            'max_width': request.form.get('max_width', type=int),
+            'max_height': request.form.get('max_height', type=int),
+            'target_size': target_size,
+            'resize_quality': resize_quality,
+            **effort.cache_params()
+        }
+        job_id = job_queue.submit(operation, params, file.stream, file.filename)
+        
+        return jsonify({
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': f'/jobs/{job_id}',
+            'result_url': f'/jobs/{job_id}/result'
+        }), 202
+        
+    except Exception as e:
+        logger.error(f"Job submission error: {e}")
         return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Status and progress of a background job"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found or expired'}), 404
     
-    finally:
-        cleanup_temp_file(temp_path)
+    return jsonify({
+        'job_id': job['id'],
+        'operation': job['operation'],
+        'filename': job['filename'],
+        'status': job['status'],
+        'progress': round(job['progress'], 2),
+        'error': job['error'],
+        'result_size': job['result_size'],
+        'expires_at': datetime.utcfromtimestamp(job['expires_at']).isoformat() if job['expires_at'] else None
+    })
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Download the output of a finished job"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    if job['status'] != DONE:
+        return jsonify({'error': f"Job is {job['status']}", 'status': job['status']}), 409
+    
+    return send_file(
+        job_queue.result_path(job_id),
+        mimetype=job['mimetype'],
+        as_attachment=True,
+        download_name=job['download_name']
+    )
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running job"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    if job['status'] in FINISHED_STATES:
+        return jsonify({'error': f"Job already {job['status']}", 'status': job['status']}), 409
+    
+    job_queue.cancel(job_id)
+    return jsonify({'job_id': job_id, 'status': 'cancelled'})
+
+# Background job workers
+job_workers = JobWorkerPool(job_queue, run_job, workers=JOB_WORKERS)
+
+def start_background():
+    """Start the sweeper and job workers of this process"""
+    sweeper.start()
+    job_workers.start()
+
+if warmup.PRELOADED:
+    # gunicorn master: warm the codecs once; workers inherit them on fork
+    warmup.warm_codecs(['JPEG', 'PNG', 'WEBP'] + (['HEIF'] if HEIC_SUPPORT else []))
+warmup.start_after_fork(start_background)
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+QuickUtil artifact store
+Files shared by every worker (the result cache disk tier), indexed in one
+SQLite database next to them instead of being found by listing the folder:
+- expiry: each entry has an expires_at, indexed, so a sweep deletes exactly
+  the expired entries and costs O(expired), not O(files)
+- quota: the total size is kept in the database by triggers; a store that
+  pushes it over the quota evicts least recently used entries right away, so
+  a burst cannot fill the disk between sweeps
+- one sweeper: every process runs a Sweeper thread, but only the holder of
+  a lease row in the database sweeps; it sleeps until the next entry is due,
+  and another process takes over when its lease runs out (extra cleanup
+  tasks are elected the same way, under a lease of their own)
+Leases also serve as short-lived tokens (see originals.py); expired ones are
+deleted with the expired entries.
+Each thread keeps its own connection to the index. The database is switched
+to WAL once, when the store is created; the mode is stored in the file, so
+later connections use it without asking again.
+"""
+
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Entries deleted per transaction while sweeping or evicting
+SWEEP_BATCH = 256
+# Longest sleep between sweeps, so entries stored elsewhere with an earlier
+# expiry are still picked up; the lease outlives a few of these
+SWEEP_MAX_SLEEP = 30.0
+LEASE_DURATION = 3 * SWEEP_MAX_SLEEP
+SWEEPER_LEASE = 'sweeper'
+
+# Connections opened before a fork, which the forked process must never close
+_INHERITED: List[sqlite3.Connection] = []
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    metadata TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_expires ON artifacts (expires_at);
+CREATE INDEX IF NOT EXISTS artifacts_accessed ON artifacts (accessed_at);
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    entries INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO usage (id, entries, bytes) VALUES (0, 0, 0);
+CREATE TRIGGER IF NOT EXISTS artifacts_insert AFTER INSERT ON artifacts BEGIN
+    UPDATE usage SET entries = entries + 1, bytes = bytes + NEW.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS artifacts_update AFTER UPDATE OF size ON artifacts BEGIN
+    UPDATE usage SET bytes = bytes + NEW.size - OLD.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS artifacts_delete AFTER DELETE ON artifacts BEGIN
+    UPDATE usage SET entries = entries - 1, bytes = bytes - OLD.size WHERE id = 0;
+END;
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+@dataclass
+class Artifact:
+    data: bytes
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    expires_at: float = 0.0
+
+
+class ArtifactStore:
+    """Expiring files with a byte quota, shared by all workers through one SQLite index"""
+
+    def __init__(self, folder: str, quota: int, ttl: int):
+        self.folder = folder
+        self.quota = quota
+        self.ttl = ttl
+        self.db_path = os.path.join(folder, 'index.sqlite3')
+        os.makedirs(folder, exist_ok=True)
+        self._local = threading.local()
+        fresh = not os.path.exists(self.db_path)
+        # A connection of its own, closed again: stores are created before
+        # gunicorn forks, and a forked worker must not share an open one
+        db = self._open()
+        try:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+        if fresh:
+            self._remove_untracked()
+
+    def _open(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    @contextmanager
+    def _connect(self):
+        """This thread's autocommit connection, opened on first use (per process)"""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            if getattr(local, 'db', None) is not None:
+                # Inherited across a fork: kept referenced, since closing it
+                # here (or letting it be collected) would drop the parent's locks
+                _INHERITED.append(local.db)
+            local.db, local.pid = self._open(), os.getpid()
+        db = local.db
+        try:
+            yield db
+        finally:
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}.bin")
+
+    def _remove_untracked(self) -> None:
+        # Files from before the index existed would never expire
+        for name in os.listdir(self.folder):
+            if name.endswith(('.bin', '.json', '.tmp')):
+                self._remove_file(os.path.join(self.folder, name))
+
+    @staticmethod
+    def _remove_file(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _touch(self, db: sqlite3.Connection, key: str, now: float) -> Optional[sqlite3.Row]:
+        """The unexpired row for key, marked as recently used"""
+        row = db.execute('SELECT metadata, expires_at FROM artifacts WHERE key = ?', (key,)).fetchone()
+        if row is None or row['expires_at'] <= now:
+            return None
+        db.execute('UPDATE artifacts SET accessed_at = ? WHERE key = ?', (now, key))
+        return row
+
+    def get(self, key: str) -> Optional[Artifact]:
+        """The entry if it exists and has not expired; marks it as recently used"""
+        with self._connect() as db:
+            row = self._touch(db, key, time.time())
+        if row is None:
+            return None
+        try:
+            with open(self.path(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        return Artifact(data, json.loads(row['metadata']), row['expires_at'])
+
+    def stat(self, key: str) -> Optional[Artifact]:
+        """get() without reading the file (data is empty)"""
+        with self._connect() as db:
+            row = self._touch(db, key, time.time())
+        if row is None or not os.path.exists(self.path(key)):
+            return None
+        return Artifact(b'', json.loads(row['metadata']), row['expires_at'])
+
+    def open(self, key: str) -> Optional[Tuple[BinaryIO, Artifact]]:
+        """get() without reading the file: the open file and the entry (with empty data).
+
+        The file stays readable if the entry is swept while it is open.
+        """
+        with self._connect() as db:
+            row = self._touch(db, key, time.time())
+        if row is None:
+            return None
+        try:
+            f = open(self.path(key), 'rb')
+        except OSError:
+            return None
+        return f, Artifact(b'', json.loads(row['metadata']), row['expires_at'])
+
+    def put(self, key: str, data: bytes, metadata: Optional[Dict[str, Any]] = None,
+            ttl: Optional[int] = None) -> int:
+        """Store an entry, then evict down to the quota; returns the number evicted"""
+        return self._store(key, len(data), lambda f: f.write(data), metadata, ttl)
+
+    def put_stream(self, key: str, stream: BinaryIO, metadata: Optional[Dict[str, Any]] = None,
+                   ttl: Optional[int] = None) -> int:
+        """put() for a seekable stream, copied without reading it into memory; leaves it rewound"""
+        stream.seek(0, 2)
+        size = stream.tell()
+        stream.seek(0)
+        try:
+            return self._store(key, size, lambda f: shutil.copyfileobj(stream, f), metadata, ttl)
+        finally:
+            stream.seek(0)
+
+    def _store(self, key: str, size: int, write: Callable[[BinaryIO], Any],
+               metadata: Optional[Dict[str, Any]], ttl: Optional[int]) -> int:
+        if size > self.quota:
+            return 0
+        path = self.path(key)
+        # Write to a private name first so other workers never see partial files
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except OSError:
+            self._remove_file(tmp_path)
+            raise
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                'INSERT INTO artifacts (key, size, metadata, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET size = excluded.size, metadata = excluded.metadata, '
+                'expires_at = excluded.expires_at, accessed_at = excluded.accessed_at',
+                (key, size, json.dumps(metadata or {}), now + (self.ttl if ttl is None else ttl), now)
+            )
+            over = db.execute('SELECT bytes FROM usage WHERE id = 0').fetchone()['bytes'] > self.quota
+        return self.evict() if over else 0
+
+    def _delete(self, select: str, params: Tuple,
+                keep: Optional[Callable[[sqlite3.Connection, List[sqlite3.Row]], List[sqlite3.Row]]] = None) -> int:
+        """Delete the rows `select` returns (a batch at a time), then their files"""
+        deleted = 0
+        while True:
+            with self._connect() as db:
+                db.execute('BEGIN IMMEDIATE')
+                try:
+                    rows = db.execute(select, params + (SWEEP_BATCH,)).fetchall()
+                    batch = keep(db, rows) if keep else rows
+                    db.executemany('DELETE FROM artifacts WHERE key = ?', [(row['key'],) for row in batch])
+                    db.execute('COMMIT')
+                except BaseException:
+                    db.execute('ROLLBACK')
+                    raise
+            for row in batch:
+                self._remove_file(self.path(row['key']))
+            deleted += len(batch)
+            if len(batch) < SWEEP_BATCH:
+                return deleted
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Delete every expired entry and lease; returns how many entries"""
+        now = time.time() if now is None else now
+        with self._connect() as db:
+            db.execute('DELETE FROM leases WHERE expires_at <= ?', (now,))
+        return self._delete('SELECT key FROM artifacts WHERE expires_at <= ? ORDER BY expires_at LIMIT ?', (now,))
+
+    def evict(self) -> int:
+        """Delete least recently used entries until the total is within the quota"""
+        def over_quota(db, rows):
+            excess = db.execute('SELECT bytes FROM usage WHERE id = 0').fetchone()['bytes'] - self.quota
+            batch = []
+            for row in rows:
+                if excess <= 0:
+                    break
+                batch.append(row)
+                excess -= row['size']
+            return batch
+        return self._delete('SELECT key, size FROM artifacts ORDER BY accessed_at LIMIT ?', (), over_quota)
+
+    def next_expiry(self) -> Optional[float]:
+        with self._connect() as db:
+            return db.execute('SELECT MIN(expires_at) AS due FROM artifacts').fetchone()['due']
+
+    def usage(self) -> Dict[str, int]:
+        with self._connect() as db:
+            row = db.execute('SELECT entries, bytes FROM usage WHERE id = 0').fetchone()
+        return {'entries': row['entries'], 'bytes': row['bytes']}
+
+    def acquire_lease(self, name: str, owner: str, duration: float) -> bool:
+        """Take or renew the named lease; False while another owner holds it"""
+        now = time.time()
+        with self._connect() as db:
+            cursor = db.execute(
+                'INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at '
+                'WHERE leases.owner = excluded.owner OR leases.expires_at <= ?',
+                (name, owner, now + duration, now)
+            )
+        return cursor.rowcount > 0
+
+    def lease_owner(self, name: str) -> Optional[str]:
+        """Owner of the named lease, None when nobody holds it"""
+        with self._connect() as db:
+            row = db.execute(
+                'SELECT owner FROM leases WHERE name = ? AND expires_at > ?', (name, time.time())
+            ).fetchone()
+        return row['owner'] if row else None
+
+    def release_lease(self, name: str, owner: str) -> bool:
+        """Give up the named lease; False when `owner` did not hold it (or it ran out)"""
+        with self._connect() as db:
+            cursor = db.execute(
+                'DELETE FROM leases WHERE name = ? AND owner = ? AND expires_at > ?', (name, owner, time.time())
+            )
+        return cursor.rowcount > 0
+
+
+class Sweeper:
+    """Background thread expiring store entries, in one process at a time.
+
+    `sweep()` runs when the next entry is due (at most SWEEP_MAX_SLEEP
+    apart) in the process holding the store's sweeper lease; it returns how
+    many entries it removed. `tasks` are other periodic cleanups (such as
+    purging expired jobs); `stores` are the stores those tasks expire, whose
+    next entry due also wakes the sweeper. The tasks are elected under a
+    lease of their own, named after them: processes of another app that
+    share the store (and so the sweeper lease) but not the tasks never keep
+    them from running.
+    """
+
+    def __init__(self, store: ArtifactStore, sweep: Callable[[], int], tasks: Sequence[Callable[[], Any]] = (),
+                 stores: Sequence[ArtifactStore] = ()):
+        self.store = store
+        self.sweep = sweep
+        self.tasks = list(tasks)
+        self.stores = list(stores)
+        self.tasks_lease = f"{SWEEPER_LEASE}:" + ','.join(
+            getattr(task, '__qualname__', repr(task)) for task in self.tasks
+        )
+        self.owner: Optional[str] = None
+        self.leader = False
+        self.tasks_leader = False
+
+    def start(self) -> None:
+        # Taken here, not in __init__, so that it names the process (forked worker) that sweeps
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        threading.Thread(target=self._run, name='sweeper', daemon=True).start()
+
+    def _elect(self, lease: str, was_leader: bool, role: str) -> bool:
+        leader = self.store.acquire_lease(lease, self.owner, LEASE_DURATION)
+        if leader != was_leader:
+            logger.info(f"🧹 Sweeper {'elected' if leader else 'standing by'} for {role} ({self.owner})")
+        return leader
+
+    def run_once(self) -> float:
+        """One round: sweep and run the tasks where elected; returns the seconds until the next"""
+        due = []
+        self.leader = self._elect(SWEEPER_LEASE, self.leader, 'expired artifacts')
+        if self.leader:
+            removed = self.sweep()
+            if removed:
+                logger.info(f"🧹 Swept {removed} expired artifacts")
+            due.append(self.store.next_expiry())
+        if self.tasks:
+            self.tasks_leader = self._elect(self.tasks_lease, self.tasks_leader, 'tasks')
+            if self.tasks_leader:
+                for task in self.tasks:
+                    task()
+                due.extend(store.next_expiry() for store in self.stores)
+        due = [when for when in due if when is not None]
+        return min(SWEEP_MAX_SLEEP, max(0.0, min(due) - time.time())) if due else SWEEP_MAX_SLEEP
+
+    def _run(self) -> None:
+        while True:
+            delay = SWEEP_MAX_SLEEP
+            try:
+                delay = self.run_once()
+            except Exception as e:
+                logger.error(f"Sweeper error: {e}")
+            time.sleep(delay)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+QuickUtil ASGI serving mode
+Serves the same Flask apps from an event loop, so a slow client does not
+tie up a worker:
+- the request body is received on the loop and spooled (in memory up to
+  SPOOL_MAX_MEMORY_MB, then to a temporary file) before the app sees it;
+  bodies over MAX_CONTENT_LENGTH are refused with 413 as soon as that is known
+- the Flask app then runs on a bounded thread pool of CPU slots (ASGI_CPU_SLOTS):
+  routing, decode and encode take a slot, waiting for bytes does not
+- the response is pulled from the app's iterator on the pool a chunk at a
+  time and sent from the loop, so a slow download holds no slot either, and
+  a streamed response (ZIP batches) stops being produced when the client
+  goes away
+Entry points: `asgi:app` (app.py) and `asgi:compression_api`
+(image_compression_api.py), e.g.
+    gunicorn --config gunicorn.conf.py --worker-class uvicorn.workers.UvicornWorker asgi:app
+"""
+
+import asyncio
+import contextvars
+import importlib
+import json
+import logging
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CPU_SLOTS = int(os.environ.get('ASGI_CPU_SLOTS', os.cpu_count() or 1))
+SPOOL_MAX_MEMORY = int(os.environ.get('SPOOL_MAX_MEMORY_MB', 16)) * 1024 * 1024
+# Response bytes gathered per trip to the pool
+RESPONSE_CHUNK = 256 * 1024
+
+# Module attribute -> module whose Flask `app` it serves
+ENTRY_POINTS = {
+    'app': 'app',
+    'compression_api': 'image_compression_api',
+}
+
+
+def _read_chunk(iterator: Iterator[bytes]) -> bytes:
+    """Next RESPONSE_CHUNK (or fewer, at the end) bytes of a WSGI response"""
+    parts = []
+    size = 0
+    for part in iterator:
+        if part:
+            parts.append(part)
+            size += len(part)
+            if size >= RESPONSE_CHUNK:
+                break
+    return b''.join(parts)
+
+
+class WsgiBridge:
+    """ASGI application running a WSGI app on a bounded pool (see module docstring)"""
+
+    def __init__(self, wsgi_app, slots: int = CPU_SLOTS, spool_max_memory: int = SPOOL_MAX_MEMORY,
+                 max_body: Optional[int] = None):
+        self.wsgi_app = wsgi_app
+        self.slots = slots
+        self.spool_max_memory = spool_max_memory
+        config = getattr(wsgi_app, 'config', {})
+        self.max_body = max_body if max_body is not None else config.get('MAX_CONTENT_LENGTH')
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # Created on first use so that a preloading master forks no threads
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.slots, thread_name_prefix='cpu-slot')
+        return self._executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._executor:
+                    self._executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send) -> None:
+        received = await self._receive_body(scope, receive, send)
+        if received is None:
+            return
+        body, size = received
+        disconnected = asyncio.Event()
+        watcher = asyncio.create_task(self._watch_disconnect(receive, disconnected))
+        loop = asyncio.get_running_loop()
+        # Every step of one request runs in the same context, whichever slot thread takes it
+        context = contextvars.copy_context()
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+            return lambda data: None
+
+        def run(function, *args):
+            return loop.run_in_executor(self.executor, context.run, function, *args)
+
+        iterable = None
+        try:
+            iterable = await run(self.wsgi_app, self._environ(scope, body, size), start_response)
+            iterator = iter(iterable)
+            chunk = await run(_read_chunk, iterator)
+            await send({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+            while chunk and not disconnected.is_set():
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await run(_read_chunk, iterator)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            watcher.cancel()
+            if hasattr(iterable, 'close'):
+                await run(iterable.close)
+            body.close()
+
+    async def _receive_body(self, scope, receive, send) -> Optional[Tuple[tempfile.SpooledTemporaryFile, int]]:
+        """The spooled request body and its size; None when the request was answered or abandoned"""
+        length = next((value for name, value in scope['headers'] if name == b'content-length'), None)
+        if self.max_body and length and length.isdigit() and int(length) > self.max_body:
+            await self._too_large(send)
+            return None
+        body = tempfile.SpooledTemporaryFile(max_size=self.spool_max_memory)
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if self.max_body and size > self.max_body:
+                body.close()
+                await self._too_large(send)
+                return None
+            body.write(chunk)
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+        return body, size
+
+    @staticmethod
+    async def _watch_disconnect(receive, disconnected: asyncio.Event) -> None:
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    async def _too_large(self, send) -> None:
+        payload = json.dumps({'error': f'Request too large. Max: {self.max_body // (1024 * 1024)}MB'}).encode()
+        await send({'type': 'http.response.start', 'status': 413, 'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(payload)).encode()),
+            (b'connection', b'close'),
+        ]})
+        await send({'type': 'http.response.body', 'body': payload})
+
+    @staticmethod
+    def _environ(scope, body, size: int) -> dict:
+        """PEP 3333 environ for an ASGI HTTP scope"""
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': str(server[0]),
+            'SERVER_PORT': str(server[1]) if server[1] is not None else '80',
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'CONTENT_LENGTH': str(size),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.input_terminated': True,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1')
+            if name == 'content-length':
+                continue
+            key = 'CONTENT_TYPE' if name == 'content-type' else 'HTTP_' + name.upper().replace('-', '_')
+            value = value.decode('latin-1')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+
+def __getattr__(name: str) -> WsgiBridge:
+    # Import only the app that is asked for: each one starts its own background threads
+    if name not in ENTRY_POINTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    bridge = WsgiBridge(importlib.import_module(ENTRY_POINTS[name]).app)
+    globals()[name] = bridge
+    logger.info(f"⚡ ASGI mode for {ENTRY_POINTS[name]}: {bridge.slots} CPU slots")
+    return bridge
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Synthetic benchmark corpus
+Deterministic test images (the same seed always gives the same pixels) in the
+shapes the service sees in production:
+- photo: smooth structure plus sensor-like noise, stored as JPEG
+- alpha: flat-colour graphics with transparency, stored as PNG
+- palette: the same graphics quantized to 256 colours, stored as PNG (mode P)
+- tiff16: 16-bit grayscale, stored as TIFF
+- heic: the photo content stored as HEIC (only when pillow-heif is installed)
+"""
+
+import hashlib
+import io
+import math
+import random
+from dataclasses import dataclass
+from typing import Iterator, List, Sequence
+
+from PIL import Image, ImageChops, ImageDraw
+
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+    HEIC_SUPPORT = True
+except ImportError:
+    HEIC_SUPPORT = False
+
+KINDS = ('photo', 'alpha', 'palette', 'tiff16', 'heic')
+DEFAULT_SEED = 1234
+ASPECT = 4 / 3
+NOISE_TILE = 509  # prime, so the tiled noise never lines up with 8/16px blocks
+
+
+@dataclass
+class CorpusImage:
+    """One encoded corpus image"""
+    name: str
+    kind: str
+    megapixels: float
+    width: int
+    height: int
+    format: str
+    filename: str
+    data: bytes
+
+    @property
+    def sha256(self) -> str:
+        return hashlib.sha256(self.data).hexdigest()
+
+    def describe(self) -> dict:
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'megapixels': self.megapixels,
+            'dimensions': f"{self.width}x{self.height}",
+            'format': self.format,
+            'bytes': len(self.data),
+            'sha256': self.sha256
+        }
+
+
+def dimensions_for(megapixels: float):
+    """4:3 dimensions (multiples of 16) for a megapixel count"""
+    height = int(math.sqrt(megapixels * 1_000_000 / ASPECT)) // 16 * 16
+    width = int(height * ASPECT) // 16 * 16
+    return width, height
+
+
+def _photo(size, rng: random.Random) -> Image.Image:
+    # Low-frequency structure: a tiny random image blown up with bicubic
+    base = Image.frombytes('RGB', (12, 9), rng.randbytes(12 * 9 * 3)).resize(size, Image.Resampling.BICUBIC)
+    noise_tile = Image.frombytes('RGB', (NOISE_TILE, NOISE_TILE), rng.randbytes(NOISE_TILE * NOISE_TILE * 3))
+    noise = Image.new('RGB', size)
+    for top in range(0, size[1], NOISE_TILE):
+        for left in range(0, size[0], NOISE_TILE):
+            noise.paste(noise_tile, (left, top))
+    photo = Image.blend(base, noise, 0.06)
+    base.close()
+    noise.close()
+    return photo
+
+
+def _graphic(size, rng: random.Random) -> Image.Image:
+    image = Image.new('RGBA', size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    scale = min(size)
+    for _ in range(60):
+        x0, y0 = rng.randrange(size[0]), rng.randrange(size[1])
+        extent = rng.randint(scale // 20, scale // 3)
+        box = (x0, y0, x0 + extent, y0 + rng.randint(scale // 20, scale // 3))
+        fill = (rng.randrange(256), rng.randrange(256), rng.randrange(256), rng.choice((255, 255, 192, 128)))
+        if rng.random() < 0.5:
+            draw.rectangle(box, fill=fill)
+        else:
+            draw.ellipse(box, fill=fill)
+    draw.text((scale // 20, scale // 20), 'QuickUtil', fill=(20, 20, 20, 255))
+    return image
+
+
+def _tiff16(size, rng: random.Random) -> Image.Image:
+    gradient = Image.linear_gradient('L').resize(size, Image.Resampling.BILINEAR)
+    noise = Image.frombytes('L', size, rng.randbytes(size[0] * size[1]))
+    detail = ImageChops.add(gradient, noise.point(lambda v: v // 64))
+    # Spread 8-bit values over the 16-bit range so the low byte carries data too
+    image = detail.convert('I').point(lambda v: v * 257).convert('I;16')
+    for layer in (gradient, noise, detail):
+        layer.close()
+    return image
+
+
+def _encode(image: Image.Image, kind: str) -> tuple:
+    buffer = io.BytesIO()
+    if kind == 'photo':
+        image.save(buffer, format='JPEG', quality=92)
+        return 'JPEG', 'jpg', buffer.getvalue()
+    if kind == 'heic':
+        # Fastest x265 preset: corpus generation time, not what is measured
+        image.save(buffer, format='HEIF', quality=90, enc_params={'preset': 'ultrafast'})
+        return 'HEIF', 'heic', buffer.getvalue()
+    if kind == 'tiff16':
+        image.save(buffer, format='TIFF', compression='tiff_adobe_deflate')
+        return 'TIFF', 'tiff', buffer.getvalue()
+    image.save(buffer, format='PNG')
+    return 'PNG', 'png', buffer.getvalue()
+
+
+def build_image(kind: str, megapixels: float, seed: int = DEFAULT_SEED) -> CorpusImage:
+    """Generate and encode one corpus image"""
+    size = dimensions_for(megapixels)
+    # One stream per (kind, size), so adding kinds or sizes never shifts the others
+    rng = random.Random(f"{seed}:{kind}:{megapixels}")
+    if kind in ('photo', 'heic'):
+        image = _photo(size, rng)
+    elif kind == 'alpha':
+        image = _graphic(size, rng)
+    elif kind == 'palette':
+        graphic = _graphic(size, rng)
+        image = graphic.quantize(256, method=Image.Quantize.FASTOCTREE)
+        graphic.close()
+    elif kind == 'tiff16':
+        image = _tiff16(size, rng)
+    else:
+        raise ValueError(f'Unknown corpus kind: {kind}')
+
+    try:
+        fmt, extension, data = _encode(image, kind)
+    finally:
+        image.close()
+    name = f"{kind}_{megapixels:g}mp"
+    return CorpusImage(name, kind, megapixels, size[0], size[1], fmt, f"{name}.{extension}", data)
+
+
+def available_kinds(kinds: Sequence[str] = KINDS) -> List[str]:
+    """The requested kinds this environment can produce (HEIC needs pillow-heif)"""
+    return [kind for kind in kinds if kind != 'heic' or HEIC_SUPPORT]
+
+
+def generate_corpus(sizes: Sequence[float], kinds: Sequence[str] = KINDS,
+                    seed: int = DEFAULT_SEED) -> Iterator[CorpusImage]:
+    """Yield corpus images one at a time so only one large image is in memory"""
+    for megapixels in sizes:
+        for kind in available_kinds(kinds):
+            yield build_image(kind, megapixels, seed)
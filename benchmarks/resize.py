@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+QuickUtil resize benchmark
+Times every resample tier against the old single-pass LANCZOS resize
+('exact') on the synthetic corpus, for a few output widths. Each tier is
+scored by its speedup over 'exact' and by PSNR against the 'exact' output,
+so a faster tier can be checked to still look the same.
+
+Usage (from the repository root):
+    python -m benchmarks.resize --sizes 12,50 --widths 320,1280 --output resize.json
+    python -m benchmarks.resize --sizes 12 --min-psnr 40 --fail-on-regression
+"""
+
+import argparse
+import io
+import json
+import sys
+import time
+from typing import List, Optional
+
+from PIL import Image
+
+from benchmarks.corpus import DEFAULT_SEED, KINDS, CorpusImage, generate_corpus
+from benchmarks.run import parse_list, percentile
+from format_select import psnr
+import resample
+
+DEFAULT_SIZES = '12,50'
+DEFAULT_WIDTHS = '320,1280'
+REFERENCE_TIER = 'exact'
+# Above this PSNR (dB) against the reference the difference is not visible
+DEFAULT_MIN_PSNR = 40.0
+
+
+def run_tiers(image: Image.Image, size, repeat: int) -> dict:
+    """p50/p99 latency and output of every tier for one source and target size"""
+    timings = {}
+    for tier in resample.TIERS:
+        latencies = []
+        output = None
+        for _ in range(repeat):
+            if output:
+                output.close()
+            started = time.perf_counter()
+            output = resample.resize(image, size, tier)
+            latencies.append(time.perf_counter() - started)
+        timings[tier] = (latencies, output)
+    return timings
+
+
+def bench_image(corpus_image: CorpusImage, widths: List[int], repeat: int) -> List[dict]:
+    image = Image.open(io.BytesIO(corpus_image.data))
+    image.load()
+    results = []
+    try:
+        for width in widths:
+            if width >= image.width:
+                continue
+            size = (width, max(1, round(image.height * width / image.width)))
+            timings = run_tiers(image, size, repeat)
+            reference_latencies, reference = timings[REFERENCE_TIER]
+            reference_p50 = percentile(reference_latencies, 0.50)
+            for tier, (latencies, output) in timings.items():
+                p50 = percentile(latencies, 0.50)
+                results.append({
+                    'input': corpus_image.name,
+                    'kind': corpus_image.kind,
+                    'megapixels': corpus_image.megapixels,
+                    'output_size': f"{size[0]}x{size[1]}",
+                    'tier': tier,
+                    'runs': len(latencies),
+                    'p50_ms': round(p50 * 1000, 3),
+                    'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+                    'speedup': round(reference_p50 / p50, 2) if p50 else None,
+                    'psnr_db': None if tier == REFERENCE_TIER else round(psnr(output, reference), 2)
+                })
+            for _, output in timings.values():
+                output.close()
+    finally:
+        image.close()
+    return results
+
+
+def print_table(results: List[dict]) -> None:
+    print(f"{'input':<18} {'output':<11} {'tier':<9} {'p50 ms':>9} {'p99 ms':>9} {'speedup':>8} {'PSNR dB':>8}")
+    for r in results:
+        score = '-' if r['psnr_db'] is None else f"{r['psnr_db']:.1f}"
+        print(f"{r['input']:<18} {r['output_size']:<11} {r['tier']:<9} {r['p50_ms']:>9.1f} "
+              f"{r['p99_ms']:>9.1f} {r['speedup']:>7.2f}x {score:>8}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='QuickUtil resize benchmark')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='Megapixel sizes (default: %(default)s)')
+    parser.add_argument('--kinds', default=','.join(KINDS), help='Corpus kinds (default: %(default)s)')
+    parser.add_argument('--widths', default=DEFAULT_WIDTHS, help='Output widths (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed resizes per tier (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--output', default='resize-results.json', help='Where to write the results JSON')
+    parser.add_argument('--min-psnr', type=float, default=DEFAULT_MIN_PSNR,
+                        help="Lowest acceptable PSNR of the default tier against 'exact' (default: %(default)s)")
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help='Exit with status 1 when the default tier is below --min-psnr or slower than exact')
+    args = parser.parse_args(argv)
+
+    results = []
+    for image in generate_corpus(parse_list(args.sizes, float), parse_list(args.kinds), args.seed):
+        print(f"▶ {image.name} ({image.width}x{image.height})", flush=True)
+        results.extend(bench_image(image, parse_list(args.widths, int), args.repeat))
+
+    print_table(results)
+    with open(args.output, 'w') as f:
+        json.dump({'default_tier': resample.DEFAULT_TIER, 'results': results}, f, indent=2)
+    print(f"\n💾 Results written to {args.output}")
+
+    failures = [
+        r for r in results
+        if r['tier'] == resample.DEFAULT_TIER and r['tier'] != REFERENCE_TIER
+        and (r['psnr_db'] < args.min_psnr or r['speedup'] < 1)
+    ]
+    if failures:
+        print(f"\n⚠️ {len(failures)} case(s) where '{resample.DEFAULT_TIER}' is below {args.min_psnr} dB or slower than '{REFERENCE_TIER}':")
+        for r in failures:
+            print(f"  {r['input']} -> {r['output_size']}: {r['psnr_db']} dB, {r['speedup']}x")
+        if args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
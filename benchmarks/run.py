@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+QuickUtil codec benchmark
+Runs the synthetic corpus through the /compress endpoints of both Flask apps
+(app.py and image_compression_api.py) with their test clients, for every
+output format x quality x mode, and records throughput, p50/p99 latency,
+output bytes and peak memory per case. Results are written as JSON and can be
+compared against a saved baseline.
+
+Usage (from the repository root):
+    python -m benchmarks.run --sizes 1,12,50 --output bench.json
+    python -m benchmarks.run --sizes 1 --baseline benchmarks/baseline.json --fail-on-regression
+"""
+
+import argparse
+import io
+import json
+import logging
+import math
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+import PIL
+
+from benchmarks.corpus import DEFAULT_SEED, HEIC_SUPPORT, KINDS, CorpusImage, generate_corpus
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_SIZES = '1,12,50'
+DEFAULT_QUALITIES = '60,85'
+APP_FORMATS = ['jpeg', 'webp', 'png'] + (['heic'] if HEIC_SUPPORT else [])
+API_MODES = {'aggressive': 'JPEG', 'webp': 'WEBP', 'lossless': 'PNG'}
+
+# Default regression thresholds (relative to the baseline)
+LATENCY_TOLERANCE = 0.15
+SIZE_TOLERANCE = 0.02
+MEMORY_TOLERANCE = 0.25
+MEMORY_NOISE_FLOOR = 8 * 1024 * 1024  # smaller peak-memory changes are noise
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+@dataclass
+class Case:
+    """One benchmarked request shape"""
+    app: str        # 'app' (app.py) or 'api' (image_compression_api.py)
+    format: str
+    quality: int
+    mode: str
+
+    def label(self) -> str:
+        return f"{self.app}/{self.mode}/{self.format}/q{self.quality}"
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (falls back to the peak)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        if resource is None:
+            return 0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+class MemorySampler:
+    """Background thread tracking the highest RSS seen while a case runs"""
+
+    def __init__(self, interval: float = 0.002):
+        self.interval = interval
+        self.baseline = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.baseline = self.peak = current_rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    @property
+    def delta(self) -> int:
+        return self.peak - self.baseline
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def load_apps(names: List[str]):
+    """Import the apps configured for benchmarking; returns their test clients
+    and the scratch directory to remove afterwards.
+
+    Every request must take the full decode/encode path, so the result cache
+    TTL is zero; the decode budget is raised so 50MP inputs are admitted; and
+    all scratch folders live in a private temporary directory.
+    """
+    os.environ.setdefault('RESULT_CACHE_TTL', '0')
+    os.environ.setdefault('DECODE_MEMORY_MB', '4096')
+    os.environ.setdefault('JOB_WORKERS', '0')
+    scratch = tempfile.tempdir = tempfile.mkdtemp(prefix='quickutil_bench_')
+
+    clients = {}
+    if 'app' in names:
+        import app as web_app
+        clients['app'] = web_app.app.test_client()
+    if 'api' in names:
+        import image_compression_api
+        clients['api'] = image_compression_api.app.test_client()
+    # Per-request INFO lines would dominate small-image timings
+    logging.disable(logging.INFO)
+    return clients, scratch
+
+
+def build_cases(apps: List[str], qualities: List[int]) -> List[Case]:
+    cases = []
+    if 'app' in apps:
+        for fmt in APP_FORMATS:
+            # PNG output ignores quality
+            for quality in (qualities[-1:] if fmt == 'png' else qualities):
+                cases.append(Case('app', fmt, quality, 'standard'))
+    if 'api' in apps:
+        for mode, fmt in API_MODES.items():
+            for quality in (qualities[-1:] if mode == 'lossless' else qualities):
+                cases.append(Case('api', fmt, quality, mode))
+    return cases
+
+
+def post(client, case: Case, image: CorpusImage, effort: Optional[str] = None):
+    upload = (io.BytesIO(image.data), image.filename)
+    if case.app == 'app':
+        data = {'file': upload, 'format': case.format, 'quality': str(case.quality)}
+    else:
+        data = {'image': upload, 'format': case.format, 'quality': str(case.quality), 'mode': case.mode}
+    if effort:
+        data['effort'] = effort
+    response = client.post('/compress', data=data, content_type='multipart/form-data')
+    body = response.get_data()
+    response.close()
+    return response.status_code, body
+
+
+def run_case(client, case: Case, image: CorpusImage, repeat: int, warmup: int,
+             effort: Optional[str] = None) -> dict:
+    """Time `repeat` requests (after `warmup` untimed ones) for one input"""
+    result = {
+        **asdict(case),
+        'case': case.label(),
+        'input': image.name,
+        'kind': image.kind,
+        'megapixels': image.megapixels,
+        'input_bytes': len(image.data)
+    }
+    for _ in range(warmup):
+        status, _ = post(client, case, image, effort)
+        if status != 200:
+            break
+
+    latencies = []
+    output_bytes = 0
+    status = 200
+    with MemorySampler() as memory:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            status, body = post(client, case, image, effort)
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                result['error'] = body[:200].decode('utf-8', 'replace')
+                break
+            output_bytes = len(body)
+
+    result['status'] = status
+    if status != 200:
+        return result
+    total = sum(latencies)
+    result.update({
+        'runs': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'throughput_mps': round(image.megapixels * len(latencies) / total, 3),
+        'requests_per_s': round(len(latencies) / total, 3),
+        'output_bytes': output_bytes,
+        'peak_memory_bytes': max(0, memory.delta)
+    })
+    return result
+
+
+def result_key(result: dict) -> str:
+    return f"{result['case']}@{result['input']}"
+
+
+def compare(results: dict, baseline: dict, latency_tolerance: float = LATENCY_TOLERANCE,
+            size_tolerance: float = SIZE_TOLERANCE, memory_tolerance: float = MEMORY_TOLERANCE) -> List[dict]:
+    """Regressions of `results` against `baseline` (cases missing from either are skipped)"""
+    corpus_changed = {
+        item['name'] for item in results['corpus']
+        if any(old['name'] == item['name'] and old['sha256'] != item['sha256'] for old in baseline['corpus'])
+    }
+    previous = {result_key(r): r for r in baseline['results'] if r.get('status') == 200}
+    regressions = []
+    for current in results['results']:
+        old = previous.get(result_key(current))
+        if old is None:
+            continue
+        if current.get('status') != 200:
+            regressions.append({'key': result_key(current), 'metric': 'status',
+                                'baseline': 200, 'current': current.get('status')})
+            continue
+        checks = [('p50_ms', latency_tolerance, 0), ('output_bytes', size_tolerance, 0),
+                  ('peak_memory_bytes', memory_tolerance, MEMORY_NOISE_FLOOR)]
+        if current['input'] in corpus_changed:
+            # Different input bytes: only timing and memory are still comparable
+            checks = [check for check in checks if check[0] != 'output_bytes']
+        for metric, tolerance, floor in checks:
+            limit = old[metric] * (1 + tolerance)
+            if current[metric] > limit and current[metric] - old[metric] > floor:
+                regressions.append({
+                    'key': result_key(current),
+                    'metric': metric,
+                    'baseline': old[metric],
+                    'current': current[metric],
+                    'change': round(current[metric] / old[metric] - 1, 4) if old[metric] else None
+                })
+    return regressions
+
+
+def print_table(results: List[dict]) -> None:
+    print(f"{'case':<32} {'input':<18} {'p50 ms':>9} {'p99 ms':>9} {'MP/s':>8} {'out KB':>9} {'mem MB':>8}")
+    for r in results:
+        if r['status'] != 200:
+            print(f"{r['case']:<32} {r['input']:<18} HTTP {r['status']}: {r.get('error', '')[:60]}")
+            continue
+        print(f"{r['case']:<32} {r['input']:<18} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} "
+              f"{r['throughput_mps']:>8.2f} {r['output_bytes'] / 1024:>9.1f} "
+              f"{r['peak_memory_bytes'] / (1024 * 1024):>8.1f}")
+
+
+def parse_list(value: str, cast=str) -> List:
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='QuickUtil codec benchmark')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='Megapixel sizes (default: %(default)s)')
+    parser.add_argument('--kinds', default=','.join(KINDS), help='Corpus kinds (default: %(default)s)')
+    parser.add_argument('--qualities', default=DEFAULT_QUALITIES, help='Quality levels (default: %(default)s)')
+    parser.add_argument('--apps', default='app,api', help='Apps to benchmark: app, api (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed requests per case (default: %(default)s)')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed requests per case (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--effort', help='Encoder effort tier sent with every request (default: server default)')
+    parser.add_argument('--output', default='benchmark-results.json', help='Where to write the results JSON')
+    parser.add_argument('--baseline', help='Results JSON to compare against')
+    parser.add_argument('--save-baseline', help='Also write the results to this baseline path')
+    parser.add_argument('--latency-tolerance', type=float, default=LATENCY_TOLERANCE)
+    parser.add_argument('--size-tolerance', type=float, default=SIZE_TOLERANCE)
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with status 1 on regressions')
+    args = parser.parse_args(argv)
+
+    apps = parse_list(args.apps)
+    qualities = parse_list(args.qualities, int)
+    clients, scratch = load_apps(apps)
+    cases = build_cases(apps, qualities)
+
+    corpus, results = [], []
+    started = time.time()
+    try:
+        for image in generate_corpus(parse_list(args.sizes, float), parse_list(args.kinds), args.seed):
+            corpus.append(image.describe())
+            print(f"▶ {image.name} ({image.width}x{image.height}, {len(image.data) / 1024:.0f}KB)", flush=True)
+            for case in cases:
+                results.append(run_case(clients[case.app], case, image, args.repeat, args.warmup, args.effort))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(started)),
+            'duration_s': round(time.time() - started, 1),
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'pillow_heif': getattr(sys.modules.get('pillow_heif'), '__version__', None),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'warmup': args.warmup,
+            'effort': args.effort
+        },
+        'corpus': corpus,
+        'results': results
+    }
+
+    print_table(results)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Results written to {args.output}")
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.latency_tolerance, args.size_tolerance)
+        if regressions:
+            print(f"\n⚠️ {len(regressions)} regression(s) against {args.baseline}:")
+            for item in regressions:
+                print(f"  {item['key']}: {item['metric']} {item['baseline']} -> {item['current']}")
+            if args.fail_on_regression:
+                return 1
+        else:
+            print(f"\n✅ No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+QuickUtil encoder effort selection
+Maps an effort tier (fast / balanced / max) to per-codec encoder settings:
+WebP method, PNG compress_level, JPEG optimize/progressive and the HEIF x265
+preset. A request can pin a tier (`effort`) or give a latency budget
+(`deadline_ms`); with a budget the highest tier whose predicted encode time
+still fits the remaining time is used. Predictions come from a per-process
+cost model (seconds per megapixel for each format and tier) that starts from
+rough priors and is updated with the timing of every encode.
+"""
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Slowest (smallest output) first
+EFFORTS = ('max', 'balanced', 'fast')
+# Requests that ask for nothing keep the smallest-output settings they always had
+DEFAULT_EFFORT = os.environ.get('ENCODE_EFFORT', 'max')
+# Offline work (background jobs) is not latency bound
+OFFLINE_EFFORT = 'max'
+# PNG palette handling (see png_engine): keep truecolor, exact palettes only,
+# or lossy 256-colour quantization
+PNG_QUANTIZE_MODES = ('off', 'lossless', 'lossy')
+DEFAULT_PNG_QUANTIZE = 'lossless'
+
+CODEC_SETTINGS: Dict[str, Dict[str, Dict[str, Any]]] = {
+    'JPEG': {
+        'fast': {'optimize': False, 'progressive': False},
+        'balanced': {'optimize': True, 'progressive': False},
+        'max': {'optimize': True, 'progressive': True},
+    },
+    'WEBP': {
+        'fast': {'method': 2},
+        'balanced': {'method': 4},
+        'max': {'method': 6},
+    },
+    'PNG': {
+        'fast': {'compress_level': 1},
+        'balanced': {'compress_level': 6},
+        'max': {'compress_level': 9, 'optimize': True},
+    },
+    'HEIF': {
+        'fast': {'enc_params': {'preset': 'ultrafast'}},
+        'balanced': {'enc_params': {'preset': 'faster'}},
+        'max': {'enc_params': {'preset': 'medium'}},
+    },
+}
+
+# Starting cost estimates in seconds per megapixel, replaced by measurements
+PRIOR_COSTS = {
+    ('JPEG', 'fast'): 0.01, ('JPEG', 'balanced'): 0.02, ('JPEG', 'max'): 0.04,
+    ('WEBP', 'fast'): 0.05, ('WEBP', 'balanced'): 0.10, ('WEBP', 'max'): 0.25,
+    ('PNG', 'fast'): 0.03, ('PNG', 'balanced'): 0.08, ('PNG', 'max'): 0.40,
+    ('HEIF', 'fast'): 0.10, ('HEIF', 'balanced'): 0.20, ('HEIF', 'max'): 0.60,
+}
+# Weight of each new measurement in the moving average
+COST_SMOOTHING = 0.2
+# Encodes smaller than this say more about fixed overhead than per-pixel cost
+MIN_SAMPLE_PIXELS = 64 * 1024
+
+
+def codec_settings(format: str, effort: str) -> Dict[str, Any]:
+    """Encoder keyword arguments for a Pillow format name and effort tier"""
+    return dict(CODEC_SETTINGS.get(format.upper(), {}).get(effort, {}))
+
+
+class EncodeCostModel:
+    """Exponentially weighted seconds-per-megapixel for each (format, effort)"""
+
+    def __init__(self, priors: Optional[Dict[Tuple[str, str], float]] = None):
+        self._costs = dict(priors if priors is not None else PRIOR_COSTS)
+        self._samples: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def predict(self, format: str, effort: str, pixels: int) -> float:
+        """Predicted encode time in seconds (0 for formats without a model)"""
+        with self._lock:
+            cost = self._costs.get((format.upper(), effort), 0.0)
+        return cost * pixels / 1_000_000
+
+    def record(self, format: str, effort: str, pixels: int, seconds: float) -> None:
+        if pixels < MIN_SAMPLE_PIXELS:
+            return
+        key = (format.upper(), effort)
+        cost = seconds / (pixels / 1_000_000)
+        with self._lock:
+            previous = self._costs.get(key)
+            self._costs[key] = cost if previous is None else previous + COST_SMOOTHING * (cost - previous)
+            self._samples[key] = self._samples.get(key, 0) + 1
+
+    def choose(self, format: str, pixels: int, budget: float) -> str:
+        """Highest effort predicted to finish within `budget` seconds"""
+        for effort in EFFORTS:
+            if self.predict(format, effort, pixels) <= budget:
+                return effort
+        return EFFORTS[-1]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                f"{fmt.lower()}/{effort}": {
+                    'seconds_per_mp': round(cost, 4),
+                    'samples': self._samples.get((fmt, effort), 0)
+                }
+                for (fmt, effort), cost in sorted(self._costs.items())
+            }
+
+
+cost_model = EncodeCostModel()
+
+
+@dataclass
+class EncodePolicy:
+    """Effort requested for one request: a fixed tier or a deadline.
+
+    `deadline` is a time.perf_counter() value. Every effort actually used is
+    appended to `used`, for response headers. `png_quantize` and `dither`
+    control PNG palette conversion.
+    """
+    effort: Optional[str] = None
+    deadline: Optional[float] = None
+    png_quantize: str = DEFAULT_PNG_QUANTIZE
+    dither: bool = True
+    used: List[str] = field(default_factory=list)
+
+    def resolve(self, format: str, pixels: int) -> str:
+        if self.deadline is not None:
+            effort = cost_model.choose(format, pixels, self.deadline - time.perf_counter())
+        else:
+            effort = self.effort or DEFAULT_EFFORT
+        self.used.append(effort)
+        return effort
+
+    def settings(self, format: str, size: Tuple[int, int]) -> Tuple[str, Dict[str, Any]]:
+        """(effort, encoder keyword arguments) for encoding an image of `size`"""
+        effort = self.resolve(format, size[0] * size[1])
+        return effort, codec_settings(format, effort)
+
+    def summary(self) -> str:
+        """Efforts used so far, e.g. 'balanced' or 'fast,max'"""
+        return ','.join(sorted(set(self.used))) or self.effort or DEFAULT_EFFORT
+
+    def cache_params(self, effort: Optional[str] = None) -> Dict[str, Any]:
+        """The parts of the policy that change output bytes, for result cache
+        keys (and stored job params). A deadline policy is keyed by the lowest
+        effort it actually used, so call this after encoding."""
+        if effort is None:
+            if self.deadline is None:
+                effort = self.effort or DEFAULT_EFFORT
+            else:
+                effort = max(self.used, key=EFFORTS.index) if self.used else EFFORTS[-1]
+        return {'effort': effort, 'png_quantize': self.png_quantize, 'dither': self.dither}
+
+    def cache_lookups(self, format: str, pixels: int) -> List[Dict[str, Any]]:
+        """cache_params() of every cached result this policy may be answered
+        with, best first: its own tier, or for a deadline every tier at or
+        above the one the deadline allows now for `pixels` of `format`"""
+        if self.deadline is None:
+            return [self.cache_params()]
+        allowed = cost_model.choose(format, pixels, self.deadline - time.perf_counter())
+        return [self.cache_params(effort) for effort in EFFORTS[:EFFORTS.index(allowed) + 1]]
+
+
+def parse_policy(effort: Optional[str] = None, deadline_ms: Optional[str] = None,
+                 default: Optional[str] = None) -> EncodePolicy:
+    """Build a policy from the `effort` / `deadline_ms` request fields.
+
+    The deadline counts from now; `effort` wins when both are given.
+    """
+    if effort is not None and str(effort).strip() != '':
+        name = str(effort).strip().lower()
+        if name not in EFFORTS:
+            raise ValueError(f"Invalid effort: {effort}. Supported: {', '.join(EFFORTS)}")
+        return EncodePolicy(effort=name)
+    if deadline_ms is not None and str(deadline_ms).strip() != '':
+        try:
+            budget = float(deadline_ms) / 1000
+        except ValueError:
+            raise ValueError(f'Invalid deadline_ms: {deadline_ms}')
+        if budget <= 0:
+            raise ValueError(f'Invalid deadline_ms: {deadline_ms}')
+        return EncodePolicy(deadline=time.perf_counter() + budget)
+    return EncodePolicy(effort=default or DEFAULT_EFFORT)
+
+
+def policy_from_form(form, default: Optional[str] = None, allow_deadline: bool = True) -> EncodePolicy:
+    """Policy from the effort, deadline_ms, png_quantize and dither fields of a
+    request form (or any mapping with .get(), such as stored job params)"""
+    policy = parse_policy(form.get('effort'), form.get('deadline_ms') if allow_deadline else None, default)
+    png_quantize = form.get('png_quantize')
+    if png_quantize is not None and str(png_quantize).strip() != '':
+        policy.png_quantize = str(png_quantize).strip().lower()
+        if policy.png_quantize not in PNG_QUANTIZE_MODES:
+            raise ValueError(f"Invalid png_quantize: {png_quantize}. Supported: {', '.join(PNG_QUANTIZE_MODES)}")
+    dither = form.get('dither')
+    if dither is not None and str(dither).strip() != '':
+        policy.dither = dither is True or str(dither).lower() in ('1', 'true', 'yes', 'on')
+    return policy
+
+
+def timed_save(image, output, format: str, policy: Optional[EncodePolicy], **params) -> str:
+    """image.save() with the policy's settings layered under `params`; the
+    encode time feeds the cost model. Returns the effort used."""
+    policy = policy or EncodePolicy()
+    effort, settings = policy.settings(format, image.size)
+    settings.update(params)
+    started = time.perf_counter()
+    image.save(output, format=format, **settings)
+    cost_model.record(format, effort, image.width * image.height, time.perf_counter() - started)
+    return effort
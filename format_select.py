@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+QuickUtil automatic output format
+Classifies an image on a small proxy (unique colours, alpha use, edge
+density) to shortlist the output formats worth trying:
+- graphic: at most 256 colours, PNG only
+- screenshot: few colours and many hard edges, PNG and WebP
+- photo: everything else, WebP and JPEG
+- alpha: transparency in use, PNG and WebP (JPEG cannot keep it)
+The caller encodes the shortlist concurrently and keeps the smallest result
+whose PSNR against the source, measured on the proxy, meets the floor.
+"""
+
+import io
+import logging
+import math
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageChops, ImageFilter, ImageStat
+
+logger = logging.getLogger(__name__)
+
+PROXY_SIZE = 256
+PALETTE_COLORS = 256
+SCREENSHOT_COLORS = 4096
+# Share of proxy pixels on a hard edge above which few-colour content is a screenshot
+SCREENSHOT_EDGE_DENSITY = 0.05
+EDGE_THRESHOLD = 32
+# Lossy results below this PSNR (dB) against the source are rejected
+DEFAULT_MIN_PSNR = 36.0
+DEFAULT_CANDIDATES = ('jpeg', 'png', 'webp')
+LOSSLESS_FORMATS = {'png'}
+
+SHORTLISTS = {
+    'graphic': ('png',),
+    'screenshot': ('png', 'webp'),
+    'photo': ('webp', 'jpeg'),
+    'alpha': ('png', 'webp'),
+}
+
+
+@dataclass
+class ContentProfile:
+    """Cheap statistics of an image, taken on a NEAREST-sampled proxy"""
+    kind: str
+    colors: Optional[int]  # None: more than SCREENSHOT_COLORS
+    alpha: bool
+    edge_density: float
+
+    def describe(self) -> str:
+        colors = self.colors if self.colors is not None else f">{SCREENSHOT_COLORS}"
+        return f"{self.kind} (colors={colors}, alpha={self.alpha}, edges={self.edge_density:.3f})"
+
+
+def _proxy_size(size: Tuple[int, int]) -> Tuple[int, int]:
+    scale = min(1.0, PROXY_SIZE / max(size))
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def _comparable(image: Image.Image) -> Image.Image:
+    """8-bit RGB/RGBA/L copy for pixel statistics"""
+    if image.mode.startswith('I'):
+        return image.convert('I').point(lambda v: v / 257).convert('L')
+    if image.mode in ('RGB', 'RGBA', 'L'):
+        return image
+    return image.convert('RGBA' if 'A' in image.getbands() or image.has_transparency_data else 'RGB')
+
+
+def quality_proxy(image: Image.Image) -> Image.Image:
+    """Box-filtered proxy used for PSNR comparisons"""
+    return _comparable(image).resize(_proxy_size(image.size), Image.Resampling.BOX)
+
+
+def classify(image: Image.Image) -> ContentProfile:
+    sample = _comparable(image.resize(_proxy_size(image.size), Image.Resampling.NEAREST))
+    alpha = 'A' in sample.getbands() and sample.getchannel('A').getextrema()[0] < 255
+    colors = sample.getcolors(maxcolors=SCREENSHOT_COLORS)
+    colors = len(colors) if colors is not None else None
+    edges = sample.convert('L').filter(ImageFilter.FIND_EDGES)
+    histogram = edges.histogram()
+    edge_density = sum(histogram[EDGE_THRESHOLD:]) / max(1, sample.width * sample.height)
+
+    if alpha:
+        kind = 'alpha'
+    elif colors is not None and colors <= PALETTE_COLORS:
+        kind = 'graphic'
+    elif colors is not None and edge_density >= SCREENSHOT_EDGE_DENSITY:
+        kind = 'screenshot'
+    else:
+        kind = 'photo'
+    return ContentProfile(kind, colors, alpha, edge_density)
+
+
+def shortlist(profile: ContentProfile, allowed: Sequence[str] = DEFAULT_CANDIDATES) -> List[str]:
+    """Formats worth a trial encode, best guess first; falls back to anything allowed"""
+    candidates = [fmt for fmt in SHORTLISTS[profile.kind] if fmt in allowed]
+    if not candidates:
+        candidates = [fmt for fmt in allowed if not (profile.alpha and fmt == 'jpeg')] or list(allowed)
+    return candidates
+
+
+def psnr(image: Image.Image, reference: Image.Image) -> float:
+    """Peak signal-to-noise ratio in dB of two same-size images (inf when identical)"""
+    a, b = _comparable(image), _comparable(reference)
+    if a.mode != b.mode:
+        mode = 'RGBA' if 'A' in a.getbands() + b.getbands() else 'RGB'
+        a, b = a.convert(mode), b.convert(mode)
+    stat = ImageStat.Stat(ImageChops.difference(a, b))
+    mse = sum(s / n for s, n in zip(stat.sum2, stat.count)) / len(stat.count)
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def encoded_psnr(data: io.BytesIO, reference_proxy: Image.Image) -> float:
+    """PSNR of an encoded result against the source proxy, decoding at reduced scale"""
+    data.seek(0)
+    with Image.open(data) as decoded:
+        # JPEG decodes straight to about the proxy size
+        decoded.draft(decoded.mode, reference_proxy.size)
+        proxy = _comparable(decoded).resize(reference_proxy.size, Image.Resampling.BOX)
+    data.seek(0)
+    return psnr(proxy, reference_proxy)
@@ -0,0 +1,33 @@
+"""
+Gunicorn settings for both apps (gunicorn --config gunicorn.conf.py app:app).
+The app is preloaded in the master so codec plugins are loaded and warmed
+once and shared copy-on-write with every worker, including ones forked later
+to replace recycled workers. PRELOAD=0 imports the app in each worker instead.
+WORKER_CLASS=uvicorn.workers.UvicornWorker serves the ASGI entry points
+(asgi:app, asgi:compression_api) instead.
+"""
+
+import gc
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+worker_class = os.environ.get('WORKER_CLASS', 'sync')
+preload_app = os.environ.get('PRELOAD', '1') == '1'
+
+if preload_app:
+    # Read by warmup.py when the master imports the app
+    os.environ['QUICKUTIL_PRELOAD'] = '1'
+
+
+def when_ready(server):
+    # Move the preloaded objects out of the collector's reach so collections
+    # in the workers do not write to (and un-share) their pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Background threads (sweeper, job workers) belong to each worker
+    import warmup
+    warmup.run_after_fork()
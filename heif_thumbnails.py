@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+QuickUtil HEIF thumbnail extraction
+pillow-heif lists a HEIF's embedded thumbnails (info['thumbnails']) but has
+no call that decodes one. This module makes a copy of the file in which the
+chosen thumbnail is the primary image, which pillow-heif then opens and
+decodes like any other HEIF, without touching the full-size image:
+- `pitm` (primary item) is pointed at the thumbnail item
+- the thumbnail's `thmb` reference is renamed to a type libheif ignores, so
+  the item is listed as a top-level image instead of being attached to the
+  old primary
+Both edits overwrite bytes in place, so every offset in `iloc` stays valid.
+The cost is one copy of the (compressed) file.
+"""
+
+import logging
+import struct
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Reference type that replaces 'thmb'; unknown types are skipped by readers
+DETACHED_REFERENCE = b'xthm'
+
+
+@dataclass
+class Box:
+    type: bytes
+    start: int
+    # Offset of the payload (after the size/type header)
+    body: int
+    end: int
+
+
+@dataclass
+class Thumbnail:
+    item_id: int
+    size: Tuple[int, int]
+    # Offset of the type field of its 'thmb' reference box
+    reference_type: int
+
+
+def _boxes(data: bytes, start: int, end: int) -> Iterator[Box]:
+    position = start
+    while position + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, position)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, position + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - position
+        if size < header or position + size > end:
+            raise ValueError(f"Truncated {box_type!r} box")
+        yield Box(box_type, position, position + header, position + size)
+        position += size
+
+
+def _child(data: bytes, parent: Box, box_type: bytes, full_box: bool = False) -> Optional[Box]:
+    start = parent.body + (4 if full_box else 0)
+    return next((box for box in _boxes(data, start, parent.end) if box.type == box_type), None)
+
+
+def _item_id(data: bytes, offset: int, wide: bool) -> Tuple[int, int]:
+    """(item ID, offset after it); IDs are 32-bit in version 1+ boxes"""
+    if wide:
+        return struct.unpack_from('>I', data, offset)[0], offset + 4
+    return struct.unpack_from('>H', data, offset)[0], offset + 2
+
+
+def _primary(data: bytes, pitm: Box) -> Tuple[int, int, bool]:
+    """(primary item ID, its offset, 32-bit)"""
+    wide = data[pitm.body] >= 1
+    item_id, _ = _item_id(data, pitm.body + 4, wide)
+    return item_id, pitm.body + 4, wide
+
+
+def _thumbnail_references(data: bytes, iref: Box, primary: int) -> Dict[int, int]:
+    """Thumbnail item ID -> offset of the type of its 'thmb' box, for thumbnails of the primary"""
+    wide = data[iref.body] >= 1
+    references = {}
+    for box in _boxes(data, iref.body + 4, iref.end):
+        if box.type != b'thmb':
+            continue
+        item_id, offset = _item_id(data, box.body, wide)
+        count = struct.unpack_from('>H', data, offset)[0]
+        offset += 2
+        targets = []
+        for _ in range(count):
+            target, offset = _item_id(data, offset, wide)
+            targets.append(target)
+        if primary in targets:
+            references[item_id] = box.start + 4
+    return references
+
+
+def _item_sizes(data: bytes, iprp: Box) -> Dict[int, Tuple[int, int]]:
+    """Item ID -> encoded size from its 'ispe' property"""
+    ipco = _child(data, iprp, b'ipco')
+    ipma = _child(data, iprp, b'ipma')
+    if ipco is None or ipma is None:
+        return {}
+    properties: List[Box] = list(_boxes(data, ipco.body, ipco.end))
+    version = data[ipma.body]
+    flags = int.from_bytes(data[ipma.body + 1:ipma.body + 4], 'big')
+    offset = ipma.body + 4
+    entries = struct.unpack_from('>I', data, offset)[0]
+    offset += 4
+    sizes = {}
+    for _ in range(entries):
+        item_id, offset = _item_id(data, offset, version >= 1)
+        count = data[offset]
+        offset += 1
+        for _ in range(count):
+            if flags & 1:
+                index = struct.unpack_from('>H', data, offset)[0] & 0x7FFF
+                offset += 2
+            else:
+                index = data[offset] & 0x7F
+                offset += 1
+            if 0 < index <= len(properties) and properties[index - 1].type == b'ispe':
+                # FullBox header, then 32-bit width and height
+                sizes[item_id] = struct.unpack_from('>II', data, properties[index - 1].body + 4)
+    return sizes
+
+
+def thumbnails(data: bytes) -> Tuple[Optional[Box], List[Thumbnail]]:
+    """The 'pitm' box and the thumbnails of the primary image, smallest first"""
+    meta = next((box for box in _boxes(data, 0, len(data)) if box.type == b'meta'), None)
+    if meta is None:
+        return None, []
+    pitm = _child(data, meta, b'pitm', full_box=True)
+    iref = _child(data, meta, b'iref', full_box=True)
+    iprp = _child(data, meta, b'iprp', full_box=True)
+    if pitm is None or iref is None or iprp is None:
+        return pitm, []
+    primary, _, _ = _primary(data, pitm)
+    sizes = _item_sizes(data, iprp)
+    found = [
+        Thumbnail(item_id, sizes[item_id], reference_type)
+        for item_id, reference_type in _thumbnail_references(data, iref, primary).items()
+        if item_id in sizes
+    ]
+    return pitm, sorted(found, key=lambda thumbnail: max(thumbnail.size))
+
+
+def thumbnail_file(data: bytes, min_box: int) -> Optional[Tuple[bytes, Tuple[int, int]]]:
+    """A HEIF whose primary image is the smallest thumbnail with a larger
+    side of at least `min_box`, and that thumbnail's encoded size; None when
+    there is none or the container cannot be read"""
+    try:
+        pitm, found = thumbnails(data)
+        chosen = next((thumbnail for thumbnail in found if max(thumbnail.size) >= min_box), None)
+        if chosen is None:
+            return None
+        _, offset, wide = _primary(data, pitm)
+        if not wide and chosen.item_id > 0xFFFF:
+            return None
+    except (ValueError, struct.error, IndexError) as e:
+        logger.warning(f"⚠️ Unreadable HEIF container, no thumbnail: {e}")
+        return None
+    patched = bytearray(data)
+    patched[offset:offset + (4 if wide else 2)] = chosen.item_id.to_bytes(4 if wide else 2, 'big')
+    patched[chosen.reference_type:chosen.reference_type + 4] = DETACHED_REFERENCE
+    return bytes(patched), chosen.size
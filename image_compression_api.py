@@ -6,16 +6,34 @@ Deployed on Render.com for high-quality image compression
 
 import os
 import io
+import hashlib
 import logging
+import multiprocessing
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from datetime import datetime
 from typing import Dict, Any, Optional, Tuple
 from PIL import Image, ImageFilter, ImageEnhance
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 import base64
 import tempfile
 import shutil
 
+from admission import MemoryBudget, estimate_decoded_bytes
+from artifact_store import Sweeper
+from encode_effort import EFFORTS, OFFLINE_EFFORT, PNG_QUANTIZE_MODES, EncodePolicy, policy_from_form, timed_save
+from image_decode import decode_for_bounds
+from image_probe import ProbeError, check_accepted, probe_stream
+import jpeg_lossless
+import metrics
+from png_engine import encode_png
+import resample
+import warmup
+from result_cache import ResultCache, hash_stream
+from size_search import fit_to_size, parse_size
+from zip_stream import ZipStreamWriter
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -26,12 +44,55 @@ CORS(app)
 # Constants
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
 SUPPORTED_FORMATS = ['JPEG', 'PNG', 'WEBP', 'BMP', 'TIFF']
+# Inputs Pillow decodes here (no HEIF plugin is registered in this app)
+INPUT_FORMATS = {'JPEG', 'MPO', 'PNG', 'GIF', 'BMP', 'WEBP', 'TIFF'}
+LOSSY_FORMATS = ['JPEG', 'WEBP']
+
+# Batch execution: worker pool size (also the per-request concurrency cap),
+# the decoded-pixel memory budget shared by all batch requests of this worker,
+# and input formats whose decode holds the GIL and therefore runs in processes
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', min(4, os.cpu_count() or 1)))
+BATCH_MEMORY_BUDGET = int(os.environ.get('BATCH_MEMORY_MB', 512)) * 1024 * 1024
+BATCH_PROCESS_FORMATS = {f.strip().upper() for f in os.environ.get('BATCH_PROCESS_FORMATS', 'GIF').split(',') if f.strip()}
+# Decoded image plus one converted/resized working copy
+BATCH_WORKING_SET_FACTOR = 2
+
+# Encoded results, shared on disk with the other workers
+result_cache = ResultCache()
+# Expires them in one process at a time (see artifact_store)
+sweeper = Sweeper(result_cache.store, result_cache.sweep_disk)
+warmup.start_after_fork(sweeper.start)
+
+batch_budget = MemoryBudget(BATCH_MEMORY_BUDGET)
+
+# Per-stage latency and memory histograms, served on /metrics
+request_metrics = metrics.install(app, gauges={
+    'quickutil_batch_budget_bytes': lambda: batch_budget.capacity,
+    'quickutil_batch_budget_in_use_bytes': lambda: batch_budget.in_use
+})
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix='batch')
+if warmup.PRELOADED:
+    # gunicorn master: warm the codecs once; workers inherit them on fork
+    warmup.warm_codecs(['JPEG', 'PNG', 'WEBP'])
+_batch_process_pool = None
+_batch_process_pool_lock = threading.Lock()
+
+def get_batch_process_pool() -> ProcessPoolExecutor:
+    """Process pool for GIL-bound decoders, created on first use"""
+    global _batch_process_pool
+    with _batch_process_pool_lock:
+        if _batch_process_pool is None:
+            _batch_process_pool = ProcessPoolExecutor(
+                max_workers=BATCH_MAX_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _batch_process_pool
 
 class ImageCompressor:
     """Professional image compression with multiple algorithms"""
     
     @staticmethod
-    def compress_aggressive(image: Image.Image, quality: int = 85, optimize: bool = True) -> Tuple[Image.Image, dict]:
+    def compress_aggressive(image: Image.Image, quality: int = 85) -> Tuple[Image.Image, dict]:
         """Aggressive compression with quality optimization"""
         
         # Convert to RGB if necessary for JPEG compression
@@ -44,10 +105,8 @@ class ImageCompressor:
                 background.paste(image, mask=image.split()[-1])
                 image = background
         
-        # Progressive JPEG for better compression
+        # Huffman optimization and progressive scans come from the effort tier
         compression_params = {
-            'optimize': optimize,
-            'progressive': True,
             'quality': quality
         }
         
@@ -61,10 +120,8 @@ class ImageCompressor:
         if image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
             image = image.convert('RGBA')
         
-        compression_params = {
-            'optimize': True,
-            'compress_level': 9  # Maximum PNG compression
-        }
+        # Palette conversion and zlib settings are chosen by png_engine
+        compression_params = {}
         
         return image, compression_params
     
@@ -72,18 +129,50 @@ class ImageCompressor:
     def compress_webp(image: Image.Image, quality: int = 85, lossless: bool = False) -> Tuple[Image.Image, dict]:
         """WebP compression (modern format)"""
         
+        # method (compression effort) comes from the effort tier
         compression_params = {
-            'optimize': True,
             'quality': quality if not lossless else 100,
-            'lossless': lossless,
-            'method': 6  # Maximum compression effort
+            'lossless': lossless
         }
         
         return image, compression_params
     
+    @staticmethod
+    def output_format_for(output_format: Optional[str], compression_mode: str) -> str:
+        """Format actually written for a requested format and compression mode"""
+        if compression_mode == 'lossless' or output_format == 'PNG':
+            return 'PNG'
+        if compression_mode == 'webp' or output_format == 'WEBP':
+            return 'WEBP'
+        return 'JPEG'
+    
+    @staticmethod
+    def encode(image: Image.Image, output_format: Optional[str], compression_mode: str = 'aggressive',
+               quality: int = 85, effort: Optional[EncodePolicy] = None) -> Tuple[io.BytesIO, Image.Image, str]:
+        """Compress and encode with the algorithm matching the mode/format,
+        using the encoder settings of the effort policy"""
+        
+        format_used = ImageCompressor.output_format_for(output_format, compression_mode)
+        with metrics.stage('convert'):
+            if format_used == 'PNG':
+                compressed_image, params = ImageCompressor.compress_lossless(image)
+            elif format_used == 'WEBP':
+                compressed_image, params = ImageCompressor.compress_webp(image, quality)
+            else:  # aggressive
+                compressed_image, params = ImageCompressor.compress_aggressive(image, quality)
+        
+        output_buffer = io.BytesIO()
+        with metrics.stage('encode'):
+            if format_used == 'PNG':
+                # Palette and zlib settings are chosen per image
+                encode_png(compressed_image, output_buffer, effort)
+            else:
+                timed_save(compressed_image, output_buffer, format_used, effort, **params)
+        return output_buffer, compressed_image, format_used
+    
     @staticmethod
     def resize_image(image: Image.Image, max_width: int = None, max_height: int = None, 
-                    maintain_aspect: bool = True) -> Image.Image:
+                    maintain_aspect: bool = True, resize_quality: str = resample.DEFAULT_TIER) -> Image.Image:
         """Smart image resizing"""
         
         if not max_width and not max_height:
@@ -106,8 +195,8 @@ class ImageCompressor:
             new_width = max_width or width
             new_height = max_height or height
         
-        # Use LANCZOS for high-quality resizing
-        return image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        # Integer pre-shrink for large ratios, LANCZOS (per tier) for the last step
+        return resample.resize(image, (max(1, new_width), max(1, new_height)), resize_quality)
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -142,48 +231,135 @@ def compress_image():
         if quality < 10 or quality > 100:
             return jsonify({'error': 'Quality must be between 10 and 100'}), 400
         
+        try:
+            target_size = parse_size(request.form.get('target_size'))
+            resize_quality = resample.parse_tier(request.form.get('resize_quality'))
+            effort = policy_from_form(request.form)
+            keep_icc, orientation = jpeg_lossless.parse_options(
+                request.form.get('keep_icc'), request.form.get('orientation')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         if output_format not in SUPPORTED_FORMATS:
             return jsonify({'error': f'Unsupported format. Supported: {SUPPORTED_FORMATS}'}), 400
         
+        # Reject non-images, unsupported formats and decompression bombs from
+        # the header, and oversized uploads from their length, before reading
+        # the upload into memory
+        try:
+            probe = probe_stream(file.stream)
+            check_accepted(probe, INPUT_FORMATS)
+        except ProbeError as e:
+            return jsonify({'error': str(e)}), e.status
+        file.stream.seek(0, 2)
+        upload_size = file.stream.tell()
+        file.stream.seek(0)
+        if upload_size > MAX_FILE_SIZE:
+            return jsonify({'error': 'File too large. Maximum size: 50MB'}), 400
+        # mode=strip rewrites JPEG marker segments only (no decode, no re-encode)
+        if compression_mode == 'strip' and probe.format not in ('JPEG', 'MPO'):
+            return jsonify({'error': 'mode=strip needs a JPEG input'}), 400
+        
         # Read and validate image
         image_data = file.read()
-        if len(image_data) > MAX_FILE_SIZE:
-            return jsonify({'error': 'File too large. Maximum size: 50MB'}), 400
         
         original_size = len(image_data)
+        metrics.set_labels(
+            input_format=os.path.splitext(file.filename)[1].lstrip('.'),
+            output_format=ImageCompressor.output_format_for(output_format, compression_mode)
+        )
         
-        # Open image with PIL
-        try:
-            image = Image.open(io.BytesIO(image_data))
-            original_format = image.format
-            original_mode = image.mode
-            original_dimensions = image.size
-        except Exception as e:
-            return jsonify({'error': f'Invalid image file: {str(e)}'}), 400
-        
-        # Apply resizing if requested
-        if max_width or max_height:
+        # Look the result up first; a hit skips decode and encode entirely
+        source_hash = hashlib.sha256(image_data).hexdigest()
+        
+        def cache_key(policy_params):
+            return result_cache.make_key(
+                source_hash, endpoint='compress', quality=quality,
+                format=output_format, mode=compression_mode, max_width=max_width, max_height=max_height,
+                target_size=target_size, resize_quality=resize_quality, **policy_params,
+                strip=f"{keep_icc},{orientation}" if compression_mode == 'strip' else None
+            )
+        cached = result_cache.get_any(
+            cache_key(params) for params in effort.cache_lookups(
+                ImageCompressor.output_format_for(output_format, compression_mode), probe.pixels or 0
+            )
+        )
+        search = None
+        if cached:
+            compressed_data = cached.data
+            result_info = dict(cached.metadata, decode_path='none')
+        elif compression_mode == 'strip':
+            try:
+                with metrics.stage('strip'):
+                    stripped = jpeg_lossless.strip_jpeg(image_data, keep_icc, orientation)
+            except ValueError as e:
+                return jsonify({'error': f'Invalid image file: {str(e)}'}), 400
+            compressed_data = stripped.data
+            result_info = {
+                'original_format': 'JPEG',
+                'output_format': 'JPEG',
+                'original_dimensions': f"{probe.size[0]}x{probe.size[1]}" if probe.size else 'unknown',
+                'final_dimensions': f"{stripped.size[0]}x{stripped.size[1]}",
+                'decode_path': 'none',
+                'quality': quality
+            }
+            result_cache.put(cache_key(effort.cache_params()), compressed_data, result_info)
+        else:
+            # Open image with PIL
+            try:
+                with metrics.stage('probe'):
+                    image = Image.open(io.BytesIO(image_data))
+                metrics.set_labels(input_format=image.format)
+                original_format = image.format
+                original_mode = image.mode
+                original_dimensions = image.size
+            except Exception as e:
+                return jsonify({'error': f'Invalid image file: {str(e)}'}), 400
+            
+            # Decode at reduced scale when the output is much smaller
             max_w = int(max_width) if max_width else None
             max_h = int(max_height) if max_height else None
-            image = ImageCompressor.resize_image(image, max_w, max_h)
-        
-        # Apply compression based on mode
-        compressor = ImageCompressor()
-        
-        if compression_mode == 'lossless' or output_format == 'PNG':
-            compressed_image, params = compressor.compress_lossless(image)
-            output_format = 'PNG'
-        elif compression_mode == 'webp' or output_format == 'WEBP':
-            compressed_image, params = compressor.compress_webp(image, quality)
-            output_format = 'WEBP'
-        else:  # aggressive
-            compressed_image, params = compressor.compress_aggressive(image, quality)
-            output_format = 'JPEG'
-        
-        # Save compressed image to memory
-        output_buffer = io.BytesIO()
-        compressed_image.save(output_buffer, format=output_format, **params)
-        compressed_data = output_buffer.getvalue()
+            with metrics.stage('decode'):
+                image, decode_path = decode_for_bounds(image, max_w, max_h)
+            
+            # Apply resizing if requested
+            if max_w or max_h:
+                with metrics.stage('resize'):
+                    image = ImageCompressor.resize_image(image, max_w, max_h, resize_quality=resize_quality)
+            
+            # Apply compression based on mode and save to memory
+            if target_size:
+                # Highest quality (up to the requested one) that fits the target size
+                resolved_format = ImageCompressor.output_format_for(output_format, compression_mode)
+                search = fit_to_size(
+                    image,
+                    lambda img, q: ImageCompressor.encode(img, output_format, compression_mode, q, effort)[0],
+                    target_size,
+                    max_quality=quality,
+                    lossy=resolved_format in LOSSY_FORMATS
+                )
+                output_buffer, quality, final_size = search.data, search.quality, search.size
+                output_format = resolved_format
+            else:
+                output_buffer, compressed_image, output_format = ImageCompressor.encode(
+                    image, output_format, compression_mode, quality, effort
+                )
+                final_size = compressed_image.size
+            compressed_data = output_buffer.getvalue()
+            
+            result_info = {
+                'original_format': original_format or 'Unknown',
+                'output_format': output_format,
+                'original_dimensions': f"{original_dimensions[0]}x{original_dimensions[1]}",
+                'final_dimensions': f"{final_size[0]}x{final_size[1]}",
+                'decode_path': decode_path,
+                'quality': quality
+            }
+            result_cache.put(cache_key(effort.cache_params()), compressed_data, result_info)
+        
+        output_format = result_info['output_format']
+        quality = result_info.get('quality', quality)
         compressed_size = len(compressed_data)
         
         # Calculate compression metrics
@@ -191,7 +367,7 @@ def compress_image():
         size_reduction = original_size - compressed_size
         
         # Prepare response
-        output_buffer.seek(0)
+        output_buffer = io.BytesIO(compressed_data)
         
         # Generate filename
         original_name = os.path.splitext(file.filename)[0]
@@ -211,12 +387,20 @@ def compress_image():
         response.headers['X-Compressed-Size'] = str(compressed_size)
         response.headers['X-Compression-Ratio'] = f"{compression_ratio:.2f}"
         response.headers['X-Size-Reduction'] = str(size_reduction)
-        response.headers['X-Original-Format'] = original_format or 'Unknown'
+        response.headers['X-Original-Format'] = result_info['original_format']
         response.headers['X-Output-Format'] = output_format
-        response.headers['X-Original-Dimensions'] = f"{original_dimensions[0]}x{original_dimensions[1]}"
-        response.headers['X-Final-Dimensions'] = f"{compressed_image.size[0]}x{compressed_image.size[1]}"
+        response.headers['X-Original-Dimensions'] = result_info['original_dimensions']
+        response.headers['X-Final-Dimensions'] = result_info['final_dimensions']
         response.headers['X-Compression-Mode'] = compression_mode
         response.headers['X-Quality'] = str(quality)
+        response.headers['X-Decode-Path'] = result_info['decode_path']
+        response.headers['X-Encode-Effort'] = effort.summary()
+        response.headers['X-Cache'] = 'HIT' if cached else 'MISS'
+        if target_size:
+            response.headers['X-Target-Size'] = str(target_size)
+            response.headers['X-Target-Met'] = str(compressed_size <= target_size).lower()
+            response.headers['X-Target-Iterations'] = str(search.full_encodes if search else 0)
+            response.headers['X-Target-Time-Ms'] = f"{search.elapsed_ms:.1f}" if search else '0'
         
         logger.info(f"Compressed {file.filename}: {original_size} → {compressed_size} bytes ({compression_ratio:.2f}% reduction)")
         
@@ -226,6 +410,140 @@ def compress_image():
         logger.error(f"Compression error: {str(e)}")
         return jsonify({'error': f'Compression failed: {str(e)}'}), 500
 
+def encode_batch_item(source, compression_mode: str, quality: int,
+                      effort: Optional[EncodePolicy] = None) -> Tuple[bytes, str]:
+    """Decode and compress one batch input given as a stream or raw bytes"""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with Image.open(source) as image:
+        with metrics.stage('decode'):
+            image.load()
+        output_buffer, _, format_used = ImageCompressor.encode(
+            image, None, compression_mode, quality, effort
+        )
+    return output_buffer.getvalue(), format_used
+
+def run_batch_item(file, input_format: str, compression_mode: str, quality: int,
+                   keep_data: bool = False, effort: Optional[EncodePolicy] = None) -> Tuple[Dict[str, Any], Optional[bytes]]:
+    """Compress one uploaded file of a batch (runs on the batch executor).
+    
+    Returns the result entry and, when keep_data is set, the compressed bytes.
+    """
+    effort = effort or EncodePolicy()
+    stream = file.stream
+    stream.seek(0, 2)
+    original_size = stream.tell()
+    
+    cache_key = result_cache.make_key(
+        hash_stream(stream), endpoint='batch-compress', quality=quality, mode=compression_mode, **effort.cache_params()
+    )
+    cached = result_cache.get(cache_key)
+    if cached:
+        compressed_data = cached.data
+        format_used = cached.metadata.get('output_format', 'JPEG')
+    else:
+        if input_format in BATCH_PROCESS_FORMATS:
+            future = get_batch_process_pool().submit(encode_batch_item, stream.read(), compression_mode, quality, effort)
+            compressed_data, format_used = future.result()
+        else:
+            compressed_data, format_used = encode_batch_item(stream, compression_mode, quality, effort)
+        result_cache.put(cache_key, compressed_data, {'output_format': format_used})
+    
+    compressed_size = len(compressed_data)
+    compression_ratio = (original_size - compressed_size) / original_size * 100
+    
+    result = {
+        'filename': file.filename,
+        'original_size': original_size,
+        'compressed_size': compressed_size,
+        'compression_ratio': round(compression_ratio, 2),
+        'size_reduction': original_size - compressed_size,
+        'output_format': format_used,
+        'status': 'success'
+    }
+    return result, (compressed_data if keep_data else None)
+
+def iter_batch_results(files, compression_mode: str, quality: int, concurrency: int, keep_data: bool = False,
+                       effort: Optional[EncodePolicy] = None):
+    """Yield (index, result, compressed data) for each file as soon as it finishes.
+    
+    At most `concurrency` files are in flight, and each one is submitted only
+    after its estimated decoded size has been reserved against batch_budget.
+    Per-file failures become error entries instead of aborting the batch.
+    """
+    in_flight = {}  # future -> (index, filename)
+    
+    def collect(done):
+        for future in done:
+            index, filename = in_flight.pop(future)
+            try:
+                result, data = future.result()
+            except Exception as e:
+                result, data = {'filename': filename, 'status': 'error', 'error': str(e)}, None
+            yield index, result, data
+    
+    for index, file in enumerate(files):
+        if file.filename == '':
+            continue
+        
+        try:
+            with metrics.stage('probe'), Image.open(file.stream) as probe:
+                input_format = probe.format
+                needed = estimate_decoded_bytes(probe) * BATCH_WORKING_SET_FACTOR
+            file.stream.seek(0)
+        except Exception as e:
+            yield index, {'filename': file.filename, 'status': 'error', 'error': str(e)}, None
+            continue
+        
+        if not batch_budget.fits(needed):
+            yield index, {
+                'filename': file.filename,
+                'status': 'error',
+                'error': f'Image too large: needs {needed / (1024 * 1024):.1f}MB to process'
+            }, None
+            continue
+        
+        while len(in_flight) >= concurrency:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            yield from collect(done)
+        
+        batch_budget.reserve(needed)
+        future = batch_executor.submit(
+            metrics.propagate(run_batch_item), file, input_format, compression_mode, quality, keep_data, effort
+        )
+        future.add_done_callback(lambda _, needed=needed: batch_budget.release(needed))
+        in_flight[future] = (index, file.filename)
+    
+    while in_flight:
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        yield from collect(done)
+
+def batch_summary(results, total_files: int) -> Dict[str, Any]:
+    """Batch response body (also used as the ZIP manifest)"""
+    return {
+        'results': results,
+        'total_files': total_files,
+        'successful': len([r for r in results if r['status'] == 'success']),
+        'failed': len([r for r in results if r['status'] == 'error'])
+    }
+
+def stream_batch_zip(files, compression_mode: str, quality: int, concurrency: int,
+                     effort: Optional[EncodePolicy] = None):
+    """Generate a ZIP of the compressed files, each entry sent as it finishes,
+    followed by a manifest.json entry with the per-file metadata"""
+    writer = ZipStreamWriter()
+    results = []
+    for _, result, data in iter_batch_results(files, compression_mode, quality, concurrency, keep_data=True, effort=effort):
+        if data is not None:
+            base_name = os.path.splitext(result['filename'])[0]
+            extension = result['output_format'].lower().replace('jpeg', 'jpg')
+            archive_name = writer.unique_name(f"{base_name}_compressed.{extension}")
+            result['archive_name'] = archive_name
+            yield writer.add(archive_name, data)
+        results.append(result)
+    yield writer.add_json('manifest.json', batch_summary(results, len(files)))
+    yield writer.close()
+
 @app.route('/batch-compress', methods=['POST'])
 def batch_compress():
     """Batch image compression endpoint"""
@@ -240,74 +558,43 @@ def batch_compress():
         output_format = request.form.get('format', 'JPEG').upper()
         compression_mode = request.form.get('mode', 'aggressive')
         
-        results = []
+        concurrency = request.form.get('concurrency', BATCH_MAX_WORKERS, type=int)
+        concurrency = max(1, min(BATCH_MAX_WORKERS, concurrency))
+        # One fixed tier for the whole batch (no per-item deadline)
+        try:
+            effort = policy_from_form(request.form, default=OFFLINE_EFFORT, allow_deadline=False)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # ZIP mode streams the compressed files back instead of only their sizes
+        if request.form.get('output', 'json').lower() == 'zip':
+            return Response(
+                stream_with_context(stream_batch_zip(files, compression_mode, quality, concurrency, effort)),
+                mimetype='application/zip',
+                headers={'Content-Disposition': 'attachment; filename=compressed_images.zip'}
+            )
         
-        for file in files:
-            if file.filename == '':
-                continue
-                
-            try:
-                # Process each image individually
-                # (This is a simplified version - in production, you'd want proper batch processing)
-                image_data = file.read()
-                original_size = len(image_data)
-                
-                image = Image.open(io.BytesIO(image_data))
-                
-                # Apply compression
-                compressor = ImageCompressor()
-                
-                if compression_mode == 'lossless':
-                    compressed_image, params = compressor.compress_lossless(image)
-                    format_used = 'PNG'
-                elif compression_mode == 'webp':
-                    compressed_image, params = compressor.compress_webp(image, quality)
-                    format_used = 'WEBP'
-                else:
-                    compressed_image, params = compressor.compress_aggressive(image, quality)
-                    format_used = 'JPEG'
-                
-                # Get compressed data size (without saving)
-                output_buffer = io.BytesIO()
-                compressed_image.save(output_buffer, format=format_used, **params)
-                compressed_size = len(output_buffer.getvalue())
-                
-                compression_ratio = (original_size - compressed_size) / original_size * 100
-                
-                results.append({
-                    'filename': file.filename,
-                    'original_size': original_size,
-                    'compressed_size': compressed_size,
-                    'compression_ratio': round(compression_ratio, 2),
-                    'size_reduction': original_size - compressed_size,
-                    'status': 'success'
-                })
-                
-            except Exception as e:
-                results.append({
-                    'filename': file.filename,
-                    'status': 'error',
-                    'error': str(e)
-                })
-        
-        return jsonify({
-            'results': results,
-            'total_files': len(files),
-            'successful': len([r for r in results if r['status'] == 'success']),
-            'failed': len([r for r in results if r['status'] == 'error'])
-        })
+        ordered = sorted(iter_batch_results(files, compression_mode, quality, concurrency, effort=effort), key=lambda item: item[0])
+        return jsonify(batch_summary([result for _, result, _ in ordered], len(files)))
         
     except Exception as e:
         logger.error(f"Batch compression error: {str(e)}")
         return jsonify({'error': f'Batch compression failed: {str(e)}'}), 500
 
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Result cache hit/miss/eviction counters for this worker"""
+    return jsonify(result_cache.stats())
+
 @app.route('/formats', methods=['GET'])
 def get_supported_formats():
     """Get supported image formats"""
     return jsonify({
         'supported_formats': SUPPORTED_FORMATS,
         'max_file_size': MAX_FILE_SIZE,
-        'compression_modes': ['aggressive', 'lossless', 'webp']
+        'compression_modes': ['aggressive', 'lossless', 'webp', 'strip'],
+        'effort_tiers': list(EFFORTS),
+        'png_quantize_modes': list(PNG_QUANTIZE_MODES)
     })
 
 if __name__ == '__main__':
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+QuickUtil decode planner
+Picks the cheapest way to decode an image when the caller only needs it to fit
+within max_width/max_height: an embedded preview, the smallest HEIF thumbnail
+that covers the target, JPEG DCT scaling (Image.draft), an integer
+Image.reduce pre-shrink, or a plain full decode.
+"""
+
+import io
+import logging
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from PIL import ExifTags, Image
+
+import heif_thumbnails
+
+try:
+    import pillow_heif
+except ImportError:
+    pillow_heif = None
+
+logger = logging.getLogger(__name__)
+
+# Keep at least this much oversampling for the final LANCZOS pass, the same
+# margin Image.thumbnail() uses for its own draft/reduce shortcut.
+REDUCING_GAP = 2.0
+
+# Decode paths, reported to clients in the X-Decode-Path header
+DECODE_FULL = 'full'
+DECODE_DRAFT = 'draft'
+DECODE_REDUCE = 'reduce'
+DECODE_PREVIEW = 'preview'
+DECODE_THUMBNAIL = 'thumbnail'
+
+# Modes Image.reduce() can work on directly
+REDUCIBLE_MODES = {'L', 'LA', 'RGB', 'RGBA', 'RGBa', 'La', 'I', 'F'}
+
+
+@dataclass
+class DecodePlan:
+    """How an image will be decoded for a requested bounding box"""
+    path: str
+    source_size: Tuple[int, int]
+    target_size: Tuple[int, int]
+    # Size of the buffer the decoder will allocate, for memory admission
+    decoded_size: Tuple[int, int]
+    reduce_factor: int = 1
+    # Embedded JPEG preview, or (thumbnail path) a HEIF whose primary image is the chosen thumbnail
+    preview: Optional[bytes] = None
+
+
+def fit_within(size: Tuple[int, int], max_width: Optional[int] = None,
+               max_height: Optional[int] = None) -> Tuple[int, int]:
+    """Size the image would have after being fitted into the bounds (never upscales)"""
+    width, height = size
+    ratios = []
+    if max_width:
+        ratios.append(max_width / width)
+    if max_height:
+        ratios.append(max_height / height)
+    if not ratios or min(ratios) >= 1:
+        return size
+    ratio = min(ratios)
+    return max(1, round(width * ratio)), max(1, round(height * ratio))
+
+
+def _exif_thumbnail(image: Image.Image) -> Optional[bytes]:
+    """Return the JPEG thumbnail stored in EXIF IFD1, if any"""
+    exif_data = image.info.get('exif')
+    if not exif_data:
+        return None
+    try:
+        ifd1 = image.getexif().get_ifd(ExifTags.IFD.IFD1)
+        offset = ifd1.get(0x0201)  # JPEGInterchangeFormat
+        length = ifd1.get(0x0202)  # JPEGInterchangeFormatLength
+    except Exception:
+        return None
+    if not offset or not length:
+        return None
+    # Offsets are relative to the TIFF header, which follows "Exif\0\0"
+    start = offset + 6 if exif_data.startswith(b'Exif\x00\x00') else offset
+    return exif_data[start:start + length] or None
+
+
+def _find_preview(image: Image.Image, target: Tuple[int, int]) -> Optional[Tuple[bytes, Tuple[int, int]]]:
+    """Return an embedded preview (and its size) that is at least as large as the target"""
+    thumbnail = _exif_thumbnail(image)
+    if not thumbnail:
+        return None
+    try:
+        with Image.open(io.BytesIO(thumbnail)) as preview:
+            preview_size = preview.size
+    except Exception:
+        return None
+
+    # Previews with a different aspect ratio are letterboxed or rotated
+    width, height = image.size
+    if abs(preview_size[0] / preview_size[1] - width / height) > 0.01:
+        return None
+    if preview_size[0] < target[0] or preview_size[1] < target[1]:
+        return None
+    return thumbnail, preview_size
+
+
+def _heif_thumbnail(image: Image.Image, target: Tuple[int, int]) -> Optional[Tuple[bytes, Tuple[int, int]]]:
+    """The smallest HEIF thumbnail at least as large as the target, as a
+    standalone HEIF (see heif_thumbnails), and its displayed size"""
+    if pillow_heif is None or image.format != 'HEIF' or image.fp is None:
+        return None
+    # pillow-heif lists thumbnails by their larger side: skip the container
+    # read when none is large enough
+    if not any(box >= max(target) for box in image.info.get('thumbnails') or []):
+        return None
+    position = image.fp.tell()
+    try:
+        image.fp.seek(0)
+        data = image.fp.read()
+    finally:
+        image.fp.seek(position)
+    extracted = heif_thumbnails.thumbnail_file(data, max(target))
+    if extracted is None:
+        return None
+    thumbnail_data, _ = extracted
+    try:
+        # Header only: the size after rotation/mirroring, and proof libheif accepts the copy
+        with Image.open(io.BytesIO(thumbnail_data)) as thumbnail:
+            size = thumbnail.size
+    except Exception as e:
+        logger.warning(f"⚠️ HEIF thumbnail not readable, decoding in full: {e}")
+        return None
+    # The thumbnail must cover the target in the orientation of the full image
+    if size[0] < target[0] or size[1] < target[1]:
+        return None
+    return thumbnail_data, size
+
+
+def _draft_size(source_size: Tuple[int, int], requested: Tuple[int, int]) -> Tuple[int, int]:
+    """Size libjpeg will decode to for a draft request (same rule as JpegImageFile.draft)"""
+    scale = min(source_size[0] // requested[0], source_size[1] // requested[1])
+    for denominator in (8, 4, 2, 1):
+        if scale >= denominator:
+            return (-(-source_size[0] // denominator), -(-source_size[1] // denominator))
+    return source_size
+
+
+def _draft_request(target_size: Tuple[int, int]) -> Tuple[int, int]:
+    return (int(target_size[0] * REDUCING_GAP), int(target_size[1] * REDUCING_GAP))
+
+
+def plan_decode(image: Image.Image, max_width: Optional[int] = None,
+                max_height: Optional[int] = None) -> DecodePlan:
+    """Choose a decode path from the header-declared size and the requested bounds.
+
+    The image must not have been loaded yet, otherwise only the reduce path
+    can still save any work.
+    """
+    source_size = image.size
+    target_size = fit_within(source_size, max_width, max_height)
+    if target_size == source_size:
+        return DecodePlan(DECODE_FULL, source_size, target_size, source_size)
+
+    preview = _find_preview(image, target_size)
+    if preview:
+        data, preview_size = preview
+        return DecodePlan(DECODE_PREVIEW, source_size, target_size, preview_size, preview=data)
+
+    thumbnail = _heif_thumbnail(image, target_size)
+    if thumbnail:
+        data, thumbnail_size = thumbnail
+        return DecodePlan(DECODE_THUMBNAIL, source_size, target_size, thumbnail_size, preview=data)
+
+    if image.format == 'JPEG' and image.im is None:
+        decoded_size = _draft_size(source_size, _draft_request(target_size))
+        return DecodePlan(DECODE_DRAFT, source_size, target_size, decoded_size)
+
+    factor = int(min(source_size[0] / target_size[0],
+                     source_size[1] / target_size[1]) / REDUCING_GAP)
+    if factor >= 2 and image.mode in REDUCIBLE_MODES:
+        return DecodePlan(DECODE_REDUCE, source_size, target_size, source_size, reduce_factor=factor)
+
+    return DecodePlan(DECODE_FULL, source_size, target_size, source_size)
+
+
+def apply_decode_plan(image: Image.Image, plan: DecodePlan) -> Tuple[Image.Image, str]:
+    """Decode the image following the plan.
+
+    Returns the decoded image and the path that was actually taken. When a new
+    image object is returned the source image is closed.
+    """
+    if plan.path in (DECODE_PREVIEW, DECODE_THUMBNAIL):
+        preview = Image.open(io.BytesIO(plan.preview))
+        preview.load()
+        # Drops the container (and for HEIF its primary image) before anything else is decoded
+        image.close()
+        return preview, plan.path
+
+    if plan.path == DECODE_DRAFT:
+        image.draft(image.mode, _draft_request(plan.target_size))
+        image.load()
+        return image, DECODE_DRAFT if image.size != plan.source_size else DECODE_FULL
+
+    if plan.path == DECODE_REDUCE:
+        image.load()
+        reduced = image.reduce(plan.reduce_factor)
+        image.close()
+        return reduced, DECODE_REDUCE
+
+    image.load()
+    return image, DECODE_FULL
+
+
+def decode_for_bounds(image: Image.Image, max_width: Optional[int] = None,
+                      max_height: Optional[int] = None,
+                      plan: Optional[DecodePlan] = None) -> Tuple[Image.Image, str]:
+    """Plan and run the cheapest decode that still covers max_width/max_height.
+
+    A plan made earlier (e.g. to size a memory reservation) can be passed in.
+    """
+    plan = plan or plan_decode(image, max_width, max_height)
+    decoded, path = apply_decode_plan(image, plan)
+    logger.info(f"🧭 Decode path: {path} ({plan.source_size[0]}x{plan.source_size[1]} -> "
+                f"{decoded.width}x{decoded.height}, target {plan.target_size[0]}x{plan.target_size[1]})")
+    return decoded, path
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+QuickUtil header probe
+Reads format, dimensions, mode, frame count, EXIF orientation and ICC
+presence from the first bytes of an image, before anything is spooled or
+decoded. Bytes are fed in as they arrive and parsed at growing sizes
+(PROBE_STEPS) until the header is found:
+- JPEG, PNG, GIF, BMP and TIFF headers are parsed by Pillow's own openers,
+  which stop reading at the first scan / image data
+- WebP and HEIF openers read the whole file, so their headers (VP8/VP8L/VP8X
+  chunk, ISOBMFF 'ispe' property) are parsed here unless the input is already
+  complete
+Values that live after the pixel data (GIF/TIFF frame counts, HEIF EXIF) are
+None unless the whole input fits in the probe buffer.
+"""
+
+import io
+import logging
+import struct
+from dataclasses import asdict, dataclass
+from typing import Callable, Collection, Iterator, Optional, Tuple
+
+from PIL import Image
+
+from admission import pixel_buffer_bytes
+
+logger = logging.getLogger(__name__)
+
+# Buffer sizes at which parsing is attempted; the last one is the limit
+PROBE_STEPS = (32, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024)
+PROBE_LIMIT = PROBE_STEPS[-1]
+# Formats whose frame count is known from the header alone
+HEADER_FRAME_FORMATS = {'JPEG', 'MPO', 'PNG'}
+HEIF_BRANDS = {b'heic', b'heix', b'hevc', b'hevx', b'heim', b'heis', b'mif1', b'msf1'}
+AVIF_BRANDS = {b'avif', b'avis'}
+EXIF_ORIENTATION = 0x0112
+
+
+class ProbeError(Exception):
+    """The input is not an image that can be accepted; `status` is the HTTP status to answer with"""
+
+    def __init__(self, message: str, status: int = 415):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class ImageProbe:
+    """What the header says about an image (None: not known from the header)"""
+    format: str
+    size: Optional[Tuple[int, int]] = None
+    mode: Optional[str] = None
+    frame_count: Optional[int] = None
+    orientation: Optional[int] = None
+    has_icc: Optional[bool] = None
+    header_bytes: int = 0
+
+    @property
+    def pixels(self) -> Optional[int]:
+        return self.size[0] * self.size[1] if self.size else None
+
+    def decode_bytes(self) -> Optional[int]:
+        """Bytes Pillow allocates to decode one frame at full size"""
+        return pixel_buffer_bytes(self.size, self.mode or 'RGBA') if self.size else None
+
+    def to_dict(self) -> dict:
+        info = asdict(self)
+        info['format'] = self.format.lower()
+        info['width'], info['height'] = self.size or (None, None)
+        del info['size']
+        info['decode_bytes'] = self.decode_bytes()
+        return info
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """Pillow format name from the magic bytes, or None"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'GIF'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'TIFF'
+    if head.startswith(b'BM'):
+        return 'BMP'
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in HEIF_BRANDS:
+            return 'HEIF'
+        if brand in AVIF_BRANDS:
+            return 'AVIF'
+    return None
+
+
+def _from_pillow(image: Image.Image, complete: bool) -> ImageProbe:
+    frame_count = None
+    if complete or image.format in HEADER_FRAME_FORMATS:
+        frame_count = getattr(image, 'n_frames', 1)
+    orientation = None
+    try:
+        if image.format == 'TIFF':
+            orientation = image.tag_v2.get(EXIF_ORIENTATION)
+        elif image.info.get('exif'):
+            # Exif.load() only parses the bytes; getexif() can decode PNG pixels
+            exif = Image.Exif()
+            exif.load(image.info['exif'])
+            orientation = exif.get(EXIF_ORIENTATION)
+    except Exception:
+        pass
+    return ImageProbe(
+        format=image.format,
+        size=image.size,
+        mode=image.mode,
+        frame_count=frame_count,
+        orientation=orientation,
+        has_icc=bool(image.info.get('icc_profile'))
+    )
+
+
+def _webp_header(data: bytes) -> Optional[ImageProbe]:
+    """Canvas size and flags from the first chunk of a WebP file"""
+    if len(data) < 30:
+        return None
+    chunk = data[12:16]
+    if chunk == b'VP8X':
+        flags = data[20]
+        width = 1 + int.from_bytes(data[24:27], 'little')
+        height = 1 + int.from_bytes(data[27:30], 'little')
+        animated = bool(flags & 0x02)
+        return ImageProbe(
+            'WEBP', (width, height), 'RGBA' if flags & 0x10 else 'RGB',
+            frame_count=None if animated else 1, has_icc=bool(flags & 0x20)
+        )
+    if chunk == b'VP8L':
+        bits = int.from_bytes(data[21:25], 'little')
+        width, height = 1 + (bits & 0x3FFF), 1 + ((bits >> 14) & 0x3FFF)
+        return ImageProbe('WEBP', (width, height), 'RGBA' if bits >> 28 & 1 else 'RGB',
+                          frame_count=1, has_icc=False)
+    if chunk == b'VP8 ' and data[23:26] == b'\x9d\x01\x2a':
+        width, height = struct.unpack('<HH', data[26:30])
+        return ImageProbe('WEBP', (width & 0x3FFF, height & 0x3FFF), 'RGB', frame_count=1, has_icc=False)
+    raise ProbeError('Invalid WebP header')
+
+
+def _boxes(data: bytes, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """(type, payload start, box end) of the ISOBMFF boxes in data[start:end];
+    a box running past the end of `data` ends the walk with end = -1"""
+    offset = start
+    while offset + 8 <= end:
+        size, kind = struct.unpack('>I4s', data[offset:offset + 8])
+        header = 8
+        if size == 1:
+            if offset + 16 > len(data):
+                yield kind, offset, -1
+                return
+            size = struct.unpack('>Q', data[offset + 8:offset + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            raise ProbeError('Invalid HEIF box')
+        box_end = offset + size
+        yield kind, offset + header, box_end if box_end <= len(data) else -1
+        if box_end > len(data):
+            return
+        offset = box_end
+
+
+def _heif_header(data: bytes, format: str) -> Optional[ImageProbe]:
+    """Largest 'ispe' (image spatial extents) property in the meta box"""
+    for kind, start, end in _boxes(data, 0, len(data)):
+        if kind != b'meta':
+            continue
+        if end < 0:
+            return None
+        probe = ImageProbe(format, mode='RGB', has_icc=False)
+        # meta is a full box: 4 bytes of version and flags before its children
+        for child, child_start, child_end in _boxes(data, start + 4, end):
+            if child != b'iprp':
+                continue
+            for container, ipco_start, ipco_end in _boxes(data, child_start, child_end):
+                if container != b'ipco':
+                    continue
+                for prop, prop_start, prop_end in _boxes(data, ipco_start, ipco_end):
+                    if prop == b'ispe':
+                        size = struct.unpack('>II', data[prop_start + 4:prop_start + 12])
+                        if probe.size is None or size[0] * size[1] > probe.pixels:
+                            probe.size = size
+                    elif prop == b'colr' and data[prop_start:prop_start + 4] in (b'prof', b'rICC'):
+                        probe.has_icc = True
+                    elif prop == b'auxC' and b'alpha' in data[prop_start:prop_end]:
+                        probe.mode = 'RGBA'
+        if probe.size is None:
+            raise ProbeError('HEIF file has no image size')
+        return probe
+    return None
+
+
+def probe_bytes(data: bytes, complete: bool) -> Optional[ImageProbe]:
+    """Probe the first bytes of an input (all of it when `complete`).
+
+    Returns None when more bytes are needed; raises ProbeError for data that
+    is not a recognised image.
+    """
+    format = sniff_format(data[:16])
+    if format is None:
+        if complete or len(data) >= 16:
+            raise ProbeError('Unrecognized image data')
+        return None
+    if complete or format not in ('WEBP', 'HEIF', 'AVIF'):
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                probe = _from_pillow(image, complete)
+        except Image.DecompressionBombError as e:
+            raise ProbeError(str(e), status=413)
+        except Exception as e:
+            if complete:
+                raise ProbeError(f'Cannot read {format} header: {e}')
+            return None
+    elif format == 'WEBP':
+        probe = _webp_header(data)
+    else:
+        probe = _heif_header(data, format)
+    if probe:
+        probe.header_bytes = len(data)
+    return probe
+
+
+class HeaderProbe:
+    """Incremental probe: feed() bytes as they arrive, then finish()"""
+
+    def __init__(self, limit: int = PROBE_LIMIT):
+        self.limit = limit
+        self.result: Optional[ImageProbe] = None
+        self.error: Optional[ProbeError] = None
+        self._buffer = bytearray()
+        self._steps = iter(step for step in PROBE_STEPS if step < limit)
+        self._next = next(self._steps, limit)
+        self._attempted = 0
+        self._truncated = False
+
+    @property
+    def done(self) -> bool:
+        return self.result is not None or self.error is not None
+
+    def feed(self, data: bytes) -> bool:
+        """Add bytes; True once the header is resolved (or rejected)"""
+        if self.done:
+            return True
+        room = self.limit - len(self._buffer)
+        self._buffer += data[:room]
+        self._truncated = self._truncated or len(data) > room
+        if len(self._buffer) >= self._next and len(self._buffer) > self._attempted:
+            while self._next <= len(self._buffer) and self._next < self.limit:
+                self._next = next(self._steps, self.limit)
+            self._attempt(complete=False)
+        return self.done
+
+    def finish(self) -> ImageProbe:
+        """The probe result once all input was fed; raises ProbeError when rejected"""
+        if not self.done:
+            if self._truncated:
+                # Header not found within the limit: report what the magic bytes say
+                format = sniff_format(bytes(self._buffer[:16]))
+                if format is None:
+                    self.error = ProbeError('Unrecognized image data')
+                else:
+                    self.result = ImageProbe(format, header_bytes=len(self._buffer))
+            else:
+                self._attempt(complete=True)
+        if self.error:
+            raise self.error
+        return self.result
+
+    def _attempt(self, complete: bool) -> None:
+        self._attempted = len(self._buffer)
+        try:
+            self.result = probe_bytes(bytes(self._buffer), complete)
+        except ProbeError as e:
+            self.error = e
+
+
+def check_accepted(probe: ImageProbe, formats: Collection[str]) -> None:
+    """Reject inputs that could never be processed, from their header alone:
+    formats outside `formats`, and more pixels than Pillow's
+    DecompressionBombError limit (checked before any upload is spooled)"""
+    if probe.format not in formats:
+        raise ProbeError(f'Unsupported image format: {probe.format.lower()}')
+    if probe.pixels and probe.pixels > 2 * Image.MAX_IMAGE_PIXELS:
+        raise ProbeError(
+            f'Image too large: {probe.size[0]}x{probe.size[1]} ({probe.pixels / 1_000_000:.0f} MP). '
+            f'Max: {2 * Image.MAX_IMAGE_PIXELS / 1_000_000:.0f} MP', status=413
+        )
+
+
+def probe_stream(stream, limit: int = PROBE_LIMIT, chunk_size: int = 16 * 1024) -> ImageProbe:
+    """Probe a readable stream, reading no further than the header needs"""
+    probe = HeaderProbe(limit)
+    while not probe.done:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        probe.feed(chunk)
+    return probe.finish()
+
+
+class ProbingFile:
+    """Spool file for an upload that probes the header while it is written.
+
+    `check(probe)` may raise ProbeError to reject the upload; from then on
+    nothing more is stored. With keep=False nothing is stored at all (only
+    the header is wanted). Everything else is delegated to the spool file.
+    """
+
+    def __init__(self, file, check: Optional[Callable[[ImageProbe], None]] = None, keep: bool = True):
+        self.file = file
+        self.keep = keep
+        self._check = check
+        self._probe = HeaderProbe()
+
+    def write(self, data: bytes) -> int:
+        if not self._probe.done and self._probe.feed(data):
+            self._validate()
+            if self._probe.error:
+                logger.info(f"🚫 Upload rejected from its header: {self._probe.error}")
+                self.file.seek(0)
+                self.file.truncate()
+        if self.keep and not self._probe.error:
+            return self.file.write(data)
+        return len(data)
+
+    def result(self) -> ImageProbe:
+        """The checked probe; raises ProbeError when the upload was rejected"""
+        if not self._probe.done:
+            try:
+                self._probe.finish()
+            except ProbeError:
+                pass
+            self._validate()
+        return self._probe.finish()
+
+    def _validate(self) -> None:
+        if self._check and self._probe.result is not None:
+            try:
+                self._check(self._probe.result)
+            except ProbeError as e:
+                self._probe.error = e
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
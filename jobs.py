@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+QuickUtil background job queue
+SQLite-backed queue for slow conversions (large HEIC/TIFF files) so they do
+not hold a sync gunicorn worker for the whole request. Inputs and results are
+kept as files next to the database; results expire after a TTL. Every
+gunicorn worker can run a small local worker pool that claims jobs from the
+shared queue.
+A claimed job carries the claiming worker (host, pid and claim ID) and a
+lease that a heartbeat thread renews while the handler runs. Only a job
+whose lease has run out, because its process died or hung, is requeued;
+a worker that has lost its lease can no longer record progress or a result.
+"""
+
+import json
+import logging
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_FOLDER = os.path.join(tempfile.gettempdir(), 'quickutil_jobs')
+DEFAULT_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 3600))  # 1 hour
+POLL_INTERVAL = 1.0
+# Seconds a claim stays valid without a heartbeat; renewed every third of it
+DEFAULT_LEASE = int(os.environ.get('JOB_LEASE', 60))
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = {DONE, FAILED, CANCELLED}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    operation TEXT NOT NULL,
+    params TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    mimetype TEXT,
+    download_name TEXT,
+    result_size INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    expires_at REAL,
+    worker TEXT,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_expires ON jobs (expires_at);
+"""
+
+# Columns added after the first release, for queues created before them
+ADDED_COLUMNS = {'worker': 'TEXT', 'lease_until': 'REAL'}
+
+
+class JobCancelled(Exception):
+    """Raised inside a job handler when the job has been cancelled"""
+
+
+class JobQueue:
+    """Persistent job queue shared by all workers through one SQLite file"""
+
+    def __init__(self, folder: str = DEFAULT_JOB_FOLDER, result_ttl: int = DEFAULT_RESULT_TTL,
+                 lease: int = DEFAULT_LEASE):
+        self.folder = folder
+        self.result_ttl = result_ttl
+        self.lease = lease
+        self.db_path = os.path.join(folder, 'jobs.sqlite3')
+        self.wakeup = threading.Event()
+        os.makedirs(folder, exist_ok=True)
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+            columns = {row['name'] for row in db.execute('PRAGMA table_info(jobs)')}
+            for column, column_type in ADDED_COLUMNS.items():
+                if column not in columns:
+                    db.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+
+    @contextmanager
+    def _connect(self):
+        """Autocommit connection, closed on exit"""
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            yield db
+        finally:
+            db.close()
+
+    def input_path(self, job_id: str) -> str:
+        return os.path.join(self.folder, f"{job_id}.input")
+
+    def result_path(self, job_id: str) -> str:
+        return os.path.join(self.folder, f"{job_id}.result")
+
+    def submit(self, operation: str, params: Dict[str, Any], source: BinaryIO, filename: str) -> str:
+        """Store the input and queue a job; returns the job id"""
+        job_id = uuid.uuid4().hex
+        source.seek(0)
+        with open(self.input_path(job_id), 'wb') as f:
+            shutil.copyfileobj(source, f)
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                'INSERT INTO jobs (id, operation, params, filename, status, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job_id, operation, json.dumps(params), filename, QUEUED, now, now)
+            )
+        self.wakeup.set()
+        logger.info(f"📥 Job queued: {job_id} ({operation}, {filename})")
+        return job_id
+
+    @staticmethod
+    def _worker_id() -> str:
+        """Identity of one claim: host and pid (for operators) plus a unique suffix"""
+        return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """Atomically move the oldest queued job to running and return it;
+        job['worker'] is the claim the other calls must present"""
+        worker = self._worker_id()
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute(
+                'SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1', (QUEUED,)
+            ).fetchone()
+            if row is None:
+                db.execute('COMMIT')
+                return None
+            now = time.time()
+            db.execute(
+                'UPDATE jobs SET status = ?, updated_at = ?, worker = ?, lease_until = ? WHERE id = ?',
+                (RUNNING, now, worker, now + self.lease, row['id'])
+            )
+            db.execute('COMMIT')
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job.update(status=RUNNING, worker=worker, lease_until=now + self.lease)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as db:
+            row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        return job
+
+    def heartbeat(self, job_id: str, worker: str) -> bool:
+        """Renew the lease of a claim; False once the job was cancelled or requeued"""
+        with self._connect() as db:
+            cursor = db.execute(
+                'UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ? AND worker = ?',
+                (time.time() + self.lease, job_id, RUNNING, worker)
+            )
+        return bool(cursor.rowcount)
+
+    def set_progress(self, job_id: str, worker: str, progress: float) -> None:
+        """Record progress; raises JobCancelled if the job was cancelled or requeued meanwhile"""
+        now = time.time()
+        with self._connect() as db:
+            cursor = db.execute(
+                'UPDATE jobs SET progress = ?, updated_at = ?, lease_until = ? WHERE id = ? AND status = ? AND worker = ?',
+                (progress, now, now + self.lease, job_id, RUNNING, worker)
+            )
+        if cursor.rowcount == 0:
+            raise JobCancelled(job_id)
+
+    def complete(self, job_id: str, worker: str, data: bytes, mimetype: str, download_name: str) -> None:
+        """Store the result of a job this claim still holds"""
+        # Written aside first: a worker that lost its claim must not touch
+        # the files of whoever runs the job now
+        pending = f"{self.result_path(job_id)}.{worker.rsplit(':', 1)[-1]}"
+        with open(pending, 'wb') as f:
+            f.write(data)
+        now = time.time()
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            cursor = db.execute(
+                'UPDATE jobs SET status = ?, progress = 1, mimetype = ?, download_name = ?, '
+                'result_size = ?, updated_at = ?, expires_at = ?, lease_until = NULL '
+                'WHERE id = ? AND status = ? AND worker = ?',
+                (DONE, mimetype, download_name, len(data), now, now + self.result_ttl, job_id, RUNNING, worker)
+            )
+            if cursor.rowcount:
+                os.replace(pending, self.result_path(job_id))
+            db.execute('COMMIT')
+        if cursor.rowcount == 0:
+            # Cancelled or requeued while the last stage was running
+            os.remove(pending)
+        else:
+            self._remove_input(job_id)
+
+    def fail(self, job_id: str, worker: str, error: str) -> None:
+        now = time.time()
+        with self._connect() as db:
+            cursor = db.execute(
+                'UPDATE jobs SET status = ?, error = ?, updated_at = ?, expires_at = ?, lease_until = NULL '
+                'WHERE id = ? AND status = ? AND worker = ?',
+                (FAILED, error, now, now + self.result_ttl, job_id, RUNNING, worker)
+            )
+        if cursor.rowcount:
+            self._remove_input(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job; returns False if it already finished"""
+        now = time.time()
+        with self._connect() as db:
+            cursor = db.execute(
+                'UPDATE jobs SET status = ?, updated_at = ?, expires_at = ? WHERE id = ? AND status IN (?, ?)',
+                (CANCELLED, now, now + self.result_ttl, job_id, QUEUED, RUNNING)
+            )
+        if cursor.rowcount:
+            self._remove_files(job_id)
+            logger.info(f"🛑 Job cancelled: {job_id}")
+        return bool(cursor.rowcount)
+
+    def purge_expired(self) -> int:
+        """Delete finished jobs (rows and files) whose TTL has passed, and
+        requeue running jobs whose lease ran out (their worker died or hung)"""
+        now = time.time()
+        with self._connect() as db:
+            # Jobs claimed before leases existed count from their last update
+            requeued = db.execute(
+                'UPDATE jobs SET status = ?, progress = 0, worker = NULL, lease_until = NULL '
+                'WHERE status = ? AND COALESCE(lease_until, updated_at + ?) <= ?',
+                (QUEUED, RUNNING, self.lease, now)
+            ).rowcount
+            if requeued:
+                logger.warning(f"⚠️ Requeued {requeued} job(s) whose worker lease expired")
+                self.wakeup.set()
+            rows = db.execute(
+                'SELECT id FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?', (time.time(),)
+            ).fetchall()
+            for row in rows:
+                self._remove_files(row['id'])
+                db.execute('DELETE FROM jobs WHERE id = ?', (row['id'],))
+        return len(rows)
+
+    def _remove_input(self, job_id: str) -> None:
+        try:
+            os.remove(self.input_path(job_id))
+        except OSError:
+            pass
+
+    def _remove_files(self, job_id: str) -> None:
+        self._remove_input(job_id)
+        try:
+            os.remove(self.result_path(job_id))
+        except OSError:
+            pass
+
+
+# Handler signature: handler(job, input_stream, progress) -> (data, mimetype, download_name)
+JobHandler = Callable[[Dict[str, Any], BinaryIO, Callable[[float], None]], tuple]
+
+
+class JobWorkerPool:
+    """Background threads that claim jobs from the queue and run them"""
+
+    def __init__(self, queue: JobQueue, handler: JobHandler, workers: int = 1):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self._threads = []
+
+    def start(self) -> None:
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'job-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                job = self.queue.claim()
+            except Exception as e:
+                logger.error(f"Job queue error: {e}")
+                job = None
+            if job is None:
+                self.queue.wakeup.wait(POLL_INTERVAL)
+                self.queue.wakeup.clear()
+                continue
+            self._execute(job)
+
+    def _heartbeat(self, job: Dict[str, Any], stop: threading.Event) -> None:
+        """Keep the claim on a running job alive until it ends or is lost"""
+        while not stop.wait(self.queue.lease / 3):
+            try:
+                if not self.queue.heartbeat(job['id'], job['worker']):
+                    return
+            except Exception as e:
+                # A missed beat is retried; the lease covers two more
+                logger.warning(f"⚠️ Job heartbeat failed: {job['id']}: {e}")
+
+    def _execute(self, job: Dict[str, Any]) -> None:
+        job_id, worker = job['id'], job['worker']
+        logger.info(f"⚙️ Job started: {job_id} ({job['operation']}) by {worker}")
+        stop = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job, stop), name=f'job-heartbeat-{job_id[:8]}', daemon=True).start()
+        try:
+            with open(self.queue.input_path(job_id), 'rb') as source:
+                data, mimetype, download_name = self.handler(
+                    job, source, lambda progress: self.queue.set_progress(job_id, worker, progress)
+                )
+            self.queue.complete(job_id, worker, data, mimetype, download_name)
+            logger.info(f"✅ Job done: {job_id}")
+        except JobCancelled:
+            logger.info(f"🛑 Job stopped, cancelled or requeued: {job_id}")
+        except Exception as e:
+            # fail() leaves cancelled and requeued jobs untouched
+            logger.error(f"💥 Job failed: {job_id}: {e}")
+            self.queue.fail(job_id, worker, str(e))
+        finally:
+            stop.set()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+QuickUtil lossless JPEG metadata stripping
+Rewrites a JPEG at the marker-segment level without decoding it:
+- APP1 (EXIF, GPS, XMP), APP13 (IPTC), other APPn and COM segments are dropped
+- APP0 (JFIF) and APP14 (Adobe colour transform) are kept, since decoders
+  need them; APP2 ICC profiles are kept unless keep_icc is off
+- anything after the first EOI (MPO secondary images, vendor trailers) is cut
+- the EXIF orientation survives as a minimal EXIF segment holding only that
+  tag, or (orientation=apply) is applied as a lossless transform by jpegtran
+  when it is installed and the image size allows a perfect transform
+The entropy-coded data is copied as is, so the cost is a scan of the headers
+plus one copy of the file.
+"""
+
+import logging
+import shutil
+import struct
+import subprocess
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ORIENTATION_MODES = ('keep', 'apply', 'drop')
+JPEGTRAN = shutil.which('jpegtran')
+JPEGTRAN_TIMEOUT = 10  # seconds
+# jpegtran arguments that undo each EXIF orientation
+ORIENTATION_TRANSFORMS = {
+    2: ['-flip', 'horizontal'],
+    3: ['-rotate', '180'],
+    4: ['-flip', 'vertical'],
+    5: ['-transpose'],
+    6: ['-rotate', '90'],
+    7: ['-transverse'],
+    8: ['-rotate', '270'],
+}
+# Orientations whose transform swaps width and height
+TRANSPOSING = {5, 6, 7, 8}
+
+SOI, EOI, SOS, APP0, APP1, APP2, APP14, COM = 0xD8, 0xD9, 0xDA, 0xE0, 0xE1, 0xE2, 0xEE, 0xFE
+# Markers without a length field
+STANDALONE = {0x01, SOI, EOI} | set(range(0xD0, 0xD8))
+# Start-of-frame markers (not DHT 0xC4, JPG 0xC8, DAC 0xCC)
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+ICC_ID = b'ICC_PROFILE\x00'
+EXIF_ID = b'Exif\x00\x00'
+EXIF_ORIENTATION = 0x0112
+
+
+@dataclass
+class Segment:
+    marker: int
+    start: int
+    end: int
+
+    def payload(self, data: bytes) -> bytes:
+        return data[self.start + 4:self.end]
+
+    def name(self, data: bytes) -> str:
+        if APP0 <= self.marker <= 0xEF:
+            identifier = self.payload(data)[:16].split(b'\x00', 1)[0]
+            label = identifier.decode('ascii', 'replace') if identifier.isascii() else ''
+            return f"APP{self.marker - APP0}" + (f":{label}" if label else '')
+        return 'COM' if self.marker == COM else f"{self.marker:02X}"
+
+
+@dataclass
+class StripResult:
+    data: bytes
+    size: Tuple[int, int]
+    orientation: int
+    # 'none', 'tagged' (kept as a tag), 'dropped' or 'transformed' (applied by jpegtran)
+    orientation_action: str
+    removed: List[str] = field(default_factory=list)
+
+
+def parse_options(keep_icc: Optional[str], orientation: Optional[str]) -> Tuple[bool, str]:
+    """(keep_icc, orientation mode) from request fields"""
+    keep = True if keep_icc is None or str(keep_icc).strip() == '' else str(keep_icc).lower() in ('1', 'true', 'yes', 'on')
+    mode = (orientation or 'keep').strip().lower()
+    if mode not in ORIENTATION_MODES:
+        raise ValueError(f"Invalid orientation: {orientation}. Supported: {', '.join(ORIENTATION_MODES)}")
+    return keep, mode
+
+
+def parse_segments(data: bytes) -> Tuple[List[Segment], int]:
+    """Marker segments before the first scan, and the offset of the SOS marker"""
+    if not data.startswith(b'\xff\xd8'):
+        raise ValueError('Not a JPEG file')
+    segments = []
+    offset = 2
+    while True:
+        if offset >= len(data) or data[offset] != 0xFF:
+            raise ValueError('Corrupt JPEG: marker expected')
+        while offset < len(data) and data[offset] == 0xFF:
+            offset += 1  # fill bytes
+        if offset >= len(data):
+            raise ValueError('Truncated JPEG')
+        marker = data[offset]
+        start = offset - 1
+        if marker == SOS:
+            return segments, start
+        if marker in STANDALONE:
+            offset += 1
+            continue
+        if offset + 3 > len(data):
+            raise ValueError('Truncated JPEG')
+        length = struct.unpack('>H', data[offset + 1:offset + 3])[0]
+        end = offset + 1 + length
+        if length < 2 or end > len(data):
+            raise ValueError('Truncated JPEG')
+        segments.append(Segment(marker, start, end))
+        offset = end
+
+
+def frame_size(data: bytes, segments: List[Segment]) -> Tuple[int, int]:
+    for segment in segments:
+        if segment.marker in SOF_MARKERS:
+            height, width = struct.unpack('>HH', data[segment.start + 5:segment.start + 9])
+            return width, height
+    raise ValueError('Corrupt JPEG: no frame header')
+
+
+def exif_orientation(payload: bytes) -> int:
+    """Orientation tag of an APP1 EXIF payload (1 when absent or unreadable)"""
+    if not payload.startswith(EXIF_ID):
+        return 1
+    tiff = payload[len(EXIF_ID):]
+    try:
+        order = {b'II': '<', b'MM': '>'}[tiff[:2]]
+        ifd = struct.unpack(order + 'I', tiff[4:8])[0]
+        count = struct.unpack(order + 'H', tiff[ifd:ifd + 2])[0]
+        for index in range(count):
+            entry = ifd + 2 + 12 * index
+            tag, kind = struct.unpack(order + 'HH', tiff[entry:entry + 4])
+            if tag == EXIF_ORIENTATION and kind == 3:
+                value = struct.unpack(order + 'H', tiff[entry + 8:entry + 10])[0]
+                return value if value in range(1, 9) else 1
+    except (KeyError, struct.error):
+        pass
+    return 1
+
+
+def orientation_segment(orientation: int) -> bytes:
+    """APP1 segment with an EXIF block holding only the orientation tag"""
+    tiff = b'MM\x00\x2a' + struct.pack('>IH', 8, 1) + struct.pack('>HHIHH', EXIF_ORIENTATION, 3, 1, orientation, 0) + b'\x00' * 4
+    payload = EXIF_ID + tiff
+    return b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+
+
+def jpegtran_transform(data: bytes, orientation: int) -> Optional[bytes]:
+    """Lossless transform undoing `orientation`, or None when it cannot be done perfectly"""
+    if not JPEGTRAN or orientation not in ORIENTATION_TRANSFORMS:
+        return None
+    command = [JPEGTRAN, '-copy', 'none', '-perfect', *ORIENTATION_TRANSFORMS[orientation]]
+    try:
+        result = subprocess.run(command, input=data, capture_output=True, timeout=JPEGTRAN_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"⚠️ jpegtran failed: {e}")
+        return None
+    if result.returncode != 0 or not result.stdout:
+        # -perfect refuses sizes that are not a whole number of MCUs
+        logger.info(f"↪️ No perfect transform for orientation {orientation}: {result.stderr.decode(errors='replace').strip()}")
+        return None
+    return result.stdout
+
+
+def scan_length(data: bytes, segments: List[Segment], sos: int) -> int:
+    """Offset just past the first EOI. A file that ends in EOI and has no MPF
+    (multi-picture) segment is taken to have no trailer, which saves
+    searching the whole entropy-coded scan."""
+    multi_picture = any(s.marker == APP2 and s.payload(data).startswith(b'MPF\x00') for s in segments)
+    if data.endswith(b'\xff\xd9') and not multi_picture:
+        return len(data)
+    eoi = data.find(b'\xff\xd9', sos)
+    return len(data) if eoi < 0 else eoi + 2
+
+
+def strip_jpeg(data: bytes, keep_icc: bool = True, orientation: str = 'keep') -> StripResult:
+    """Drop metadata segments (and trailers) from a JPEG without decoding it.
+
+    `orientation` is 'keep' (minimal EXIF with the tag), 'apply' (jpegtran
+    transform, falling back to 'keep') or 'drop'. Raises ValueError for data
+    that is not a well-formed JPEG.
+    """
+    segments, sos = parse_segments(data)
+    scan_end = scan_length(data, segments, sos)
+
+    value = 1
+    for segment in segments:
+        if segment.marker == APP1 and segment.payload(data).startswith(EXIF_ID):
+            value = exif_orientation(segment.payload(data))
+            break
+
+    kept, removed, icc = [], [], []
+    for segment in segments:
+        is_icc = segment.marker == APP2 and segment.payload(data).startswith(ICC_ID)
+        if segment.marker in (APP0, APP14) or not (APP0 <= segment.marker <= 0xEF or segment.marker == COM):
+            kept.append(data[segment.start:segment.end])
+        elif is_icc and keep_icc:
+            kept.append(data[segment.start:segment.end])
+            icc.append(data[segment.start:segment.end])
+        else:
+            removed.append(segment.name(data))
+    if scan_end < len(data):
+        removed.append('trailer')
+
+    size = frame_size(data, segments)
+    action = 'none'
+    if value != 1:
+        action = 'dropped' if orientation == 'drop' else 'tagged'
+        if orientation == 'apply':
+            transformed = jpegtran_transform(data[:scan_end], value)
+            if transformed is not None:
+                # jpegtran copied no markers; put the ICC profile back after JFIF
+                out_segments, out_sos = parse_segments(transformed)
+                head = b''.join(transformed[s.start:s.end] for s in out_segments if s.marker == APP0)
+                rest = b''.join(transformed[s.start:s.end] for s in out_segments if s.marker != APP0)
+                output = b'\xff\xd8' + head + b''.join(icc) + rest + transformed[out_sos:]
+                if value in TRANSPOSING:
+                    size = (size[1], size[0])
+                return StripResult(output, size, value, 'transformed', removed)
+
+    # APP0 (if any) must stay first; the orientation tag goes right after it
+    if segments and segments[0].marker == APP0:
+        head, kept = kept[:1], kept[1:]
+    else:
+        head = []
+    tag = [orientation_segment(value)] if action == 'tagged' else []
+    output = b''.join([b'\xff\xd8', *head, *tag, *kept, memoryview(data)[sos:scan_end]])
+    return StripResult(output, size, value, action, removed)
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+QuickUtil request metrics
+Per-stage latency histograms, peak-RSS deltas and request/byte counters,
+labelled by endpoint, input format and output format, and rendered in the
+Prometheus text exposition format on /metrics. Metrics are kept per process
+(each gunicorn worker reports its own).
+"""
+
+import bisect
+import contextvars
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Request stages, in the order they happen
+STAGES = ('receive', 'probe', 'strip', 'decode', 'resize', 'transform', 'classify', 'convert', 'encode', 'send')
+LABELS = ('endpoint', 'input_format', 'output_format')
+UNKNOWN = 'unknown'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+MEMORY_BUCKETS = tuple(mb * 1024 * 1024 for mb in (1, 4, 16, 32, 64, 128, 256, 512, 1024, 2048))
+
+# Pillow format names and file extensions both end up as label values
+FORMAT_ALIASES = {'jpg': 'jpeg', 'mpo': 'jpeg', 'heic': 'heif', 'tif': 'tiff'}
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# ru_maxrss is in KiB on Linux and in bytes on macOS
+_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def peak_rss() -> int:
+    """High-water mark of this process's resident set size, in bytes"""
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT
+
+
+def format_label(value: Optional[str]) -> str:
+    if not value:
+        return UNKNOWN
+    value = str(value).lower()
+    return FORMAT_ALIASES.get(value, value)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names: Iterable[str], values: Iterable[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter keyed by a tuple of label values"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f'{self.name}{_label_text(self.labelnames, labels)} {_number(value)}')
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram keyed by a tuple of label values"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...],
+                 buckets: Tuple[float, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{_number(bound)}"'
+                lines.append(f'{self.name}_bucket{_label_text(self.labelnames, labels, le)} {cumulative}')
+            label_text = _label_text(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_text} {_number(total)}')
+            lines.append(f'{self.name}_count{label_text} {cumulative}')
+        return lines
+
+
+class RequestTracker:
+    """Stage timings and labels of one request (or background job)"""
+
+    def __init__(self, owner: 'AppMetrics', endpoint: str):
+        self.owner = owner
+        self.labels = {'endpoint': endpoint, 'input_format': UNKNOWN, 'output_format': UNKNOWN}
+        self.stages: Dict[str, float] = {}
+        self.started = time.perf_counter()
+        self.send_started = None
+        self.status = 'error'
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.rss_before = peak_rss()
+        self.finished = False
+        # Batch items add stage time from several executor threads
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def finish(self) -> None:
+        if self.finished:
+            return
+        self.finished = True
+        if self.send_started is not None:
+            self.add('send', time.perf_counter() - self.send_started)
+        self.owner.record(self)
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar('quickutil_metrics_tracker', default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as one request stage; a no-op outside a tracked request"""
+    tracker = _current.get()
+    if tracker is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracker.add(name, time.perf_counter() - started)
+
+
+def set_labels(input_format: Optional[str] = None, output_format: Optional[str] = None) -> None:
+    """Attach the input/output format to the current request's metrics"""
+    tracker = _current.get()
+    if tracker is None:
+        return
+    if input_format:
+        tracker.labels['input_format'] = format_label(input_format)
+    if output_format:
+        tracker.labels['output_format'] = format_label(output_format)
+
+
+def propagate(fn: Callable) -> Callable:
+    """Wrap fn so it records into the current request when run on another thread"""
+    tracker = _current.get()
+
+    def run(*args, **kwargs):
+        token = _current.set(tracker)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+class AppMetrics:
+    """Metric families of one Flask app plus the request hooks that feed them"""
+
+    def __init__(self, gauges: Optional[Dict[str, Callable[[], float]]] = None):
+        self.gauges = gauges or {}
+        self.stage_seconds = Histogram(
+            'quickutil_stage_seconds', 'Time spent in each request stage',
+            ('stage',) + LABELS, LATENCY_BUCKETS
+        )
+        self.request_seconds = Histogram(
+            'quickutil_request_seconds', 'End-to-end request latency including the response send',
+            LABELS, LATENCY_BUCKETS
+        )
+        self.peak_rss_delta = Histogram(
+            'quickutil_peak_rss_delta_bytes', 'Growth of the process peak RSS while the request ran',
+            LABELS, MEMORY_BUCKETS
+        )
+        self.requests = Counter(
+            'quickutil_requests_total', 'Requests handled, by response status', LABELS + ('status',)
+        )
+        self.input_bytes = Counter('quickutil_input_bytes_total', 'Request body bytes received', LABELS)
+        self.output_bytes = Counter('quickutil_output_bytes_total', 'Response body bytes sent', LABELS)
+
+    @contextmanager
+    def track(self, endpoint: str):
+        """Track work outside a Flask request (e.g. a background job)"""
+        tracker = RequestTracker(self, endpoint)
+        token = _current.set(tracker)
+        try:
+            yield tracker
+            tracker.status = 'ok'
+        finally:
+            _current.reset(token)
+            tracker.finish()
+
+    def record(self, tracker: RequestTracker) -> None:
+        labels = tuple(tracker.labels[name] for name in LABELS)
+        for name, seconds in tracker.stages.items():
+            self.stage_seconds.observe((name,) + labels, seconds)
+        self.request_seconds.observe(labels, time.perf_counter() - tracker.started)
+        self.peak_rss_delta.observe(labels, peak_rss() - tracker.rss_before)
+        self.requests.inc(labels + (tracker.status,))
+        if tracker.input_bytes:
+            self.input_bytes.inc(labels, tracker.input_bytes)
+        if tracker.output_bytes:
+            self.output_bytes.inc(labels, tracker.output_bytes)
+
+    def render(self) -> str:
+        lines = []
+        for family in (self.stage_seconds, self.request_seconds, self.peak_rss_delta,
+                       self.requests, self.input_bytes, self.output_bytes):
+            lines.extend(family.render())
+        for name, read in self.gauges.items():
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {_number(read())}')
+        return '\n'.join(lines) + '\n'
+
+
+ENVIRON_KEY = 'quickutil.metrics_tracker'
+
+
+class _SendTracker:
+    """WSGI response iterable that times the body send and counts its bytes"""
+
+    def __init__(self, app_iter, tracker: RequestTracker):
+        self.app_iter = app_iter
+        self.tracker = tracker
+
+    def __iter__(self):
+        for chunk in self.app_iter:
+            self.tracker.output_bytes += len(chunk)
+            yield chunk
+
+    def close(self) -> None:
+        try:
+            if hasattr(self.app_iter, 'close'):
+                self.app_iter.close()
+        finally:
+            self.tracker.finish()
+
+
+class MetricsMiddleware:
+    """Finishes each tracked request once the server has sent the whole body.
+
+    Response.call_on_close is not enough: send_file responses are passed
+    through as a wsgi.file_wrapper and their close callbacks never run.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        app_iter = self.wsgi_app(environ, start_response)
+        tracker = environ.get(ENVIRON_KEY)
+        if tracker is None:
+            return app_iter
+        tracker.send_started = time.perf_counter()
+        return _SendTracker(app_iter, tracker)
+
+
+def install(app, gauges: Optional[Dict[str, Callable[[], float]]] = None) -> AppMetrics:
+    """Hook request tracking into a Flask app and add its /metrics route"""
+    from flask import Response, request
+
+    metrics = AppMetrics(gauges)
+    app.wsgi_app = MetricsMiddleware(app.wsgi_app)
+
+    @app.before_request
+    def _start_tracking():
+        if request.endpoint in (None, 'metrics') or request.method == 'OPTIONS':
+            return
+        tracker = RequestTracker(metrics, request.endpoint)
+        request.environ[ENVIRON_KEY] = tracker
+        _current.set(tracker)
+        tracker.input_bytes = request.content_length or 0
+        if request.mimetype == 'multipart/form-data':
+            # Parse (and spool) the upload here so its cost is its own stage
+            with stage('receive'):
+                request.files
+
+    @app.after_request
+    def _record_status(response):
+        tracker = request.environ.get(ENVIRON_KEY)
+        if tracker is not None:
+            tracker.status = str(response.status_code)
+        return response
+
+    @app.teardown_request
+    def _stop_tracking(exc):
+        _current.set(None)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        """Prometheus metrics for this worker"""
+        return Response(metrics.render(), mimetype=CONTENT_TYPE.split(';')[0],
+                        headers={'Content-Type': CONTENT_TYPE})
+
+    app.extensions['quickutil_metrics'] = metrics
+    return metrics
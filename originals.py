@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+QuickUtil original store
+Recently uploaded originals, kept by content hash so that a client trying
+several settings on one file sends it only once:
+- the client asks /uploads/preflight with the SHA-256 and size of its file
+  and gets a challenge: a byte range chosen by the server
+- it asks again with the SHA-256 of the challenge ID followed by those
+  bytes; knowing the hash alone is not enough, so nobody learns whether a
+  file they do not have was uploaded by someone else
+- if the original is held and the proof matches, it gets a source token
+  and sends `source_token` instead of the file; the result cache (keyed by
+  the hash) answers repeats without a decode
+- otherwise it gets an upload token and sends the file once with
+  `upload_token`; the upload is checked against the hash and size the token
+  was issued for, kept for ORIGINALS_TTL seconds, and answered with a source
+  token for the requests after it
+A held original is only ever reached through a source token: a short-lived
+grant bound to one hash and given only to a client that proved it has the
+file. Uploads without a token are not kept. Originals live in an
+ArtifactStore (byte quota, LRU eviction, TTL) shared by all workers;
+challenges and tokens are leases in its index, so any worker honours them.
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+import re
+import tempfile
+import threading
+import uuid
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from artifact_store import ArtifactStore
+from result_cache import hash_stream
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ORIGINALS_FOLDER = os.path.join(tempfile.gettempdir(), 'quickutil_originals')
+DEFAULT_ORIGINALS_QUOTA = int(os.environ.get('ORIGINALS_DISK_MB', 512)) * 1024 * 1024
+DEFAULT_ORIGINALS_TTL = int(os.environ.get('ORIGINALS_TTL', 900))  # 15 minutes
+DEFAULT_TOKEN_TTL = int(os.environ.get('UPLOAD_TOKEN_TTL', 300))  # 5 minutes
+
+# Largest byte range a possession challenge asks for
+CHALLENGE_BYTES = 64 * 1024
+
+DIGEST_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+
+def parse_digest(value: Optional[str]) -> str:
+    """Lower-case hex SHA-256; raises ValueError for anything else"""
+    digest = (value or '').strip().lower()
+    if not DIGEST_PATTERN.fullmatch(digest):
+        raise ValueError('sha256 must be 64 hex characters')
+    return digest
+
+
+def parse_file_size(value) -> int:
+    """Byte size of the file being announced; raises ValueError when missing or negative"""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('size must be the file size in bytes')
+    if size < 0:
+        raise ValueError('size must be the file size in bytes')
+    return size
+
+
+class OriginalStore:
+    """Originals by SHA-256, plus the upload tokens for ones not held yet"""
+
+    def __init__(self, folder: str = DEFAULT_ORIGINALS_FOLDER, quota: int = DEFAULT_ORIGINALS_QUOTA,
+                 ttl: int = DEFAULT_ORIGINALS_TTL, token_ttl: int = DEFAULT_TOKEN_TTL):
+        self.ttl = ttl
+        self.token_ttl = token_ttl
+        self.store = ArtifactStore(folder, quota, ttl)
+        self.counters = {'challenges': 0, 'held': 0, 'unproven': 0, 'tokens': 0, 'retained': 0, 'rejected': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    @staticmethod
+    def _token_lease(token: str) -> str:
+        return f"upload:{token}"
+
+    @staticmethod
+    def _source_lease(token: str) -> str:
+        return f"source:{token}"
+
+    @staticmethod
+    def _challenge_lease(challenge: str) -> str:
+        return f"challenge:{challenge}"
+
+    @staticmethod
+    def challenge_range(challenge: str, size: int) -> Tuple[int, int]:
+        """(offset, length) of the bytes a challenge asks for, derived from its random ID"""
+        length = min(size, CHALLENGE_BYTES)
+        return int(challenge[:12], 16) % (size - length + 1), length
+
+    @staticmethod
+    def proof(challenge: str, chunk: bytes) -> str:
+        """Answer to a challenge: SHA-256 of its ID followed by the requested bytes"""
+        return hashlib.sha256(challenge.encode() + chunk).hexdigest()
+
+    def preflight(self, digest: str, size: int, challenge: Optional[str] = None,
+                  proof: Optional[str] = None) -> Dict[str, object]:
+        """Without a challenge: a new one. With an answered challenge: the
+        `source` hash of a held original when the proof matches, otherwise
+        an upload token (an unanswered or wrong proof looks like a new file)"""
+        if not challenge:
+            challenge = uuid.uuid4().hex
+            self.store.acquire_lease(self._challenge_lease(challenge), f"{digest}:{size}", self.token_ttl)
+            offset, length = self.challenge_range(challenge, size)
+            self._count('challenges')
+            return {'status': 'challenge', 'challenge': challenge, 'offset': offset, 'length': length,
+                    'expires_in': self.token_ttl}
+        filename = self._proven(digest, size, challenge, proof or '')
+        if filename is not None:
+            self._count('held')
+            return {'status': 'held', 'source_token': self.grant(digest), 'filename': filename,
+                    'expires_in': self.token_ttl}
+        token = uuid.uuid4().hex
+        self.store.acquire_lease(self._token_lease(token), f"{digest}:{size}", self.token_ttl)
+        self._count('tokens')
+        return {'status': 'upload', 'upload_token': token, 'expires_in': self.token_ttl}
+
+    def _proven(self, digest: str, size: int, challenge: str, proof: str) -> Optional[str]:
+        """Filename of the held original when `proof` answers the challenge, else None"""
+        # Spent whatever the outcome, so a challenge cannot be guessed at
+        if not self.store.release_lease(self._challenge_lease(challenge), f"{digest}:{size}"):
+            self._count('unproven')
+            return None
+        held = self.store.open(digest)
+        if held is None:
+            return None
+        f, artifact = held
+        with f:
+            if artifact.metadata.get('size') != size:
+                return None
+            offset, length = self.challenge_range(challenge, size)
+            f.seek(offset)
+            chunk = f.read(length)
+        if not hmac.compare_digest(self.proof(challenge, chunk), proof.lower()):
+            self._count('unproven')
+            return None
+        return artifact.metadata.get('filename') or f"{digest[:12]}.bin"
+
+    def grant(self, digest: str) -> str:
+        """A source token for a held original, valid for token_ttl seconds"""
+        token = uuid.uuid4().hex
+        self.store.acquire_lease(self._source_lease(token), digest, self.token_ttl)
+        return token
+
+    def retain(self, stream: BinaryIO, filename: str, token: str) -> Optional[str]:
+        """Keep an upload sent with a token; its hash, or None when it does not match the token"""
+        digest = hash_stream(stream)
+        stream.seek(0, 2)
+        size = stream.tell()
+        stream.seek(0)
+        # Releasing checks the token was issued for exactly this content, and spends it
+        if not self.store.release_lease(self._token_lease(token), f"{digest}:{size}"):
+            self._count('rejected')
+            logger.warning(f"⚠️ Upload token does not match {filename} ({size} bytes), not keeping it")
+            return None
+        self.store.put_stream(digest, stream, {'filename': filename, 'size': size})
+        self._count('retained')
+        logger.info(f"📥 Keeping original {filename} ({size / (1024 * 1024):.1f}MB) as {digest[:12]}")
+        return digest
+
+    def open(self, token: str) -> Optional[Tuple[BinaryIO, str]]:
+        """The original a source token grants and its filename; None when the
+        token is unknown or expired or the original is gone, alike"""
+        digest = self.store.lease_owner(self._source_lease(token))
+        if digest is None:
+            return None
+        held = self.store.open(digest)
+        if held is None:
+            return None
+        f, artifact = held
+        return f, artifact.metadata.get('filename') or f"{digest[:12]}.bin"
+
+    def sweep(self) -> int:
+        """Delete expired originals and tokens (a Sweeper task); returns how many originals"""
+        return self.store.expire()
+
+    def stats(self) -> Dict[str, int]:
+        usage = self.store.usage()
+        with self._lock:
+            counters = dict(self.counters)
+        return {**counters, 'entries': usage['entries'], 'bytes': usage['bytes'], 'ttl': self.ttl}
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+QuickUtil operation pipeline
+Runs an ordered list of operations (crop, resize, rotate, flip, filters) on an
+image that is decoded once and encoded once by the caller. Consecutive
+geometric operations are fused before any pixel is touched:
+- crops and resizes collapse into a single Image.resize(box=...) (or a plain
+  crop), so pixels outside the final crop are never resampled
+- rotations by multiples of 90 degrees and flips become one transpose, moved
+  after the resize so it runs on the smaller image
+- the fused geometry tells the decoder how much resolution is needed, so JPEG
+  DCT scaling / reduce can be used when the result is much smaller
+Rotations by other angles and filters are barriers that fusion does not cross.
+"""
+
+import json
+import logging
+import math
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from PIL import Image
+
+import resample
+import tile_filters
+
+logger = logging.getLogger(__name__)
+
+MAX_OPERATIONS = 32
+MAX_OUTPUT_PIXELS = 100_000_000
+FILTER_OPERATIONS = ('brightness', 'contrast', 'saturation', 'sharpness', 'blur')
+OPERATIONS = ('crop', 'resize', 'rotate', 'flip') + FILTER_OPERATIONS
+
+# D4 symmetries as 2x2 matrices acting on (x, y) with y pointing down,
+# relative to the image centre
+Matrix = Tuple[int, int, int, int]
+IDENTITY: Matrix = (1, 0, 0, 1)
+TRANSPOSE_MATRICES: Dict[Image.Transpose, Matrix] = {
+    Image.Transpose.FLIP_LEFT_RIGHT: (-1, 0, 0, 1),
+    Image.Transpose.FLIP_TOP_BOTTOM: (1, 0, 0, -1),
+    Image.Transpose.ROTATE_90: (0, 1, -1, 0),     # 90 degrees counter-clockwise
+    Image.Transpose.ROTATE_180: (-1, 0, 0, -1),
+    Image.Transpose.ROTATE_270: (0, -1, 1, 0),    # 90 degrees clockwise
+    Image.Transpose.TRANSPOSE: (0, 1, 1, 0),
+    Image.Transpose.TRANSVERSE: (0, -1, -1, 0),
+}
+MATRIX_TRANSPOSES = {matrix: method for method, matrix in TRANSPOSE_MATRICES.items()}
+# Clockwise quarter turns
+QUARTER_TURNS = {
+    0: IDENTITY,
+    1: TRANSPOSE_MATRICES[Image.Transpose.ROTATE_270],
+    2: TRANSPOSE_MATRICES[Image.Transpose.ROTATE_180],
+    3: TRANSPOSE_MATRICES[Image.Transpose.ROTATE_90],
+}
+FLIPS = {
+    'horizontal': TRANSPOSE_MATRICES[Image.Transpose.FLIP_LEFT_RIGHT],
+    'vertical': TRANSPOSE_MATRICES[Image.Transpose.FLIP_TOP_BOTTOM],
+}
+
+Box = Tuple[float, float, float, float]
+
+
+class PipelineError(ValueError):
+    """Raised for invalid operation lists (maps to HTTP 400)"""
+
+
+def _compose(second: Matrix, first: Matrix) -> Matrix:
+    """Matrix of applying `first` and then `second`"""
+    a, b, c, d = second
+    e, f, g, h = first
+    return (a * e + b * g, a * f + b * h, c * e + d * g, c * f + d * h)
+
+
+def _swaps_axes(matrix: Matrix) -> bool:
+    return matrix[0] == 0
+
+
+def _swap(size: Tuple[int, int], matrix: Matrix) -> Tuple[int, int]:
+    return (size[1], size[0]) if _swaps_axes(matrix) else size
+
+
+@dataclass
+class Operation:
+    """One validated pipeline operation"""
+    name: str
+    params: Dict[str, Any] = field(default_factory=dict)
+
+    def describe(self) -> str:
+        args = ','.join(f"{key}={value}" for key, value in self.params.items())
+        return f"{self.name}({args})"
+
+
+def _number(spec: Dict[str, Any], key: str, default=None, minimum=None, integer=False):
+    value = spec.get(key, default)
+    if value is None:
+        return None
+    try:
+        value = int(value) if integer else float(value)
+    except (TypeError, ValueError):
+        raise PipelineError(f"{spec.get('op')}: '{key}' must be a number")
+    if minimum is not None and value < minimum:
+        raise PipelineError(f"{spec.get('op')}: '{key}' must be >= {minimum}")
+    return value
+
+
+def _flag(value, default: bool) -> bool:
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+def parse_operations(spec: Union[str, List[Dict[str, Any]]]) -> List[Operation]:
+    """Validate an operation list given as JSON text or already-decoded dicts"""
+    if isinstance(spec, str):
+        try:
+            spec = json.loads(spec)
+        except ValueError as e:
+            raise PipelineError(f'operations is not valid JSON: {e}')
+    if not isinstance(spec, list) or not spec:
+        raise PipelineError('operations must be a non-empty list')
+    if len(spec) > MAX_OPERATIONS:
+        raise PipelineError(f'At most {MAX_OPERATIONS} operations are allowed')
+
+    operations = []
+    for item in spec:
+        if not isinstance(item, dict) or item.get('op') not in OPERATIONS:
+            raise PipelineError(f"Unknown operation: {item!r}. Supported: {', '.join(OPERATIONS)}")
+        name = item['op']
+        if name == 'crop':
+            params = {key: _number(item, key, minimum=0, integer=True) for key in ('x', 'y', 'width', 'height')}
+            if None in params.values() or not params['width'] or not params['height']:
+                raise PipelineError('crop needs x, y, width and height (width/height > 0)')
+        elif name == 'resize':
+            params = {
+                'width': _number(item, 'width', minimum=1, integer=True),
+                'height': _number(item, 'height', minimum=1, integer=True),
+                'maintain_aspect': _flag(item.get('maintain_aspect'), True)
+            }
+            if not params['width'] and not params['height']:
+                raise PipelineError('resize needs width and/or height')
+        elif name == 'rotate':
+            params = {'angle': _number(item, 'angle', 0.0), 'expand': _flag(item.get('expand'), True)}
+        elif name == 'flip':
+            direction = str(item.get('direction', 'horizontal')).lower()
+            if direction not in FLIPS:
+                raise PipelineError("flip direction must be 'horizontal' or 'vertical'")
+            params = {'direction': direction}
+        elif name == 'blur':
+            params = {'radius': _number(item, 'radius', _number(item, 'value', 0.0), minimum=0)}
+        else:
+            params = {'factor': _number(item, 'factor', _number(item, 'value', 1.0), minimum=0)}
+        operations.append(Operation(name, params))
+    return operations
+
+
+# Planned steps
+
+@dataclass
+class GeometryStep:
+    """Fused crops/resizes/transposes: resample `box` to `size`, then transpose"""
+    box: Box
+    size: Tuple[int, int]
+    matrix: Matrix = IDENTITY
+    source_size: Tuple[int, int] = (0, 0)
+    tier: str = resample.DEFAULT_TIER
+
+    @property
+    def output_size(self) -> Tuple[int, int]:
+        return _swap(self.size, self.matrix)
+
+    def crop(self, x: int, y: int, width: int, height: int) -> None:
+        visible_w, visible_h = self.output_size
+        right, bottom = min(visible_w, x + width), min(visible_h, y + height)
+        if x >= visible_w or y >= visible_h or right <= x or bottom <= y:
+            raise PipelineError(f'crop ({x},{y},{width}x{height}) is outside the {visible_w}x{visible_h} image')
+        # Map the visible rectangle back through the pending transpose
+        a, b, c, d = self.matrix
+        pre_w, pre_h = self.size
+        corners = []
+        for cx, cy in ((x, y), (right, bottom)):
+            vx, vy = cx - visible_w / 2, cy - visible_h / 2
+            # Inverse of an orthogonal matrix is its transpose
+            corners.append((a * vx + c * vy + pre_w / 2, b * vx + d * vy + pre_h / 2))
+        left, top = min(p[0] for p in corners), min(p[1] for p in corners)
+        right, bottom = max(p[0] for p in corners), max(p[1] for p in corners)
+        # ...and from output pixels to source coordinates
+        scale_x = (self.box[2] - self.box[0]) / pre_w
+        scale_y = (self.box[3] - self.box[1]) / pre_h
+        self.box = (self.box[0] + left * scale_x, self.box[1] + top * scale_y,
+                    self.box[0] + right * scale_x, self.box[1] + bottom * scale_y)
+        self.size = (round(right - left), round(bottom - top))
+
+    def resize(self, width: Optional[int], height: Optional[int], maintain_aspect: bool) -> None:
+        visible_w, visible_h = self.output_size
+        if maintain_aspect:
+            ratios = [r for r in ((width / visible_w) if width else None,
+                                  (height / visible_h) if height else None) if r]
+            ratio = min(ratios)
+            target = (max(1, round(visible_w * ratio)), max(1, round(visible_h * ratio)))
+        else:
+            target = (width or visible_w, height or visible_h)
+        if target[0] * target[1] > MAX_OUTPUT_PIXELS:
+            raise PipelineError(f'resize to {target[0]}x{target[1]} exceeds the output size limit')
+        self.size = _swap(target, self.matrix)
+
+    def transpose(self, matrix: Matrix) -> None:
+        self.matrix = _compose(matrix, self.matrix)
+
+    @property
+    def is_identity(self) -> bool:
+        return (self.matrix == IDENTITY and self.size == self.source_size
+                and self.box == (0, 0) + tuple(self.source_size))
+
+    def scale_ratio(self) -> float:
+        """Output pixels per source pixel along the tighter axis"""
+        return min(self.size[0] / (self.box[2] - self.box[0]), self.size[1] / (self.box[3] - self.box[1]))
+
+    def apply(self, image: Image.Image) -> Image.Image:
+        # The image may have been decoded at a reduced scale
+        fx = image.width / self.source_size[0]
+        fy = image.height / self.source_size[1]
+        box = (self.box[0] * fx, self.box[1] * fy, self.box[2] * fx, self.box[3] * fy)
+        result = image
+        integral_box = tuple(round(v) for v in box)
+        if (integral_box[2] - integral_box[0], integral_box[3] - integral_box[1]) == self.size and \
+                all(abs(v - r) < 1e-6 for v, r in zip(box, integral_box)):
+            if integral_box != (0, 0) + image.size:
+                result = image.crop(integral_box)
+        else:
+            result = resample.resize(image, self.size, self.tier, box=box)
+        if self.matrix != IDENTITY:
+            transposed = result.transpose(MATRIX_TRANSPOSES[self.matrix])
+            if result is not image:
+                result.close()
+            result = transposed
+        return result
+
+    def describe(self) -> str:
+        parts = []
+        box = tuple(round(v, 1) for v in self.box)
+        if box != (0, 0) + tuple(self.source_size):
+            parts.append(f"box={box}")
+        if self.size != (round(self.box[2] - self.box[0]), round(self.box[3] - self.box[1])):
+            parts.append(f"resize={self.size[0]}x{self.size[1]}")
+        if self.matrix != IDENTITY:
+            parts.append(f"transpose={MATRIX_TRANSPOSES[self.matrix].name}")
+        return 'geometry(' + ','.join(parts or ['identity']) + ')'
+
+
+@dataclass
+class RotateStep:
+    """Rotation by an arbitrary angle (clockwise, degrees)"""
+    angle: float
+    expand: bool
+
+    def apply(self, image: Image.Image) -> Image.Image:
+        if image.mode in ('1', 'P'):
+            image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+        fill = (255,) * len(image.getbands()) if image.mode in ('RGB', 'L', 'CMYK') else None
+        return image.rotate(-self.angle, resample=Image.Resampling.BICUBIC, expand=self.expand, fillcolor=fill)
+
+    def output_size(self, size: Tuple[int, int]) -> Tuple[int, int]:
+        if not self.expand:
+            return size
+        radians = math.radians(self.angle)
+        cos, sin = abs(math.cos(radians)), abs(math.sin(radians))
+        return (math.ceil(size[0] * cos + size[1] * sin), math.ceil(size[0] * sin + size[1] * cos))
+
+    def describe(self) -> str:
+        return f"rotate({self.angle:g})"
+
+
+@dataclass
+class FilterStep:
+    """ImageEnhance factor or Gaussian blur"""
+    name: str
+    value: float
+
+    def apply(self, image: Image.Image, executor: Optional[Executor] = None) -> Image.Image:
+        """Large images are filtered in bands on `executor` (see tile_filters)"""
+        converted = None
+        if image.mode not in ('L', 'RGB', 'RGBA'):
+            image = converted = image.convert('RGBA' if 'A' in image.getbands() or image.has_transparency_data else 'RGB')
+        try:
+            return tile_filters.apply_filter(image, self.name, self.value, executor)
+        finally:
+            if converted:
+                converted.close()
+
+    def describe(self) -> str:
+        return f"{self.name}({self.value:g})"
+
+
+Step = Union[GeometryStep, RotateStep, FilterStep]
+
+
+class Pipeline:
+    """An operation list planned for one source size"""
+
+    def __init__(self, operations: List[Operation], source_size: Tuple[int, int],
+                 resize_quality: str = resample.DEFAULT_TIER):
+        self.operations = operations
+        self.source_size = source_size
+        self.resize_quality = resize_quality
+        self.steps: List[Step] = []
+        # Largest intermediate image, for memory admission
+        self.peak_pixels = 0
+        self._plan()
+
+    def _plan(self) -> None:
+        size = self.source_size
+        geometry = None
+        for operation in self.operations:
+            params = operation.params
+            quarter_turns = None
+            if operation.name == 'rotate':
+                angle = params['angle'] % 360
+                if angle % 90 == 0:
+                    quarter_turns = int(angle // 90)
+                else:
+                    if geometry:
+                        self._add_geometry(geometry)
+                        size, geometry = geometry.output_size, None
+                    step = RotateStep(angle, params['expand'])
+                    self.steps.append(step)
+                    size = step.output_size(size)
+                    self._track(size)
+                    continue
+            elif operation.name in FILTER_OPERATIONS:
+                if geometry:
+                    self._add_geometry(geometry)
+                    size, geometry = geometry.output_size, None
+                value = params['radius'] if operation.name == 'blur' else params['factor']
+                neutral = 0 if operation.name == 'blur' else 1
+                if value != neutral:
+                    self.steps.append(FilterStep(operation.name, value))
+                continue
+
+            if geometry is None:
+                geometry = GeometryStep((0, 0) + tuple(size), size, source_size=size, tier=self.resize_quality)
+            if operation.name == 'crop':
+                geometry.crop(params['x'], params['y'], params['width'], params['height'])
+            elif operation.name == 'resize':
+                geometry.resize(params['width'], params['height'], params['maintain_aspect'])
+            elif operation.name == 'flip':
+                geometry.transpose(FLIPS[params['direction']])
+            elif quarter_turns is not None:
+                geometry.transpose(QUARTER_TURNS[quarter_turns])
+        if geometry:
+            self._add_geometry(geometry)
+
+    def _add_geometry(self, geometry: GeometryStep) -> None:
+        if not geometry.is_identity:
+            self.steps.append(geometry)
+            self._track(geometry.output_size)
+
+    def _track(self, size: Tuple[int, int]) -> None:
+        self.peak_pixels = max(self.peak_pixels, size[0] * size[1])
+
+    def decode_bounds(self) -> Tuple[Optional[int], Optional[int]]:
+        """max_width/max_height the source must be decoded at (None: full size).
+
+        Only a leading geometry step can lower the decode resolution; its box
+        is scaled to whatever size the decoder actually produces.
+        """
+        if not self.steps or not isinstance(self.steps[0], GeometryStep):
+            return None, None
+        ratio = self.steps[0].scale_ratio()
+        if ratio >= 1:
+            return None, None
+        return (max(1, math.ceil(self.source_size[0] * ratio)),
+                max(1, math.ceil(self.source_size[1] * ratio)))
+
+    def apply(self, image: Image.Image, stage=None, executor: Optional[Executor] = None) -> Image.Image:
+        """Run every step; intermediate images are closed as soon as they are replaced.
+
+        `stage(name)` is an optional context-manager factory used to time steps.
+        Filters on large images run band-parallel on `executor` when given.
+        """
+        for step in self.steps:
+            name = 'resize' if isinstance(step, GeometryStep) else 'transform'
+            run = partial(step.apply, executor=executor) if isinstance(step, FilterStep) else step.apply
+            if stage:
+                with stage(name):
+                    result = run(image)
+            else:
+                result = run(image)
+            if result is not image:
+                image.close()
+                image = result
+        return image
+
+    def describe(self) -> str:
+        return ' | '.join(step.describe() for step in self.steps) or 'identity'
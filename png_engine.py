@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+QuickUtil PNG engine
+Two things make PNGs small and cheap to write: fewer bytes per pixel and the
+right zlib settings.
+- Palette: an RGB/RGBA image that uses at most 256 colours is written as an
+  exact 8-bit palette PNG. With png_quantize=lossy, other images are
+  quantized to 256 colours (libimagequant when Pillow has it, median cut or
+  octree otherwise, optional Floyd-Steinberg dithering) and kept only if the
+  result stays above a PSNR floor.
+- zlib settings: a few compress_level/strategy pairs are tried on a sample of
+  row strips and the smallest wins, preferring the cheaper level when sizes
+  are within SIZE_TOLERANCE. Pillow picks PNG row filters itself (adaptive
+  per row), so the zlib strategy is the searchable part of the filter choice.
+"""
+
+import io
+import logging
+import zlib
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from PIL import Image, ImageChops, features
+
+from encode_effort import DEFAULT_PNG_QUANTIZE, EncodePolicy, timed_save
+from format_select import psnr
+
+logger = logging.getLogger(__name__)
+
+PALETTE_COLORS = 256
+# Lossy quantization is kept only at or above this PSNR (dB)
+QUANTIZE_MIN_PSNR = 40.0
+
+# Row strips sampled for the settings search
+SAMPLE_STRIPS = 8
+SAMPLE_STRIP_ROWS = 16
+# Sample sizes within this fraction of the best count as a tie
+SIZE_TOLERANCE = 0.01
+
+# (compress_level, zlib strategy) pairs tried per effort tier, cheapest first
+STRATEGY_CANDIDATES = {
+    'fast': [(1, zlib.Z_DEFAULT_STRATEGY), (1, zlib.Z_RLE)],
+    'balanced': [(3, zlib.Z_RLE), (6, zlib.Z_DEFAULT_STRATEGY), (6, zlib.Z_FILTERED)],
+    'max': [(6, zlib.Z_DEFAULT_STRATEGY), (6, zlib.Z_FILTERED), (9, zlib.Z_DEFAULT_STRATEGY), (9, zlib.Z_FILTERED)],
+}
+STRATEGY_NAMES = {
+    zlib.Z_DEFAULT_STRATEGY: 'default',
+    zlib.Z_FILTERED: 'filtered',
+    zlib.Z_RLE: 'rle',
+}
+
+
+@dataclass
+class PngPlan:
+    """What encode_png() decided for one image"""
+    palette: str  # 'none', 'exact' or 'quantized'
+    compress_level: int
+    compress_type: int
+
+    def describe(self) -> str:
+        return f"palette={self.palette},level={self.compress_level},strategy={STRATEGY_NAMES[self.compress_type]}"
+
+
+def _same_pixels(a: Image.Image, b: Image.Image) -> bool:
+    return ImageChops.difference(a, b).getbbox() is None
+
+
+def exact_palette(image: Image.Image) -> Optional[Image.Image]:
+    """The image as a palette image without any pixel change, if it has <= 256 colours"""
+    if image.mode not in ('RGB', 'RGBA'):
+        return None
+    colors = image.getcolors(maxcolors=PALETTE_COLORS)
+    if colors is None:
+        return None
+    if image.mode == 'RGB':
+        # Every colour is in the palette, so nearest-colour mapping is exact
+        palette = Image.new('P', (1, 1))
+        palette.putpalette([channel for _, color in colors for channel in color])
+        quantized = image.quantize(palette=palette, dither=Image.Dither.NONE)
+        palette.close()
+        return quantized
+    quantized = image.quantize(len(colors), method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+    with quantized.convert('RGBA') as check:
+        if _same_pixels(check, image):
+            return quantized
+    quantized.close()
+    return None
+
+
+def quantize(image: Image.Image, dither: bool = True) -> Image.Image:
+    """256-colour quantization; dithering only applies to RGB input"""
+    if features.check_feature('libimagequant'):
+        method = Image.Quantize.LIBIMAGEQUANT
+    else:
+        method = Image.Quantize.FASTOCTREE if image.mode == 'RGBA' else Image.Quantize.MEDIANCUT
+    quantized = image.quantize(PALETTE_COLORS, method=method, dither=Image.Dither.NONE)
+    if dither and image.mode == 'RGB':
+        # quantize() only dithers when mapping onto a given palette
+        dithered = image.quantize(palette=quantized, dither=Image.Dither.FLOYDSTEINBERG)
+        quantized.close()
+        quantized = dithered
+    return quantized
+
+
+def row_sample(image: Image.Image) -> Image.Image:
+    """SAMPLE_STRIPS evenly spaced strips of rows, stacked into one image"""
+    strip_rows = min(SAMPLE_STRIP_ROWS, image.height)
+    strips = min(SAMPLE_STRIPS, max(1, image.height // strip_rows))
+    if strips * strip_rows >= image.height:
+        return image
+    # A crop keeps the palette and transparency info; the strips go over it
+    sample = image.crop((0, 0, image.width, strips * strip_rows))
+    step = (image.height - strip_rows) / max(1, strips - 1)
+    for index in range(strips):
+        top = round(index * step)
+        with image.crop((0, top, image.width, top + strip_rows)) as strip:
+            sample.paste(strip, (0, index * strip_rows))
+    return sample
+
+
+def choose_settings(image: Image.Image, effort: str) -> Tuple[int, int]:
+    """(compress_level, compress_type) that compresses a row sample best"""
+    candidates = STRATEGY_CANDIDATES.get(effort, STRATEGY_CANDIDATES['balanced'])
+    if len(candidates) == 1:
+        return candidates[0]
+    sample = row_sample(image)
+    sizes: List[Tuple[int, Tuple[int, int]]] = []
+    for level, strategy in candidates:
+        buffer = io.BytesIO()
+        sample.save(buffer, format='PNG', compress_level=level, compress_type=strategy)
+        sizes.append((buffer.getbuffer().nbytes, (level, strategy)))
+    if sample is not image:
+        sample.close()
+    smallest = min(size for size, _ in sizes)
+    # Candidates are listed cheapest first: take the first one that ties
+    return next(settings for size, settings in sizes if size <= smallest * (1 + SIZE_TOLERANCE))
+
+
+def prepare(image: Image.Image, mode: str = DEFAULT_PNG_QUANTIZE, dither: bool = True,
+            min_psnr: float = QUANTIZE_MIN_PSNR) -> Tuple[Image.Image, str]:
+    """Image to write (possibly a new palette image) and the palette decision"""
+    if mode == 'off':
+        return image, 'none'
+    palette = exact_palette(image)
+    if palette is not None:
+        return palette, 'exact'
+    if mode == 'lossy' and image.mode in ('RGB', 'RGBA'):
+        quantized = quantize(image, dither)
+        score = psnr(quantized, image)
+        if score >= min_psnr:
+            return quantized, 'quantized'
+        logger.info(f"🎨 Quantization rejected: {score:.1f}dB < {min_psnr}dB")
+        quantized.close()
+    return image, 'none'
+
+
+def plan_png(image: Image.Image, effort: str, mode: str = DEFAULT_PNG_QUANTIZE,
+             dither: bool = True) -> Tuple[Image.Image, PngPlan]:
+    """Palette decision plus zlib settings; the returned image may be a new one"""
+    prepared, palette = prepare(image, mode, dither)
+    level, strategy = choose_settings(prepared, effort)
+    return prepared, PngPlan(palette, level, strategy)
+
+
+def encode_png(image: Image.Image, output, policy: Optional[EncodePolicy] = None) -> PngPlan:
+    """Write `image` as PNG with the palette and zlib settings chosen for it"""
+    policy = policy or EncodePolicy()
+    effort = policy.resolve('PNG', image.width * image.height)
+    prepared, plan = plan_png(image, effort, policy.png_quantize, policy.dither)
+    try:
+        # The searched settings replace the tier's defaults (optimize would force level 9)
+        timed_save(prepared, output, 'PNG', EncodePolicy(effort=effort), optimize=False,
+                   compress_level=plan.compress_level, compress_type=plan.compress_type)
+    finally:
+        if prepared is not image:
+            prepared.close()
+    logger.info(f"🧩 PNG {image.width}x{image.height} {image.mode}: {plan.describe()}")
+    return plan
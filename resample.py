@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+QuickUtil resize engine
+Every downscale goes through resize(), which shrinks in two steps for large
+ratios: an integer box reduce (Image.reduce) down to `reducing_gap` times the
+target size, then one pass of the tier's filter. The cost of the final filter
+then depends on the output size instead of the source pixel count.
+
+Tiers, selectable per request with `resize_quality`:
+- fast: reduce down to 1.5x the target, then BICUBIC
+- balanced: reduce down to 2x the target, then LANCZOS (Image.thumbnail's default)
+- quality: reduce down to 3x the target, then LANCZOS
+- exact: a single LANCZOS pass from the source (the old behaviour)
+"""
+
+import logging
+import os
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from PIL import Image
+
+from image_decode import REDUCIBLE_MODES
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ResizeTier:
+    """Reduce gap and final filter of one quality/speed tier"""
+    name: str
+    reducing_gap: Optional[float]
+    resample: Image.Resampling
+
+
+TIERS = {
+    tier.name: tier for tier in (
+        ResizeTier('fast', 1.5, Image.Resampling.BICUBIC),
+        ResizeTier('balanced', 2.0, Image.Resampling.LANCZOS),
+        ResizeTier('quality', 3.0, Image.Resampling.LANCZOS),
+        ResizeTier('exact', None, Image.Resampling.LANCZOS),
+    )
+}
+DEFAULT_TIER = os.environ.get('RESIZE_QUALITY', 'balanced')
+
+
+def parse_tier(value: Optional[str]) -> str:
+    """Validate a `resize_quality` value, falling back to the default tier"""
+    if value is None or str(value).strip() == '':
+        return DEFAULT_TIER
+    name = str(value).strip().lower()
+    if name not in TIERS:
+        raise ValueError(f"Invalid resize_quality: {value}. Supported: {', '.join(TIERS)}")
+    return name
+
+
+def resize(image: Image.Image, size: Tuple[int, int], tier: str = DEFAULT_TIER,
+           box: Optional[Tuple[float, float, float, float]] = None) -> Image.Image:
+    """Resample `box` of the image (the whole image by default) to `size`.
+
+    Palette and bilevel images are converted first, Pillow would otherwise
+    fall back to NEAREST. The source image is left open.
+    """
+    settings = TIERS[tier]
+    source = image
+    if image.mode in ('1', 'P'):
+        image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+    # Image.reduce only handles 8-bit and 32-bit modes
+    reducing_gap = settings.reducing_gap if image.mode in REDUCIBLE_MODES else None
+    result = image.resize(size, settings.resample, box=box, reducing_gap=reducing_gap)
+    if image is not source:
+        image.close()
+    return result
+
+
+def fit(image: Image.Image, size: Tuple[int, int], tier: str = DEFAULT_TIER) -> Image.Image:
+    """resize() that returns the image itself when it already has `size`"""
+    if image.size == tuple(size):
+        return image
+    return resize(image, size, tier)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+QuickUtil processed-image result cache
+Content-addressed cache for encoded outputs, keyed by the SHA-256 of the input
+plus the normalized processing parameters. Two tiers:
+- an in-process LRU with a byte budget
+- an on-disk tier shared by every gunicorn worker: an ArtifactStore with TTL
+  expiry and a byte quota enforced by LRU eviction
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Dict, Iterable, Optional
+
+from artifact_store import ArtifactStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_FOLDER = os.path.join(tempfile.gettempdir(), 'quickutil_processed')
+DEFAULT_MEMORY_BUDGET = int(os.environ.get('RESULT_CACHE_MEMORY_MB', 64)) * 1024 * 1024
+DEFAULT_DISK_BUDGET = int(os.environ.get('RESULT_CACHE_DISK_MB', 512)) * 1024 * 1024
+DEFAULT_TTL = int(os.environ.get('RESULT_CACHE_TTL', 600))  # 10 minutes
+
+
+def hash_stream(stream: BinaryIO) -> str:
+    """SHA-256 of a seekable stream, leaving it rewound"""
+    stream.seek(0)
+    digest = hashlib.file_digest(stream, 'sha256').hexdigest()
+    stream.seek(0)
+    return digest
+
+
+@dataclass
+class CachedResult:
+    """An encoded image plus the metadata needed to rebuild the response"""
+    data: bytes
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    expires_at: float = 0.0
+
+
+class ResultCache:
+    """Two-tier (memory LRU + shared disk) cache for processed images"""
+
+    def __init__(self, folder: str = DEFAULT_CACHE_FOLDER, memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                 disk_budget: int = DEFAULT_DISK_BUDGET, ttl: int = DEFAULT_TTL):
+        self.folder = folder
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, CachedResult]' = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {
+            'hits_memory': 0,
+            'hits_disk': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions_memory': 0,
+            'evictions_disk': 0,
+            'expirations': 0,
+        }
+        self.store = ArtifactStore(folder, disk_budget, ttl)
+
+    @staticmethod
+    def make_key(source_hash: str, **params: Any) -> str:
+        """Cache key for an input hash and its processing parameters.
+
+        Parameters are normalized so that equivalent requests share a key:
+        None values are dropped and strings are lower-cased.
+        """
+        normalized = {}
+        for name, value in params.items():
+            if value is None:
+                continue
+            normalized[name] = value.lower() if isinstance(value, str) else value
+        payload = json.dumps(normalized, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(f"{source_hash}:{payload}".encode()).hexdigest()
+
+    # Memory tier
+
+    def _memory_get(self, key: str) -> Optional[CachedResult]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.time():
+            self._memory_drop(key)
+            self.counters['expirations'] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _memory_put(self, key: str, entry: CachedResult) -> None:
+        size = len(entry.data)
+        if size > self.memory_budget:
+            return
+        if key in self._entries:
+            self._memory_drop(key)
+        self._entries[key] = entry
+        self._memory_bytes += size
+        while self._memory_bytes > self.memory_budget:
+            oldest = next(iter(self._entries))
+            self._memory_drop(oldest)
+            self.counters['evictions_memory'] += 1
+
+    def _memory_drop(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._memory_bytes -= len(entry.data)
+
+    # Disk tier
+
+    def _disk_get(self, key: str) -> Optional[CachedResult]:
+        try:
+            artifact = self.store.get(key)
+        except (OSError, sqlite3.Error, ValueError) as e:
+            logger.warning(f"⚠️ Result cache disk read failed: {e}")
+            return None
+        if artifact is None:
+            return None
+        return CachedResult(artifact.data, artifact.metadata, artifact.expires_at)
+
+    def _disk_put(self, key: str, entry: CachedResult) -> None:
+        try:
+            evicted = self.store.put(key, entry.data, entry.metadata)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"⚠️ Result cache disk write failed: {e}")
+            return
+        if evicted:
+            with self._lock:
+                self.counters['evictions_disk'] += evicted
+
+    def sweep_disk(self) -> int:
+        """Delete the expired disk entries (run by the elected Sweeper); returns how many"""
+        expired = self.store.expire()
+        with self._lock:
+            self.counters['expirations'] += expired
+        return expired
+
+    # Public API
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        """Look a result up in memory, then on disk"""
+        return self.get_any([key])
+
+    def get_any(self, keys: Iterable[str]) -> Optional[CachedResult]:
+        """The first of several acceptable keys that has a result (one miss if none has)"""
+        for key in keys:
+            with self._lock:
+                entry = self._memory_get(key)
+                if entry is not None:
+                    self.counters['hits_memory'] += 1
+                    return entry
+
+            entry = self._disk_get(key)
+            if entry is not None:
+                with self._lock:
+                    self.counters['hits_disk'] += 1
+                    self._memory_put(key, entry)
+                return entry
+        with self._lock:
+            self.counters['misses'] += 1
+        return None
+
+    def put(self, key: str, data: bytes, metadata: Optional[Dict[str, Any]] = None) -> None:
+        """Store an encoded result in both tiers"""
+        entry = CachedResult(bytes(data), metadata or {}, time.time() + self.ttl)
+        with self._lock:
+            self._memory_put(key, entry)
+            self.counters['stores'] += 1
+        self._disk_put(key, entry)
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters and current tier usage"""
+        disk = self.store.usage()
+        with self._lock:
+            return {
+                **self.counters,
+                'memory_entries': len(self._entries),
+                'memory_bytes': self._memory_bytes,
+                'memory_budget': self.memory_budget,
+                'disk_entries': disk['entries'],
+                'disk_bytes': disk['bytes'],
+                'disk_budget': self.disk_budget,
+                'ttl': self.ttl,
+            }
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+QuickUtil target-file-size search
+Finds the highest encoder quality (and, if needed, a downscale) whose output
+fits a byte budget. Candidate qualities are ranked on a small proxy made of
+tiles sampled from the image, whose sizes are calibrated against every full
+encode, so the search converges in a bounded number of full-resolution encodes.
+"""
+
+import io
+import logging
+import math
+import re
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+from PIL import Image
+
+import resample
+
+logger = logging.getLogger(__name__)
+
+# Proxy images are mosaics of PROXY_TILE-sized tiles, about PROXY_PIXELS in total
+PROXY_PIXELS = 256 * 1024
+PROXY_TILE = 64  # multiple of the 16px JPEG/WebP macroblock
+MIN_QUALITY = 10
+MAX_FULL_ENCODES = 4
+MAX_DOWNSCALE_STEPS = 3
+# Leave a little headroom when predicting, encoders are not perfectly monotonic
+PREDICTION_MARGIN = 0.97
+
+SIZE_UNITS = {'': 1, 'b': 1, 'kb': 1024, 'k': 1024, 'mb': 1024 * 1024, 'm': 1024 * 1024}
+
+Encoder = Callable[[Image.Image, int], io.BytesIO]
+
+
+@dataclass
+class SizeSearchResult:
+    """Outcome of a target-size search"""
+    data: io.BytesIO
+    quality: int
+    size: tuple
+    full_encodes: int
+    proxy_encodes: int
+    elapsed_ms: float
+    fits: bool
+
+
+def parse_size(value: Optional[str]) -> Optional[int]:
+    """Parse '204800', '200kb' or '1.5MB' into a byte count"""
+    if value is None or str(value).strip() == '':
+        return None
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmKM]?[bB]?)\s*', str(value))
+    if not match:
+        raise ValueError(f'Invalid target size: {value}')
+    size = int(float(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+    if size <= 0:
+        raise ValueError(f'Invalid target size: {value}')
+    return size
+
+
+def make_proxy(image: Image.Image) -> Image.Image:
+    """Build a ~PROXY_PIXELS mosaic of full-resolution tiles sampled across the image.
+
+    Tiles keep the native pixel density, so the proxy's bytes per pixel track
+    the full image far better than a downscaled copy, which smooths away the
+    fine detail that dominates encoded size.
+    """
+    pixels = image.width * image.height
+    if pixels <= PROXY_PIXELS:
+        return image
+    grid = max(1, int(math.sqrt(PROXY_PIXELS) // PROXY_TILE))
+    cols = min(grid, max(1, image.width // PROXY_TILE))
+    rows = min(grid, max(1, image.height // PROXY_TILE))
+    tile_w = min(PROXY_TILE, image.width)
+    tile_h = min(PROXY_TILE, image.height)
+    proxy = Image.new(image.mode, (cols * tile_w, rows * tile_h))
+    if image.mode == 'P':
+        proxy.putpalette(image.getpalette())
+    for row in range(rows):
+        top = (image.height - tile_h) * row // max(1, rows - 1) if rows > 1 else (image.height - tile_h) // 2
+        for col in range(cols):
+            left = (image.width - tile_w) * col // max(1, cols - 1) if cols > 1 else (image.width - tile_w) // 2
+            proxy.paste(image.crop((left, top, left + tile_w, top + tile_h)), (col * tile_w, row * tile_h))
+    return proxy
+
+
+def _encoded_size(buffer: io.BytesIO) -> int:
+    return buffer.getbuffer().nbytes
+
+
+def fit_to_size(image: Image.Image, encode: Encoder, target_bytes: int,
+                max_quality: int = 95, lossy: bool = True,
+                allow_downscale: bool = True) -> SizeSearchResult:
+    """Encode the image at the highest quality whose output is <= target_bytes.
+
+    `encode(image, quality)` must return a BytesIO. For lossless encoders only
+    the downscale step applies. When nothing fits, the smallest result found
+    is returned with fits=False.
+    """
+    started = time.perf_counter()
+    max_quality = max(MIN_QUALITY, min(100, max_quality))
+    min_quality = MIN_QUALITY if lossy else max_quality
+
+    proxy = make_proxy(image)
+    proxy_sizes: Dict[int, int] = {}
+
+    def proxy_size(quality: int) -> int:
+        if quality not in proxy_sizes:
+            proxy_sizes[quality] = _encoded_size(encode(proxy, quality))
+        return proxy_sizes[quality]
+
+    # Full-size bytes per proxy byte; starts from the pixel ratio and is
+    # recalibrated after every full encode
+    correction = (image.width * image.height) / (proxy.width * proxy.height)
+    low, high = min_quality, max_quality
+    best = None          # (quality, buffer) of the best fitting full encode
+    smallest = None      # (quality, buffer) of the smallest full encode
+    full_encodes = 0
+
+    while low <= high and full_encodes < MAX_FULL_ENCODES:
+        # Highest quality in [low, high] predicted to fit, found on the proxy
+        lo, hi, quality = low, high, low
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if proxy_size(mid) * correction <= target_bytes * PREDICTION_MARGIN:
+                quality, lo = mid, mid + 1
+            else:
+                hi = mid - 1
+
+        buffer = encode(image, quality)
+        full_encodes += 1
+        size = _encoded_size(buffer)
+        correction = size / proxy_size(quality)
+        if smallest is None or size < _encoded_size(smallest[1]):
+            smallest = (quality, buffer)
+
+        if size <= target_bytes:
+            best = (quality, buffer)
+            low = quality + 1
+            if size >= target_bytes * PREDICTION_MARGIN:
+                break  # close enough, another encode would gain almost nothing
+        else:
+            high = quality - 1
+
+    result_image = image
+    if best is None and allow_downscale:
+        # Even the lowest quality is too big: shrink the image, keeping the
+        # lowest quality tried, with area scaled to the byte overshoot
+        quality, buffer = smallest
+        for _ in range(MAX_DOWNSCALE_STEPS):
+            scale = math.sqrt(target_bytes / _encoded_size(buffer)) * PREDICTION_MARGIN
+            size = (max(1, int(result_image.width * scale)), max(1, int(result_image.height * scale)))
+            if result_image is not image:
+                result_image.close()
+            result_image = resample.resize(image, size)
+            buffer = encode(result_image, quality)
+            full_encodes += 1
+            if _encoded_size(buffer) <= target_bytes:
+                best = (quality, buffer)
+                break
+        smallest = (quality, buffer)
+
+    fits = best is not None
+    quality, buffer = best if fits else smallest
+    result = SizeSearchResult(
+        data=buffer,
+        quality=quality,
+        size=result_image.size,
+        full_encodes=full_encodes,
+        proxy_encodes=len(proxy_sizes),
+        elapsed_ms=(time.perf_counter() - started) * 1000,
+        fits=fits
+    )
+    if result_image is not image:
+        result_image.close()
+    if proxy is not image:
+        proxy.close()
+
+    logger.info(f"🎯 Target size {target_bytes}: quality={result.quality}, size={_encoded_size(buffer)}, "
+                f"full_encodes={result.full_encodes}, proxy_encodes={result.proxy_encodes}, "
+                f"{result.elapsed_ms:.0f}ms, fits={result.fits}")
+    return result
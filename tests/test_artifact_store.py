@@ -0,0 +1,60 @@
+"""Sweeper election across apps that share one artifact store"""
+
+import pytest
+
+from artifact_store import SWEEPER_LEASE, ArtifactStore, Sweeper
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(str(tmp_path / 'cache'), quota=1024 * 1024, ttl=60)
+
+
+def sweeper(store, owner, **kwargs):
+    swept = Sweeper(store, store.expire, **kwargs)
+    swept.owner = owner
+    return swept
+
+
+def test_tasks_run_while_another_app_holds_the_sweeper_lease(store, tmp_path):
+    originals = ArtifactStore(str(tmp_path / 'originals'), quota=1024 * 1024, ttl=60)
+    runs = []
+
+    def purge():
+        runs.append(True)
+
+    # image_compression_api: same store, no tasks; elected first
+    plain = sweeper(store, 'api')
+    # app: the same store plus the originals and job cleanups
+    with_tasks = sweeper(store, 'app', tasks=[originals.expire, purge], stores=[originals])
+    plain.run_once()
+    with_tasks.run_once()
+
+    assert plain.leader and not with_tasks.leader
+    assert with_tasks.tasks_leader
+    assert runs == [True]
+    assert store.lease_owner(SWEEPER_LEASE) == 'api'
+
+
+def test_tasks_are_elected_once_among_processes_with_them(store):
+    runs = []
+
+    def purge():
+        runs.append(True)
+
+    first = sweeper(store, 'worker-1', tasks=[purge])
+    second = sweeper(store, 'worker-2', tasks=[purge])
+    first.run_once()
+    second.run_once()
+
+    assert first.tasks_leader and not second.tasks_leader
+    assert runs == [True]
+
+
+def test_wakes_for_the_task_stores_next_expiry(store, tmp_path):
+    originals = ArtifactStore(str(tmp_path / 'originals'), quota=1024 * 1024, ttl=60)
+    originals.put('original', b'x', ttl=5)
+
+    delay = sweeper(store, 'app', tasks=[originals.expire], stores=[originals]).run_once()
+
+    assert 0 < delay <= 5
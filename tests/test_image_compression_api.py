@@ -0,0 +1,50 @@
+"""/compress of the standalone API rejects unprocessable inputs from their header"""
+
+import io
+import struct
+import zlib
+
+import pytest
+from PIL import Image
+
+import image_compression_api as api
+
+
+@pytest.fixture
+def client():
+    return api.app.test_client()
+
+
+def png_header(width, height):
+    """A PNG that declares its size but carries a single row of pixels"""
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    idat = zlib.compress(b'\0' + b'\0' * 3 * width)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', ihdr) + chunk(b'IDAT', idat) + chunk(b'IEND', b'')
+
+
+def test_decompression_bomb_is_refused_before_decode(client):
+    side = int((2 * Image.MAX_IMAGE_PIXELS) ** 0.5) + 1
+    response = client.post('/compress', data={'image': (io.BytesIO(png_header(side, side)), 'bomb.png')})
+    assert response.status_code == 413
+
+
+def test_unsupported_format_is_refused_before_decode(client):
+    # A valid image, but this app registers no HEIF decoder
+    pillow_heif = pytest.importorskip('pillow_heif')
+    heif = pillow_heif.from_pillow(Image.new('RGB', (32, 32)))
+    buffer = io.BytesIO()
+    heif.save(buffer, format='HEIF')
+    response = client.post('/compress', data={'image': (io.BytesIO(buffer.getvalue()), 'photo.heic')})
+    assert response.status_code == 415
+    assert 'Unsupported image format' in response.get_json()['error']
+
+
+def test_image_within_limits_is_compressed(client):
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 24), (200, 40, 40)).save(buffer, 'PNG')
+    response = client.post('/compress', data={'image': (io.BytesIO(buffer.getvalue()), 'small.png'), 'format': 'JPEG'})
+    assert response.status_code == 200
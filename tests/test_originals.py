@@ -0,0 +1,79 @@
+"""Upload-by-hash: a held original is only reachable with a source token"""
+
+import hashlib
+import io
+import os
+
+import pytest
+from PIL import Image
+
+import app as quickutil
+
+
+@pytest.fixture
+def client():
+    return quickutil.app.test_client()
+
+
+@pytest.fixture
+def upload():
+    buffer = io.BytesIO()
+    # Random pixels, so every run announces a file the server has not seen
+    Image.frombytes('RGB', (64, 48), os.urandom(64 * 48 * 3)).save(buffer, 'PNG')
+    data = buffer.getvalue()
+    return data, hashlib.sha256(data).hexdigest()
+
+
+def preflight(client, data, digest, **fields):
+    return client.post('/uploads/preflight', data={'sha256': digest, 'size': len(data), **fields}).get_json()
+
+
+def prove(client, data, digest):
+    challenge = preflight(client, data, digest)
+    offset, length = challenge['offset'], challenge['length']
+    proof = hashlib.sha256(challenge['challenge'].encode() + data[offset:offset + length]).hexdigest()
+    return preflight(client, data, digest, challenge=challenge['challenge'], proof=proof)
+
+
+def keep(client, data, digest):
+    token = prove(client, data, digest)['upload_token']
+    response = client.post('/compress', data={'file': (io.BytesIO(data), 'secret.png'), 'upload_token': token})
+    assert response.status_code == 200
+    return response.headers['X-Source-Token']
+
+
+def test_bare_digest_is_refused(client, upload):
+    data, digest = upload
+    keep(client, data, digest)
+
+    response = client.post('/compress', data={'source': digest})
+    assert response.status_code == 400
+    assert response.mimetype == 'application/json'
+
+    # A digest posing as a token is as unknown as any other token
+    as_token = client.post('/compress', data={'source_token': digest})
+    unknown = client.post('/compress', data={'source_token': '0' * 32})
+    assert as_token.status_code == unknown.status_code == 404
+    assert as_token.get_json() == unknown.get_json()
+
+
+def test_unproven_preflight_gets_no_source_token(client, upload):
+    data, digest = upload
+    keep(client, data, digest)
+
+    challenge = preflight(client, data, digest)
+    answer = preflight(client, data, digest, challenge=challenge['challenge'], proof='0' * 64)
+    assert answer['status'] == 'upload'
+    assert 'source_token' not in answer
+
+
+def test_source_token_reaches_the_held_original(client, upload):
+    data, digest = upload
+    upload_grant = keep(client, data, digest)
+
+    answer = prove(client, data, digest)
+    assert answer['status'] == 'held'
+    for token in (upload_grant, answer['source_token']):
+        response = client.post('/compress', data={'source_token': token, 'format': 'png'})
+        assert response.status_code == 200
+        assert response.mimetype == 'image/png'
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+QuickUtil tiled filters
+Runs the pipeline filters (blur, sharpness, brightness, contrast, saturation)
+on horizontal bands of a large image in parallel. Each band is read with a
+halo of extra rows on both sides, sized from the filter's reach, so the rows
+it keeps never see the band edge; the kept rows are pasted straight into the
+one preallocated output image. The result is byte-identical to filtering the
+whole image in one call:
+- brightness and saturation are per pixel and need no halo
+- contrast blends towards the mean grey of the whole image, so the mean is
+  taken from per-band histograms first
+- sharpness blends with a 3x3 SMOOTH, so a 1 row halo
+- blur is Pillow's three-pass box blur, each pass reaching floor(r) + 1 rows
+Pillow releases the GIL inside these kernels, so a thread pool is enough.
+"""
+
+import logging
+import math
+from concurrent.futures import Executor
+from typing import List, Optional, Tuple
+
+from PIL import Image, ImageEnhance, ImageFilter
+
+logger = logging.getLogger(__name__)
+
+ENHANCERS = {
+    'brightness': ImageEnhance.Brightness,
+    'contrast': ImageEnhance.Contrast,
+    'saturation': ImageEnhance.Color,
+    'sharpness': ImageEnhance.Sharpness,
+}
+# Images smaller than this are filtered in one call
+TILE_MIN_PIXELS = 4_000_000
+# Target size of one band
+BAND_PIXELS = 1_000_000
+# Passes of the box blur Pillow uses for GaussianBlur
+BLUR_PASSES = 3
+
+Band = Tuple[int, int]
+
+
+def halo_rows(name: str, value: float) -> int:
+    """Rows outside a band that can change the filter's output inside it"""
+    if name == 'blur':
+        return BLUR_PASSES * (math.floor(value) + 1)
+    if name == 'sharpness':
+        return 1
+    return 0
+
+
+def bands(height: int, width: int) -> List[Band]:
+    """(top, bottom) row ranges of about BAND_PIXELS each"""
+    rows = max(1, BAND_PIXELS // max(1, width))
+    return [(top, min(height, top + rows)) for top in range(0, height, rows)]
+
+
+def filter_image(image: Image.Image, name: str, value: float, mean: Optional[int] = None) -> Image.Image:
+    """The filter on a whole image (or a band, given the contrast `mean` of the whole image)"""
+    if name == 'blur':
+        return image.filter(ImageFilter.GaussianBlur(value))
+    if name == 'contrast' and mean is not None:
+        # ImageEnhance.Contrast, with the mean taken from the full image
+        degenerate = Image.new('L', image.size, mean)
+        if degenerate.mode != image.mode:
+            degenerate = degenerate.convert(image.mode)
+        if 'A' in image.getbands():
+            degenerate.putalpha(image.getchannel('A'))
+        try:
+            return Image.blend(degenerate, image, value)
+        finally:
+            degenerate.close()
+    return ENHANCERS[name](image).enhance(value)
+
+
+def _band_histogram(image: Image.Image, band: Band) -> List[int]:
+    with image.crop((0, band[0], image.width, band[1])) as part:
+        if part.mode == 'L':
+            return part.histogram()
+        with part.convert('L') as gray:
+            return gray.histogram()
+
+
+def grey_mean(image: Image.Image, executor: Executor, parts: List[Band]) -> int:
+    """Rounded mean of the 'L' conversion, as ImageEnhance.Contrast computes it"""
+    histogram = [0] * 256
+    for part in executor.map(lambda band: _band_histogram(image, band), parts):
+        histogram = [a + b for a, b in zip(histogram, part)]
+    total = sum(histogram)
+    return int(sum(level * count for level, count in enumerate(histogram)) / total + 0.5)
+
+
+def _filter_band(image: Image.Image, band: Band, name: str, value: float, halo: int,
+                 mean: Optional[int]) -> Image.Image:
+    top, bottom = band
+    upper, lower = max(0, top - halo), min(image.height, bottom + halo)
+    with image.crop((0, upper, image.width, lower)) as source:
+        result = filter_image(source, name, value, mean)
+    with result:
+        return result.crop((0, top - upper, image.width, bottom - upper))
+
+
+def apply_filter(image: Image.Image, name: str, value: float, executor: Optional[Executor] = None) -> Image.Image:
+    """Filter `image`, band-parallel on `executor` when it is large enough"""
+    if executor is None or image.width * image.height < TILE_MIN_PIXELS:
+        return filter_image(image, name, value)
+    parts = bands(image.height, image.width)
+    if len(parts) < 2:
+        return filter_image(image, name, value)
+    # Bands are cropped from several threads; make sure nothing is left to load
+    image.load()
+    mean = grey_mean(image, executor, parts) if name == 'contrast' else None
+    halo = halo_rows(name, value)
+    output = Image.new(image.mode, image.size)
+    results = executor.map(lambda band: _filter_band(image, band, name, value, halo, mean), parts)
+    for (top, _), result in zip(parts, results):
+        with result:
+            if top == 0:
+                # Same info (icc_profile etc.) as the single-call result
+                output.info = result.info.copy()
+            output.paste(result, (0, top))
+    logger.info(f"🧱 {name}({value:g}) on {image.width}x{image.height} in {len(parts)} bands (halo {halo})")
+    return output
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+QuickUtil responsive variants
+Builds the widths of a srcset from a single decode: the widest variant is
+resampled from the decoded image and every narrower one from the variant
+before it, so each resize pass reads the smallest source that still covers
+it. Widths above the source width are clamped (never upscaled).
+"""
+
+import logging
+from contextlib import nullcontext
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+import resample
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WIDTHS = (320, 640, 960, 1280, 1920)
+MAX_WIDTHS = 8
+MAX_FORMATS = 4
+
+Size = Tuple[int, int]
+
+
+def parse_widths(value: Optional[str]) -> List[int]:
+    """Parse '320,640,1280' into distinct widths, widest first"""
+    if value is None or str(value).strip() == '':
+        return sorted(DEFAULT_WIDTHS, reverse=True)
+    try:
+        widths = {int(item) for item in str(value).split(',') if item.strip()}
+    except ValueError:
+        raise ValueError(f'Invalid widths: {value}')
+    if not widths or min(widths) < 1:
+        raise ValueError(f'Invalid widths: {value}')
+    if len(widths) > MAX_WIDTHS:
+        raise ValueError(f'At most {MAX_WIDTHS} widths are allowed')
+    return sorted(widths, reverse=True)
+
+
+def variant_sizes(source_size: Size, widths: Sequence[int]) -> List[Size]:
+    """Output sizes for the requested widths, widest first, without duplicates"""
+    sizes = []
+    for width in sorted(widths, reverse=True):
+        width = min(width, source_size[0])
+        size = (width, max(1, round(source_size[1] * width / source_size[0])))
+        if size not in sizes:
+            sizes.append(size)
+    return sizes
+
+
+def pyramid_pixels(sizes: Sequence[Size]) -> int:
+    """Pixels held when every level is alive at once, for memory admission"""
+    return sum(width * height for width, height in sizes)
+
+
+def build_pyramid(image: Image.Image, sizes: Sequence[Size], tier: str = resample.DEFAULT_TIER,
+                  stage=None) -> Iterator[Tuple[Size, Image.Image]]:
+    """Yield (size, image) from the widest level down, each resampled from the previous.
+
+    The first level may be `image` itself. Levels are not closed here; the
+    caller owns them, since encodes of a level can still be running while
+    the next one is built. `stage(name)` optionally times the resizes.
+    """
+    level = image
+    for size in sizes:
+        with stage('resize') if stage else nullcontext():
+            level = resample.fit(level, size, tier)
+        yield size, level
+
+
+def srcset(variants: Sequence[Dict]) -> Dict[str, str]:
+    """srcset attribute value per format, from manifest entries"""
+    by_format: Dict[str, List[str]] = {}
+    for variant in sorted(variants, key=lambda v: v['width']):
+        by_format.setdefault(variant['format'], []).append(f"{variant['name']} {variant['width']}w")
+    return {fmt: ', '.join(entries) for fmt, entries in by_format.items()}
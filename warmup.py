@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+QuickUtil process startup
+With gunicorn's preload_app (see gunicorn.conf.py) the app module is imported
+once in the master: the codec plugins it needs are loaded and warmed there by
+encoding and decoding a tiny image per format, and forked workers share that
+state copy-on-write. Pillow plugins that are not listed are still only loaded
+on first use. Threads do not survive fork, so background threads are started
+through start_after_fork(), which defers them to each worker when preloaded.
+"""
+
+import importlib
+import io
+import logging
+import os
+import time
+from typing import Callable, Dict, List, Sequence
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Set by gunicorn.conf.py before the app is imported in the master
+PRELOADED = os.environ.get('QUICKUTIL_PRELOAD') == '1'
+# Pillow plugins for the formats the apps read and write
+PLUGINS = ('JpegImagePlugin', 'PngImagePlugin', 'WebPImagePlugin', 'GifImagePlugin',
+           'BmpImagePlugin', 'TiffImagePlugin')
+WARM_SIZE = (16, 16)
+
+_after_fork: List[Callable[[], None]] = []
+
+
+def register_heif() -> bool:
+    """Register the pillow-heif opener; False when it is not installed"""
+    try:
+        import pillow_heif
+    except ImportError:
+        return False
+    pillow_heif.register_heif_opener()
+    return True
+
+
+def load_plugins(names: Sequence[str] = PLUGINS) -> None:
+    """Import the listed Pillow plugins now instead of on first use"""
+    for name in names:
+        try:
+            importlib.import_module(f'PIL.{name}')
+        except ImportError as e:
+            logger.warning(f"⚠️ Pillow plugin {name} unavailable: {e}")
+
+
+def warm_codecs(formats: Sequence[str]) -> Dict[str, float]:
+    """Encode and decode a tiny image per format so codec libraries are
+    loaded and initialised; returns milliseconds per format"""
+    load_plugins()
+    timings = {}
+    with Image.linear_gradient('L').resize(WARM_SIZE).convert('RGB') as sample:
+        for format in formats:
+            started = time.perf_counter()
+            try:
+                buffer = io.BytesIO()
+                sample.save(buffer, format=format)
+                buffer.seek(0)
+                with Image.open(buffer) as decoded:
+                    decoded.load()
+            except Exception as e:
+                logger.warning(f"⚠️ Warm-up of {format} failed: {e}")
+                continue
+            timings[format] = round((time.perf_counter() - started) * 1000, 2)
+    logger.info(f"🔥 Codecs warmed (ms): {timings}")
+    return timings
+
+
+def start_after_fork(start: Callable[[], None]) -> None:
+    """Run `start` now, or in every forked worker when preloaded in a gunicorn master"""
+    if PRELOADED:
+        _after_fork.append(start)
+    else:
+        start()
+
+
+def run_after_fork() -> None:
+    """Called by gunicorn's post_fork hook in each new worker"""
+    for start in _after_fork:
+        start()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+QuickUtil streaming ZIP writer
+Builds a ZIP archive (stored, no recompression) incrementally so each entry
+can be sent to the client as soon as it is ready. Only the entry being added
+is ever buffered, so memory stays flat whatever the archive size.
+"""
+
+import json
+import os
+import time
+import zipfile
+from typing import Any, List, Set
+
+
+class _ChunkBuffer:
+    """Write-only, non-seekable sink; zipfile falls back to data descriptors"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStreamWriter:
+    """Incremental ZIP writer: every call returns the bytes to send next"""
+
+    def __init__(self):
+        self._sink = _ChunkBuffer()
+        self._zip = zipfile.ZipFile(self._sink, mode='w', compression=zipfile.ZIP_STORED)
+        self._names: Set[str] = set()
+
+    def unique_name(self, name: str) -> str:
+        """Archive name for an entry, suffixed with _1, _2... on collisions"""
+        base, ext = os.path.splitext(name)
+        candidate, counter = name, 1
+        while candidate in self._names:
+            candidate = f"{base}_{counter}{ext}"
+            counter += 1
+        return candidate
+
+    def add(self, name: str, data: bytes) -> bytes:
+        """Append a stored entry and return the archive bytes it produced"""
+        name = self.unique_name(name)
+        self._names.add(name)
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        self._zip.writestr(info, data)
+        return self._sink.drain()
+
+    def add_json(self, name: str, payload: Any) -> bytes:
+        """Append a JSON document (e.g. a manifest) as a stored entry"""
+        return self.add(name, json.dumps(payload, indent=2).encode('utf-8'))
+
+    def close(self) -> bytes:
+        """Finish the archive and return the central directory bytes"""
+        self._zip.close()
+        return self._sink.drain()